@@ -5,8 +5,11 @@ from datetime import datetime
 from pydantic import BaseModel
 import logging
 
-from ...core.database import supabase_client
-from ...services.client_monitoring_service import ClientMonitoringService
+from ...core.repository import repository
+from ...core.config import settings as app_settings
+from ...services.keyword_matcher import keyword_matcher_cache
+from ...services.scheduler_service import scheduler_service
+from ...services.task_supervisor import task_supervisor
 
 logger = logging.getLogger(__name__)
 
@@ -33,9 +36,6 @@ class MonitoringSettingsUpdate(BaseModel):
 class ClientStatusUpdate(BaseModel):
     status: str  # 'new', 'contacted', 'ignored', 'converted'
 
-# Инициализируем сервис мониторинга
-monitoring_service = ClientMonitoringService()
-
 # ==================== PRODUCT TEMPLATES ====================
 
 @router.post("/product-templates")
@@ -47,18 +47,19 @@ async def create_product_template(template: ProductTemplateCreate, user_id: int
             raise HTTPException(status_code=400, detail="Keywords list cannot be empty")
         
         # Создаем запись
-        result = supabase_client.table('product_templates').insert({
+        result = await repository.insert_product_template({
             'user_id': user_id,
             'name': template.name,
             'keywords': template.keywords,
             'is_active': True,
             'created_at': datetime.now().isoformat(),
             'updated_at': datetime.now().isoformat()
-        }).execute()
+        })
         
-        if result.data:
+        if result:
+            keyword_matcher_cache.invalidate(user_id)
             logger.info(f"Created product template: {template.name}")
-            return {"status": "success", "data": result.data[0]}
+            return {"status": "success", "data": result}
         else:
             raise HTTPException(status_code=400, detail="Failed to create template")
             
@@ -70,9 +71,9 @@ async def create_product_template(template: ProductTemplateCreate, user_id: int
 async def get_product_templates(user_id: int = 1):
     """Получить все шаблоны продуктов пользователя"""
     try:
-        result = supabase_client.table('product_templates').select('*').eq('user_id', user_id).order('created_at', desc=True).execute()
+        templates = await repository.list_product_templates(user_id)
         
-        return {"status": "success", "data": result.data}
+        return {"status": "success", "data": templates}
         
     except Exception as e:
         logger.error(f"Error fetching product templates: {str(e)}")
@@ -96,11 +97,12 @@ async def update_product_template(template_id: int, template: ProductTemplateUpd
         if template.is_active is not None:
             update_data['is_active'] = template.is_active
         
-        result = supabase_client.table('product_templates').update(update_data).eq('id', template_id).eq('user_id', user_id).execute()
+        result = await repository.update_product_template(template_id, user_id, update_data)
         
-        if result.data:
+        if result:
+            keyword_matcher_cache.invalidate(user_id)
             logger.info(f"Updated product template {template_id}")
-            return {"status": "success", "data": result.data[0]}
+            return {"status": "success", "data": result}
         else:
             raise HTTPException(status_code=404, detail="Template not found")
             
@@ -112,9 +114,10 @@ async def update_product_template(template_id: int, template: ProductTemplateUpd
 async def delete_product_template(template_id: int, user_id: int = 1):
     """Удалить шаблон продукта"""
     try:
-        result = supabase_client.table('product_templates').delete().eq('id', template_id).eq('user_id', user_id).execute()
+        result = await repository.delete_product_template(template_id, user_id)
         
-        if result.data:
+        if result:
+            keyword_matcher_cache.invalidate(user_id)
             logger.info(f"Deleted product template {template_id}")
             return {"status": "success", "message": "Template deleted"}
         else:
@@ -130,10 +133,10 @@ async def delete_product_template(template_id: int, user_id: int = 1):
 async def get_monitoring_settings(user_id: int = 1):
     """Получить настройки мониторинга пользователя"""
     try:
-        result = supabase_client.table('monitoring_settings').select('*').eq('user_id', user_id).execute()
+        result = await repository.get_monitoring_settings(user_id)
         
-        if result.data:
-            return {"status": "success", "data": result.data[0]}
+        if result:
+            return {"status": "success", "data": result}
         else:
             # Создаем настройки по умолчанию, если их нет
             default_settings = {
@@ -148,8 +151,8 @@ async def get_monitoring_settings(user_id: int = 1):
                 'updated_at': datetime.now().isoformat()
             }
             
-            create_result = supabase_client.table('monitoring_settings').insert(default_settings).execute()
-            return {"status": "success", "data": create_result.data[0]}
+            create_result = await repository.insert_monitoring_settings(default_settings)
+            return {"status": "success", "data": create_result}
             
     except Exception as e:
         logger.error(f"Error fetching monitoring settings: {str(e)}")
@@ -178,11 +181,13 @@ async def update_monitoring_settings(settings: MonitoringSettingsUpdate, user_id
             update_data['is_active'] = settings.is_active
         
         # Обновляем или создаем настройки
-        result = supabase_client.table('monitoring_settings').update(update_data).eq('user_id', user_id).execute()
+        result = await repository.update_monitoring_settings(user_id, update_data)
         
-        if result.data:
+        if result:
+            # Планировщик перестроит расписание без ожидания пересинхронизации
+            scheduler_service.mark_settings_changed()
             logger.info(f"Updated monitoring settings for user {user_id}")
-            return {"status": "success", "data": result.data[0]}
+            return {"status": "success", "data": result}
         else:
             raise HTTPException(status_code=404, detail="Settings not found")
             
@@ -194,15 +199,24 @@ async def update_monitoring_settings(settings: MonitoringSettingsUpdate, user_id
 async def start_monitoring(user_id: int = 1):
     """Запустить мониторинг для пользователя"""
     try:
-        # Включаем мониторинг в настройках
-        await update_monitoring_settings(MonitoringSettingsUpdate(is_active=True), user_id)
+        # Включаем мониторинг в настройках; сброс last_monitoring_check ставит
+        # первый прогон на сейчас. Выполняет его планировщик (в API или воркере),
+        # отдельных циклов на пользователя нет.
+        result = await repository.update_monitoring_settings(user_id, {
+            'is_active': True,
+            'last_monitoring_check': None,
+            'updated_at': datetime.now().isoformat()
+        })
+        if not result:
+            raise HTTPException(status_code=404, detail="Settings not found")
         
-        # Запускаем сервис мониторинга
-        await monitoring_service.start_monitoring(user_id)
+        scheduler_service.mark_settings_changed()
         
         logger.info(f"Started monitoring for user {user_id}")
         return {"status": "success", "message": "Monitoring started"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error starting monitoring: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -212,18 +226,42 @@ async def stop_monitoring(user_id: int = 1):
     """Остановить мониторинг для пользователя"""
     try:
         # Выключаем мониторинг в настройках
-        await update_monitoring_settings(MonitoringSettingsUpdate(is_active=False), user_id)
+        result = await repository.update_monitoring_settings(user_id, {
+            'is_active': False,
+            'updated_at': datetime.now().isoformat()
+        })
+        if not result:
+            raise HTTPException(status_code=404, detail="Settings not found")
         
-        # Останавливаем сервис мониторинга
-        await monitoring_service.stop_monitoring(user_id)
+        # Планировщик уберет пользователя из расписания; текущий прогон прерываем сразу
+        scheduler_service.mark_settings_changed()
+        await scheduler_service.cancel_user_run(user_id)
         
         logger.info(f"Stopped monitoring for user {user_id}")
         return {"status": "success", "message": "Monitoring stopped"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error stopping monitoring: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/monitoring/tasks")
+async def get_monitoring_tasks():
+    """Фоновые задачи мониторинга этого процесса: статус, перезапуски и тайминги"""
+    try:
+        return {
+            "status": "success",
+            "data": {
+                "scheduler_process": "api" if app_settings.RUN_SCHEDULER_IN_API else "worker",
+                "tasks": task_supervisor.get_stats()
+            }
+        }
+        
+    except Exception as e:
+        logger.error(f"Error fetching monitoring tasks: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ==================== POTENTIAL CLIENTS ====================
 
 @router.get("/potential-clients")
@@ -235,14 +273,9 @@ async def get_potential_clients(
 ):
     """Получить список найденных потенциальных клиентов"""
     try:
-        query = supabase_client.table('potential_clients').select('*').eq('user_id', user_id)
-        
-        if status:
-            query = query.eq('client_status', status)
-        
-        result = query.order('created_at', desc=True).range(offset, offset + limit - 1).execute()
+        clients = await repository.list_potential_clients(user_id, status=status, limit=limit, offset=offset)
         
-        return {"status": "success", "data": result.data}
+        return {"status": "success", "data": clients}
         
     except Exception as e:
         logger.error(f"Error fetching potential clients: {str(e)}")
@@ -257,13 +290,11 @@ async def update_client_status(client_id: int, status_update: ClientStatusUpdate
         if status_update.status not in valid_statuses:
             raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {valid_statuses}")
         
-        result = supabase_client.table('potential_clients').update({
-            'client_status': status_update.status
-        }).eq('id', client_id).eq('user_id', user_id).execute()
+        result = await repository.update_potential_client_status(client_id, user_id, status_update.status)
         
-        if result.data:
+        if result:
             logger.info(f"Updated client {client_id} status to {status_update.status}")
-            return {"status": "success", "data": result.data[0]}
+            return {"status": "success", "data": result}
         else:
             raise HTTPException(status_code=404, detail="Client not found")
             
@@ -276,20 +307,17 @@ async def get_monitoring_stats(user_id: int = 1):
     """Получить статистику мониторинга"""
     try:
         # Общее количество найденных клиентов
-        total_result = supabase_client.table('potential_clients').select('id', count='exact').eq('user_id', user_id).execute()
-        total_clients = total_result.count or 0
+        total_clients = await repository.count_potential_clients(user_id)
         
         # Количество по статусам
         status_stats = {}
         for status in ['new', 'contacted', 'ignored', 'converted']:
-            status_result = supabase_client.table('potential_clients').select('id', count='exact').eq('user_id', user_id).eq('client_status', status).execute()
-            status_stats[status] = status_result.count or 0
+            status_stats[status] = await repository.count_potential_clients(user_id, status=status)
         
         # Статистика за последние 7 дней
         from datetime import datetime, timedelta
         week_ago = (datetime.now() - timedelta(days=7)).isoformat()
-        week_result = supabase_client.table('potential_clients').select('id', count='exact').eq('user_id', user_id).gte('created_at', week_ago).execute()
-        clients_this_week = week_result.count or 0
+        clients_this_week = await repository.count_potential_clients(user_id, since=week_ago)
         
         return {
             "status": "success",
@@ -1,8 +1,9 @@
 # backend/app/api/v1/telegram.py
 from fastapi import APIRouter, HTTPException, Depends, Query, Body
+from fastapi.responses import StreamingResponse
 from typing import List, Dict, Any, Optional
 from ...services.telegram_service import TelegramService
-from ...core.database import supabase_client
+from ...core.repository import repository
 from ...core.config import settings
 from datetime import datetime, timedelta, timezone
 from ...services.openai_service import OpenAIService
@@ -29,16 +30,16 @@ async def get_groups():
         logger.debug(f"Supabase URL: {settings.SUPABASE_URL}")
         logger.debug(f"Using table: telegram_groups")
         
-        response = supabase_client.table('telegram_groups').select("*").execute()
+        groups = await repository.list_groups()
         
         # Логируем полный ответ
-        logger.debug(f"Supabase response: {response}")
+        logger.debug(f"Supabase response: {groups}")
         
         # Проверяем, есть ли данные
-        if not response.data:
+        if not groups:
             logger.warning("No groups found in the database")
         
-        return response.data
+        return groups
     except Exception as e:
         logger.error(f"Error fetching groups: {str(e)}")
         logger.error(traceback.format_exc())
@@ -50,14 +51,14 @@ async def get_group(group_id: str):
     try:
         logger.debug(f"Fetching details for group {group_id}")
         # Получаем информацию о группе из базы данных
-        response = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
+        response = await repository.get_group(group_id)
         
-        if not response.data:
+        if not response:
             logger.warning(f"Group with ID {group_id} not found")
             raise HTTPException(status_code=404, detail="Group not found")
         
         logger.debug(f"Successfully fetched details for group {group_id}")
-        return response.data[0]
+        return response
     except HTTPException:
         raise
     except Exception as e:
@@ -72,14 +73,14 @@ async def get_group_messages(group_id: str, limit: int = Query(100, ge=1, le=100
         logger.debug(f"Fetching FRESH messages for group {group_id} with limit {limit}")
         
         # Проверяем существование группы
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
+        group = await repository.get_group(group_id)
         
-        if not group.data:
+        if not group:
             logger.warning(f"Group with ID {group_id} not found")
             raise HTTPException(status_code=404, detail="Group not found")
         
         # Получаем телеграм ID группы
-        telegram_group_id = group.data[0]["group_id"]
+        telegram_group_id = group["group_id"]
         
         # ВСЕГДА получаем свежие сообщения из Telegram API
         logger.debug(f"Fetching fresh messages from Telegram API for group {telegram_group_id}")
@@ -92,7 +93,7 @@ async def get_group_messages(group_id: str, limit: int = Query(100, ge=1, le=100
             )
             
             logger.debug(f"Successfully fetched {len(messages_data)} fresh messages")
-            return messages_data
+            return [message.to_dict() for message in messages_data]
             
         except Exception as e:
             logger.error(f"Error retrieving messages from group {telegram_group_id}: {e}")
@@ -106,6 +107,38 @@ async def get_group_messages(group_id: str, limit: int = Query(100, ge=1, le=100
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/groups/{group_id}/messages/stream")
+async def stream_group_messages(
+    group_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    days_back: Optional[int] = Query(None, ge=1, le=365)
+):
+    """Потоковая выдача сообщений группы из Telegram API в формате NDJSON (одно сообщение на строку)"""
+    group = await repository.get_group(group_id)
+    
+    if not group:
+        logger.warning(f"Group with ID {group_id} not found")
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    telegram_group_id = group["group_id"]
+    
+    async def ndjson_lines():
+        sent = 0
+        try:
+            async for batch in telegram_service.iter_group_messages(
+                telegram_group_id,
+                limit=limit,
+                days_back=days_back
+            ):
+                sent += len(batch)
+                yield "".join(json.dumps(message.to_dict(), ensure_ascii=False) + "\n" for message in batch)
+        except Exception as e:
+            # Заголовки уже отправлены - сообщаем об ошибке последней строкой потока
+            logger.error(f"Error streaming messages from group {telegram_group_id}: {e}")
+            yield json.dumps({"error": str(e), "messages_sent": sent}, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
 # Добавить новый эндпоинт для получения сообщений из БД (если нужно):
 @router.get("/groups/{group_id}/messages/cached")
 async def get_cached_group_messages(group_id: str, limit: int = Query(100, ge=1, le=1000)):
@@ -114,22 +147,17 @@ async def get_cached_group_messages(group_id: str, limit: int = Query(100, ge=1,
         logger.debug(f"Fetching cached messages for group {group_id} with limit {limit}")
         
         # Проверяем существование группы
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
+        group = await repository.get_group(group_id)
         
-        if not group.data:
+        if not group:
             logger.warning(f"Group with ID {group_id} not found")
             raise HTTPException(status_code=404, detail="Group not found")
         
         # Получаем сообщения из базы данных
-        messages = supabase_client.table('telegram_messages')\
-            .select("*")\
-            .eq('group_id', group_id)\
-            .order('date', desc=True)\
-            .limit(limit)\
-            .execute()
+        messages = await repository.list_group_messages(group_id, limit=limit)
         
-        logger.debug(f"Fetched {len(messages.data)} cached messages from database")
-        return messages.data
+        logger.debug(f"Fetched {len(messages)} cached messages from database")
+        return messages
         
     except HTTPException:
         raise
@@ -144,14 +172,14 @@ async def get_group_moderators(group_id: str):
     try:
         logger.debug(f"Fetching moderators for group {group_id}")
         # Проверяем существование группы
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
+        group = await repository.get_group(group_id)
         
-        if not group.data:
+        if not group:
             logger.warning(f"Group with ID {group_id} not found")
             raise HTTPException(status_code=404, detail="Group not found")
         
         # Получаем настройки группы и список модераторов
-        group_settings = group.data[0].get("settings", {})
+        group_settings = group.get("settings", {})
         moderator_usernames = group_settings.get("moderators", [])
         
         if not moderator_usernames:
@@ -166,13 +194,10 @@ async def get_group_moderators(group_id: str):
                 username = username[1:]
                 
             # Ищем пользователя в базе
-            user_data = supabase_client.table('telegram_users')\
-                .select('*')\
-                .eq('username', username)\
-                .execute()
+            user_data = await repository.get_user_by_username(username)
             
-            if user_data.data:
-                moderator = user_data.data[0]
+            if user_data:
+                moderator = user_data
                 moderator['is_moderator'] = True
                 moderators.append(moderator)
             else:
@@ -230,14 +255,11 @@ async def add_group(
         logger.debug(f"Formed group_id: {group_id} from entity_id: {entity_id}")
         
         # Проверяем, существует ли группа в базе
-        existing_group = supabase_client.table('telegram_groups')\
-            .select("id")\
-            .eq('group_id', group_id)\
-            .execute()
+        existing_group = await repository.get_group_by_telegram_id(group_id, columns="id")
         
-        if existing_group.data:
+        if existing_group:
             logger.warning(f"Group {group_link} already exists in database")
-            return {"status": "already_exists", "group_id": existing_group.data[0]['id']}
+            return {"status": "already_exists", "group_id": existing_group['id']}
         
         # Добавляем группу в базу с дополнительными полями
         settings = {}
@@ -260,14 +282,14 @@ async def add_group(
             'settings': settings
         }
         
-        result = supabase_client.table('telegram_groups').insert(new_group).execute()
+        result = await repository.insert_group(new_group)
         
-        if not result.data:
+        if not result:
             logger.error(f"Failed to add group {group_link} to database")
             raise HTTPException(status_code=500, detail="Failed to add group to database")
         
         logger.info(f"Successfully added group {group_link} with correct group_id: {group_id}")
-        return {"status": "success", "group_id": result.data[0]['id']}
+        return {"status": "success", "group_id": result['id']}
         
     except HTTPException:
         raise
@@ -277,25 +299,34 @@ async def add_group(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/groups/{group_id}/collect")
-async def collect_group_data(group_id: str, limit: int = Query(100, ge=1, le=1000)):
+async def collect_group_data(
+    group_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    incremental: bool = Query(True, description="Загружать только новые сообщения с прошлого сбора")
+):
     """Собрать данные группы и сохранить в базу"""
     try:
         logger.debug(f"Starting data collection for group {group_id} with limit {limit}")
         # Проверяем существование группы
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
+        group = await repository.get_group(group_id)
         
-        if not group.data:
+        if not group:
             logger.warning(f"Group with ID {group_id} not found")
             raise HTTPException(status_code=404, detail="Group not found")
         
         # Получаем Telegram ID группы
-        telegram_group_id = group.data[0]["group_id"]
+        telegram_group_id = group["group_id"]
         logger.debug(f"Group found with Telegram ID: {telegram_group_id}")
         
         # Собираем данные из Telegram
         try:
-            result = await telegram_service.collect_group_data(telegram_group_id, messages_limit=limit)
+            result = await telegram_service.collect_group_data(
+                telegram_group_id,
+                messages_limit=limit,
+                incremental=incremental
+            )
             logger.debug("Data collection completed successfully")
+            result['messages'] = [message.to_dict() for message in result['messages']]
             return {"status": "success", "data": result}
         except Exception as telegram_error:
             logger.error(f"Error collecting data from Telegram: {str(telegram_error)}")
@@ -327,12 +358,12 @@ async def analyze_group(
             raise HTTPException(status_code=400, detail="Prompt is required for analysis")
         
         # Проверяем группу
-        group_check = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
+        group_check = await repository.get_group(group_id)
         
-        if not group_check.data:
+        if not group_check:
             raise HTTPException(status_code=404, detail="Group not found")
         
-        group_data = group_check.data[0]
+        group_data = group_check
         group_name = group_data.get("name", "Unknown")
         telegram_group_id = group_data.get("group_id")
         
@@ -375,7 +406,7 @@ async def analyze_group(
         }
         
         try:
-            supabase_client.table('analysis_reports').insert(analysis_report).execute()
+            await repository.insert_analysis_report(analysis_report)
             logger.info("Analysis results saved to database")
         except Exception as db_error:
             logger.warning(f"Failed to save to database: {db_error}")
@@ -397,26 +428,21 @@ async def get_group_analytics(group_id: str):
         logger.debug(f"Fetching analytics for group {group_id}")
         
         # Проверяем существование группы
-        group = supabase_client.table('telegram_groups').select("id").eq('id', group_id).execute()
+        group = await repository.get_group(group_id, columns="id")
         
-        if not group.data:
+        if not group:
             logger.warning(f"Group with ID {group_id} not found")
             raise HTTPException(status_code=404, detail="Group not found")
         
         # Получаем последний отчет анализа из базы данных
-        analysis_reports = supabase_client.table('analysis_reports')\
-            .select("*")\
-            .eq('group_id', group_id)\
-            .order('created_at', desc=True)\
-            .limit(1)\
-            .execute()
-        
-        if not analysis_reports.data:
+        latest_report = await repository.get_latest_analysis_report(group_id)
+        
+        if not latest_report:
             logger.warning(f"No analysis reports found for group {group_id}")
             return {"status": "not_found", "message": "No analysis reports available for this group"}
         
         logger.debug(f"Successfully fetched analytics for group {group_id}")
-        return {"status": "success", "result": analysis_reports.data[0]['results']}
+        return {"status": "success", "result": latest_report['results']}
     except HTTPException:
         raise
     except Exception as e:
@@ -436,32 +462,26 @@ async def get_analysis_history(
         logger.debug(f"Fetching analysis history for group {group_id}")
         
         # Проверяем существование группы
-        group = supabase_client.table('telegram_groups').select("id").eq('id', group_id).execute()
+        group = await repository.get_group(group_id, columns="id")
         
-        if not group.data:
+        if not group:
             logger.warning(f"Group with ID {group_id} not found")
             raise HTTPException(status_code=404, detail="Group not found")
         
-        # Формируем запрос к базе данных
-        query = supabase_client.table('analysis_reports')\
-            .select("id, created_at, type, results, prompt, analyzed_moderators")\
-            .eq('group_id', group_id)
-        
-        # Добавляем фильтры по датам если указаны
-        if from_date:
-            query = query.gte('created_at', from_date)
-        if to_date:
-            query = query.lte('created_at', to_date)
-            
-        # Выполняем запрос
-        reports = query.order('created_at', desc=True).limit(limit).execute()
+        # Запрашиваем отчеты с фильтрами по датам (если указаны)
+        reports = await repository.list_analysis_reports(
+            group_id,
+            limit=limit,
+            from_date=from_date,
+            to_date=to_date
+        )
         
-        if not reports.data:
+        if not reports:
             logger.warning(f"No analysis history found for group {group_id}")
             return {"status": "not_found", "message": "No analysis history available for this group"}
         
-        logger.debug(f"Successfully fetched {len(reports.data)} analysis reports for group {group_id}")
-        return {"status": "success", "results": reports.data}
+        logger.debug(f"Successfully fetched {len(reports)} analysis reports for group {group_id}")
+        return {"status": "success", "results": reports}
     except HTTPException:
         raise
     except Exception as e:
@@ -476,22 +496,18 @@ async def get_message_thread(message_id: str, group_id: str):
         logger.debug(f"Fetching thread for message {message_id} in group {group_id}")
         
         # Проверяем существование группы
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
+        group = await repository.get_group(group_id)
         
-        if not group.data:
+        if not group:
             logger.warning(f"Group with ID {group_id} not found")
             raise HTTPException(status_code=404, detail="Group not found")
         
-        telegram_group_id = group.data[0]["group_id"]
+        telegram_group_id = group["group_id"]
         
         # Получаем сообщение из базы
-        message = supabase_client.table('telegram_messages')\
-            .select("*")\
-            .eq('group_id', group_id)\
-            .eq('message_id', message_id)\
-            .execute()
+        message = await repository.get_group_message(group_id, message_id)
         
-        if not message.data:
+        if not message:
             logger.warning(f"Message with ID {message_id} not found")
             raise HTTPException(status_code=404, detail="Message not found")
         
@@ -538,14 +554,14 @@ async def add_moderator(group_id: str, username: str):
     """Добавить модератора в группу"""
     try:
         # Проверяем существование группы
-        group = supabase_client.table('telegram_groups').select("id, settings").eq('id', group_id).execute()
+        group = await repository.get_group(group_id, columns="id, settings")
         
-        if not group.data:
+        if not group:
             logger.warning(f"Group with ID {group_id} not found")
             raise HTTPException(status_code=404, detail="Group not found")
         
         # Получаем текущие настройки группы
-        group_settings = group.data[0].get("settings", {})
+        group_settings = group.get("settings", {})
         
         # Получаем список модераторов
         moderators = group_settings.get("moderators", [])
@@ -563,9 +579,9 @@ async def add_moderator(group_id: str, username: str):
         group_settings["moderators"] = moderators
         
         # Обновляем настройки группы
-        supabase_client.table('telegram_groups').update({
+        await repository.update_group(group_id, {
             "settings": group_settings
-        }).eq('id', group_id).execute()
+        })
         
         logger.info(f"Added moderator {username} to group {group_id}")
         return {"status": "success", "message": f"Moderator {username} added to group"}
@@ -579,14 +595,14 @@ async def remove_moderator(group_id: str, username: str):
     """Удалить модератора из группы"""
     try:
         # Проверяем существование группы
-        group = supabase_client.table('telegram_groups').select("id, settings").eq('id', group_id).execute()
+        group = await repository.get_group(group_id, columns="id, settings")
         
-        if not group.data:
+        if not group:
             logger.warning(f"Group with ID {group_id} not found")
             raise HTTPException(status_code=404, detail="Group not found")
         
         # Получаем текущие настройки группы
-        group_settings = group.data[0].get("settings", {})
+        group_settings = group.get("settings", {})
         
         # Получаем список модераторов
         moderators = group_settings.get("moderators", [])
@@ -604,9 +620,9 @@ async def remove_moderator(group_id: str, username: str):
         group_settings["moderators"] = moderators
         
         # Обновляем настройки группы
-        supabase_client.table('telegram_groups').update({
+        await repository.update_group(group_id, {
             "settings": group_settings
-        }).eq('id', group_id).execute()
+        })
         
         logger.info(f"Removed moderator {username} from group {group_id}")
         return {"status": "success", "message": f"Moderator {username} removed from group"}
@@ -724,22 +740,22 @@ async def debug_group_access(group_id: str):
         logger.info(f"Testing access to group {group_id}")
         
         # Проверяем существование группы в БД
-        db_group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
+        db_group = await repository.get_group(group_id)
         
-        if not db_group.data:
+        if not db_group:
             return {
                 "status": "error",
                 "error": f"Group {group_id} not found in database"
             }
         
-        group_data = db_group.data[0]
+        group_data = db_group
         telegram_group_id = group_data["group_id"]
         
         # Тестируем доступ к группе через Telegram API
         async def test_group_access():
             try:
-                # Пробуем получить информацию о группе
-                entity = await telegram_service.get_entity(telegram_group_id)
+                # Пробуем получить информацию о группе (resolve_entity не берет блокировку повторно)
+                entity = await telegram_service.resolve_entity(telegram_group_id)
                 
                 # Пробуем получить базовую информацию
                 if hasattr(entity, 'title'):
@@ -803,6 +819,15 @@ async def telegram_health_check():
             "timestamp": datetime.now().isoformat()
         })
 
+@router.get("/debug/operations")
+async def get_telegram_operations_stats():
+    """Метрики аккаунтов пула: планировщик операций, кэш сущностей, бюджеты rate limiter'а"""
+    return {
+        "status": "success",
+        "pool": telegram_service.pool.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
 @router.post("/reconnect")
 async def force_telegram_reconnect():
     """Принудительное переподключение к Telegram API"""
@@ -841,12 +866,12 @@ async def get_detailed_group_info(group_id: str):
         logger.info(f"Getting detailed info for group {group_id}")
         
         # Проверяем группу в БД
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
+        group = await repository.get_group(group_id)
         
-        if not group.data:
+        if not group:
             raise HTTPException(status_code=404, detail="Group not found in database")
         
-        group_data = group.data[0]
+        group_data = group
         telegram_group_id = group_data["group_id"]
         
         # Проверяем подключение
@@ -897,15 +922,15 @@ async def simple_group_debug(group_id: str):
         logger.info(f"Simple debug for group {group_id}")
         
         # Только проверяем базу данных
-        db_group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
+        db_group = await repository.get_group(group_id)
         
-        if not db_group.data:
+        if not db_group:
             return {
                 "status": "error",
                 "error": f"Group {group_id} not found in database"
             }
         
-        group_data = db_group.data[0]
+        group_data = db_group
         telegram_group_id = group_data["group_id"]
         
         return {
@@ -972,14 +997,14 @@ async def get_group_messages_simple(group_id: str, limit: int = Query(10, ge=1,
         logger.debug(f"Fetching simple messages for group {group_id} with limit {limit}")
         
         # Проверяем существование группы
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
+        group = await repository.get_group(group_id)
         
-        if not group.data:
+        if not group:
             logger.warning(f"Group with ID {group_id} not found")
             raise HTTPException(status_code=404, detail="Group not found")
         
         # Получаем телеграм ID группы
-        telegram_group_id = group.data[0]["group_id"]
+        telegram_group_id = group["group_id"]
         
         # Получаем сообщения через упрощенный метод
         messages_data = await telegram_service.get_messages_simple(telegram_group_id, limit=limit)
@@ -1001,8 +1026,8 @@ async def get_group_messages_simple(group_id: str, limit: int = Query(10, ge=1,
 @router.get("/groups/{group_id}/entity-only")
 async def test_entity_only(group_id: str):
     try:
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
-        telegram_group_id = group.data[0]["group_id"]
+        group = await repository.get_group(group_id)
+        telegram_group_id = group["group_id"]
         
         entity = await telegram_service.get_entity(telegram_group_id)
         
@@ -1019,8 +1044,8 @@ async def test_entity_only(group_id: str):
 async def test_iter_messages_direct(group_id: str):
     """Тест iter_messages без execute_telegram_operation"""
     try:
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
-        telegram_group_id = group.data[0]["group_id"]
+        group = await repository.get_group(group_id)
+        telegram_group_id = group["group_id"]
         
         # Получаем entity
         entity = await telegram_service.get_entity(telegram_group_id)
@@ -1041,8 +1066,8 @@ async def test_iter_messages_direct(group_id: str):
 async def test_iter_messages_with_timeout(group_id: str):
     """Тест iter_messages с таймаутом 15 секунд"""
     try:
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
-        telegram_group_id = group.data[0]["group_id"]
+        group = await repository.get_group(group_id)
+        telegram_group_id = group["group_id"]
         
         # Получаем entity
         entity = await telegram_service.get_entity(telegram_group_id)
@@ -1087,8 +1112,8 @@ async def test_iter_messages_with_timeout(group_id: str):
 async def test_get_messages_alternative(group_id: str):
     """Альтернативный метод - get_messages вместо iter_messages"""
     try:
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
-        telegram_group_id = group.data[0]["group_id"]
+        group = await repository.get_group(group_id)
+        telegram_group_id = group["group_id"]
         
         # Получаем entity
         entity = await telegram_service.get_entity(telegram_group_id)
@@ -1120,8 +1145,8 @@ async def test_get_messages_alternative(group_id: str):
 async def test_group_permissions(group_id: str):
     """Проверка прав доступа к группе"""
     try:
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
-        telegram_group_id = group.data[0]["group_id"]
+        group = await repository.get_group(group_id)
+        telegram_group_id = group["group_id"]
         
         # Получаем entity
         entity = await telegram_service.get_entity(telegram_group_id)
@@ -1171,8 +1196,8 @@ async def test_group_permissions(group_id: str):
 async def test_combined_approach(group_id: str):
     """Комбинированный подход с fallback методами"""
     try:
-        group = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
-        telegram_group_id = group.data[0]["group_id"]
+        group = await repository.get_group(group_id)
+        telegram_group_id = group["group_id"]
         
         # Получаем entity
         entity = await telegram_service.get_entity(telegram_group_id)
@@ -1290,12 +1315,12 @@ async def analyze_community_sentiment(
         logger.info(f"📊 Analysis parameters: days_back={days_back}, prompt_length={len(prompt)}")
         
         # Проверяем группу
-        group_check = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
+        group_check = await repository.get_group(group_id)
         
-        if not group_check.data:
+        if not group_check:
             raise HTTPException(status_code=404, detail="Group not found")
         
-        group_data = group_check.data[0]
+        group_data = group_check
         group_name = group_data.get("name", "Unknown")
         telegram_group_id = group_data.get("group_id")
         
@@ -1368,7 +1393,7 @@ async def analyze_community_sentiment(
         }
         
         try:
-            supabase_client.table('analysis_reports').insert(analysis_report).execute()
+            await repository.insert_analysis_report(analysis_report)
             logger.info("✅ Analysis saved to database")
         except Exception as db_error:
             logger.warning(f"⚠️ Failed to save to database: {db_error}")
@@ -1407,11 +1432,11 @@ async def analyze_posts_comments(
         if group_id == "default":
             group_name = "Posts Analysis"
         else:
-            group_check = supabase_client.table('telegram_groups').select("*").eq('id', group_id).execute()
-            if not group_check.data:
+            group_check = await repository.get_group(group_id)
+            if not group_check:
                 raise HTTPException(status_code=404, detail="Group not found")
             
-            group_data = group_check.data[0]
+            group_data = group_check
             group_name = group_data.get("name", "Unknown")
         
         logger.info(f"📝 Parsing {len(post_links)} post links...")
@@ -1490,7 +1515,7 @@ async def analyze_posts_comments(
         }
         
         try:
-            supabase_client.table('analysis_reports').insert(analysis_report).execute()
+            await repository.insert_analysis_report(analysis_report)
             logger.info("✅ Analysis saved to database")
         except Exception as db_error:
             logger.warning(f"⚠️ Failed to save to database: {db_error}")
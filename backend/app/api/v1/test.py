@@ -1,5 +1,5 @@
 from fastapi import APIRouter, HTTPException
-from ...core.database import supabase_client
+from ...core.repository import repository
 
 router = APIRouter()
 
@@ -8,7 +8,7 @@ async def test_connection():
     """Проверка соединения с Supabase"""
     try:
         # Проверяем соединение, запрашивая список таблиц
-        result = supabase_client.from_('telegram_groups').select('*').limit(1).execute()
+        result = await repository.execute('telegram_groups', 'test_connection', lambda q: q.select('*').limit(1))
         return {
             "status": "success",
             "message": "Соединение с Supabase установлено",
@@ -14,13 +14,65 @@ class Settings(BaseSettings):
     # Supabase
     SUPABASE_URL: str = "https://ujtenbbwwdxclabytfws.supabase.co"
     SUPABASE_KEY: str
+    SUPABASE_MAX_WORKERS: int = 10  # Размер пула потоков для запросов к PostgREST
+    SUPABASE_SLOW_QUERY_MS: int = 1000  # Порог логирования медленных запросов
+    MESSAGES_UPSERT_CHUNK_SIZE: int = 500  # Размер пачки при сохранении сообщений
+    DB_UPSERT_MAX_RETRIES: int = 3  # Повторы одной пачки при ошибке
+
     # Telegram
     TELEGRAM_API_ID: int
     TELEGRAM_API_HASH: str
     TELEGRAM_SESSION_STRING: Optional[str] = None
+    TELEGRAM_SESSION_STRINGS: Optional[str] = None  # Дополнительные аккаунты пула через запятую
+    TELEGRAM_ACCOUNT_RETRY_SECONDS: int = 60  # Сколько не выбирать аккаунт после ошибки подключения
+    USER_PROFILE_CACHE_SIZE: int = 50000  # Максимум профилей в процессном кэше
+    USER_PROFILE_CACHE_TTL_SECONDS: int = 6 * 60 * 60
+    TELEGRAM_MAX_PARALLEL_OPERATIONS: int = 8  # Общий лимит одновременных операций
+    TELEGRAM_HISTORY_CONCURRENCY: int = 4  # iter_messages / get_messages / replies
+    TELEGRAM_PARTICIPANTS_CONCURRENCY: int = 1  # iter_participants
+    TELEGRAM_ENTITY_CONCURRENCY: int = 4  # get_entity и информация о группах
+    ENTITY_CACHE_SIZE: int = 5000  # Разрешенные группы/каналы/пользователи
+    ENTITY_CACHE_TTL_SECONDS: int = 6 * 60 * 60
+    ENTITY_CACHE_NEGATIVE_TTL_SECONDS: int = 5 * 60  # Сколько помнить неудачные разрешения
+    TELEGRAM_FLOOD_SLEEP_THRESHOLD: int = 0  # 0 - все FloodWait обрабатывает наш rate limiter, а не Telethon
+    TELEGRAM_MAX_FLOOD_WAIT_SECONDS: int = 120  # Более долгие FloodWait не ждем, а возвращаем ошибку
+    MESSAGE_CACHE_ENABLED: bool = True  # Локальный SQLite-кэш сообщений перед Telegram и Supabase
+    MESSAGE_CACHE_PATH: str = "data/message_cache.sqlite3"
+    MESSAGE_CACHE_RETENTION_DAYS: int = 90  # Более старые сообщения удаляются из кэша
+    MESSAGE_CACHE_GAP_LIMIT: int = 1000  # Больший разрыв - полная перезагрузка окна
+    MESSAGE_CACHE_REVALIDATE_SECONDS: int = 15 * 60  # Как часто перезагружать окно целиком (правки и удаления)
+    COMMENTS_FETCH_CONCURRENCY: int = 4  # Параллельная загрузка комментариев к постам
+    POST_COMMENTS_TIMEOUT_SECONDS: int = 30  # Таймаут на один пост, дальше - частичный результат
+    
+    # Мониторинг клиентов
+    MONITORING_REALTIME_ENABLED: bool = False  # Обработка сообщений по событиям Telethon вместо опроса
+    MONITORING_GAP_FILL_INTERVAL_SECONDS: int = 300  # Страховочная догрузка пропусков в real-time режиме
+    MONITORING_REALTIME_CONCURRENCY: int = 4  # Сколько событий real-time режима обрабатывается одновременно
+    MONITORING_USER_CONCURRENCY: int = 8  # Пользователей, мониторинг которых выполняется одновременно
+    MONITORING_USER_TIMEOUT_SECONDS: int = 600  # Максимальная длительность одного прогона пользователя
+    MONITORING_SCHEDULE_RESYNC_SECONDS: int = 600  # Страховочное перечитывание расписания из БД
+    MONITORING_SETTINGS_POLL_SECONDS: int = 15  # Проверка изменений настроек, сделанных другим процессом (0 - выключено)
+    RUN_SCHEDULER_IN_API: bool = True  # False - мониторинг выполняет отдельный процесс python -m app.worker
+    WORKER_TELEGRAM_SESSION_STRINGS: Optional[str] = None  # Сессии Telegram процесса мониторинга через запятую (вместо сессий API)
+    TASK_RESTART_BACKOFF_SECONDS: float = 5  # Первая задержка перезапуска упавшей фоновой задачи
+    TASK_RESTART_BACKOFF_MAX_SECONDS: float = 300  # Максимальная задержка перезапуска
+    SCHEDULER_LEASE_ENABLED: bool = False  # Аренда в таблице scheduler_leases: один планировщик на пользователя при нескольких процессах
+    SCHEDULER_LEASE_TTL_SECONDS: int = 30  # Через сколько аренда умершего процесса переходит к другому
+    SCHEDULER_LEASE_RENEW_SECONDS: int = 10  # Как часто продлевать аренду
+    SCHEDULER_SHARDS: int = 1  # На сколько диапазонов делятся пользователи между держателями аренды
+    SCHEDULER_MAX_SHARDS_PER_INSTANCE: int = 0  # Максимум диапазонов на процесс (0 - без ограничения)
+    CHAT_FETCH_TTL_SECONDS: int = 30  # Чат загружается не чаще, сколько бы пользователей его ни мониторили
+    CHAT_FETCH_BUFFER_SIZE: int = 2000  # Сообщений в общем буфере одного чата
+    CHAT_FETCH_BUFFER_MINUTES: int = 24 * 60  # Сколько хранить сообщения в буфере чата
+    PROCESSED_MESSAGES_INDEX_SIZE: int = 100000  # Ключей обработанных сообщений в памяти процесса
+    PROCESSED_MESSAGES_SEED_DAYS: int = 7  # За сколько дней загружать найденных клиентов при старте
     
     # OpenAI
     OPENAI_API_KEY: str
+    LEAD_CLASSIFIER_BACKEND: str = "stub"  # "stub" (локальная заглушка без запросов к API) или "openai" (платные запросы к модели)
+    LEAD_CLASSIFIER_MODEL: str = "gpt-4.1-2025-04-14"
+    LEAD_CLASSIFIER_BATCH_SIZE: int = 20  # Сообщений-кандидатов в одном запросе к модели
+    LEAD_CLASSIFIER_CONCURRENCY: int = 3  # Одновременных запросов классификации
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,555 @@
+# backend/app/core/repository.py
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from postgrest.types import ReturnMethod
+from supabase import Client
+
+from .config import settings
+from .database import supabase_client
+
+logger = logging.getLogger(__name__)
+
+# Сигнатура хука: (table, operation, duration_seconds, error)
+TimingHook = Callable[[str, str, float, Optional[BaseException]], None]
+
+
+class SupabaseRepository:
+    """
+    Асинхронный слой доступа к данным поверх синхронного supabase-клиента.
+
+    Каждый запрос к PostgREST выполняется в ограниченном пуле потоков, поэтому
+    медленный round trip не блокирует event loop (и соединение Telethon).
+    Используется один общий клиент, так что HTTP-соединения переиспользуются.
+    """
+
+    def __init__(self, client: Optional[Client] = None, max_workers: Optional[int] = None):
+        self.client = client or supabase_client
+        self.max_workers = max_workers or settings.SUPABASE_MAX_WORKERS
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="supabase"
+        )
+        self._timing_hooks: List[TimingHook] = [self._log_slow_query]
+        self.stats: Dict[str, Dict[str, Any]] = {}
+
+    # ==================== ИНФРАСТРУКТУРА ====================
+
+    def add_timing_hook(self, hook: TimingHook):
+        """Зарегистрировать хук, который вызывается после каждого запроса"""
+        self._timing_hooks.append(hook)
+
+    def remove_timing_hook(self, hook: TimingHook):
+        """Удалить ранее зарегистрированный хук"""
+        if hook in self._timing_hooks:
+            self._timing_hooks.remove(hook)
+
+    async def execute(self, table: str, operation: str, build: Callable[[Any], Any]):
+        """
+        Выполнить запрос к таблице в пуле потоков
+
+        Args:
+            table: Имя таблицы
+            operation: Имя операции (для метрик)
+            build: Функция, которая получает query builder таблицы и возвращает готовый запрос
+
+        Returns:
+            Ответ supabase (с полями data и count)
+        """
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        error = None
+
+        try:
+            return await loop.run_in_executor(
+                self._executor,
+                lambda: build(self.client.table(table)).execute()
+            )
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._record_timing(table, operation, time.perf_counter() - started, error)
+
+    def _record_timing(self, table: str, operation: str, duration: float, error: Optional[BaseException]):
+        """Обновить статистику и вызвать хуки"""
+        key = f"{table}.{operation}"
+        stat = self.stats.setdefault(key, {
+            'calls': 0,
+            'errors': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0
+        })
+        duration_ms = duration * 1000
+        stat['calls'] += 1
+        stat['total_ms'] += duration_ms
+        stat['max_ms'] = max(stat['max_ms'], duration_ms)
+        if error is not None:
+            stat['errors'] += 1
+
+        for hook in self._timing_hooks:
+            try:
+                hook(table, operation, duration, error)
+            except Exception as hook_error:
+                logger.warning(f"Timing hook failed for {key}: {hook_error}")
+
+    def _log_slow_query(self, table: str, operation: str, duration: float, error: Optional[BaseException]):
+        """Хук по умолчанию: логируем медленные и упавшие запросы"""
+        duration_ms = duration * 1000
+        if error is not None:
+            logger.warning(f"Supabase {table}.{operation} failed after {duration_ms:.0f}ms: {error}")
+        elif duration_ms >= settings.SUPABASE_SLOW_QUERY_MS:
+            logger.warning(f"Slow Supabase query {table}.{operation}: {duration_ms:.0f}ms")
+
+    async def bulk_upsert(
+        self,
+        table: str,
+        rows: List[Dict[str, Any]],
+        on_conflict: str,
+        chunk_size: int = 500,
+        max_retries: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Upsert строк пачками фиксированного размера
+
+        Каждая пачка повторяется с экспоненциальной задержкой. Если пачка так и не
+        записалась, она делится пополам, чтобы одна битая строка не теряла остальные.
+
+        Returns:
+            Статистика: rows, saved, failed, chunks, duration_seconds, rows_per_second
+        """
+        max_retries = max_retries or settings.DB_UPSERT_MAX_RETRIES
+        started = time.perf_counter()
+        stats = {'rows': len(rows), 'saved': 0, 'failed': 0, 'chunks': 0}
+
+        async def upsert_chunk(chunk: List[Dict[str, Any]], attempts: int) -> None:
+            stats['chunks'] += 1
+            for attempt in range(attempts):
+                try:
+                    await self.execute(
+                        table, 'bulk_upsert',
+                        lambda q: q.upsert(chunk, on_conflict=on_conflict, returning=ReturnMethod.minimal)
+                    )
+                    stats['saved'] += len(chunk)
+                    return
+                except Exception as e:
+                    logger.warning(
+                        f"Upsert of {len(chunk)} rows into {table} failed "
+                        f"(attempt {attempt + 1}/{attempts}): {e}"
+                    )
+                    if attempt < attempts - 1:
+                        await asyncio.sleep(0.5 * (2 ** attempt))
+
+            if len(chunk) == 1:
+                stats['failed'] += 1
+                return
+
+            # Делим пачку пополам и пробуем каждую половину по одному разу
+            middle = len(chunk) // 2
+            await upsert_chunk(chunk[:middle], 1)
+            await upsert_chunk(chunk[middle:], 1)
+
+        for start in range(0, len(rows), chunk_size):
+            await upsert_chunk(rows[start:start + chunk_size], max_retries)
+
+        duration = time.perf_counter() - started
+        stats['duration_seconds'] = round(duration, 3)
+        stats['rows_per_second'] = round(stats['saved'] / duration, 1) if duration > 0 else 0.0
+
+        logger.info(
+            f"Bulk upsert into {table}: {stats['saved']}/{stats['rows']} rows in {stats['chunks']} chunks, "
+            f"{stats['rows_per_second']} rows/s"
+        )
+        return stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика запросов по таблицам и операциям"""
+        return {
+            key: {
+                **stat,
+                'avg_ms': stat['total_ms'] / stat['calls'] if stat['calls'] else 0.0
+            }
+            for key, stat in self.stats.items()
+        }
+
+    def shutdown(self):
+        """Остановить пул потоков"""
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def _first(response) -> Optional[Dict[str, Any]]:
+        return response.data[0] if response.data else None
+
+    # ==================== TELEGRAM_GROUPS ====================
+
+    async def list_groups(self) -> List[Dict[str, Any]]:
+        response = await self.execute('telegram_groups', 'list', lambda q: q.select("*"))
+        return response.data or []
+
+    async def get_group(self, group_id: str, columns: str = "*") -> Optional[Dict[str, Any]]:
+        """Получить группу по внутреннему id"""
+        response = await self.execute(
+            'telegram_groups', 'get',
+            lambda q: q.select(columns).eq('id', group_id)
+        )
+        return self._first(response)
+
+    async def get_group_by_telegram_id(self, telegram_group_id: str, columns: str = "*") -> Optional[Dict[str, Any]]:
+        """Получить группу по Telegram ID"""
+        response = await self.execute(
+            'telegram_groups', 'get_by_telegram_id',
+            lambda q: q.select(columns).eq('group_id', telegram_group_id)
+        )
+        return self._first(response)
+
+    async def insert_group(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute('telegram_groups', 'insert', lambda q: q.insert(data))
+        return self._first(response)
+
+    async def update_group(self, group_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'telegram_groups', 'update',
+            lambda q: q.update(data).eq('id', group_id)
+        )
+        return self._first(response)
+
+    async def update_group_by_telegram_id(self, telegram_group_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'telegram_groups', 'update_by_telegram_id',
+            lambda q: q.update(data).eq('group_id', telegram_group_id)
+        )
+        return self._first(response)
+
+    # ==================== TELEGRAM_MESSAGES ====================
+
+    async def list_group_messages(self, group_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """Последние сохраненные сообщения группы"""
+        response = await self.execute(
+            'telegram_messages', 'list',
+            lambda q: q.select("*").eq('group_id', group_id).order('date', desc=True).limit(limit)
+        )
+        return response.data or []
+
+    async def get_group_message(self, group_id: str, message_id: str, columns: str = "*") -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'telegram_messages', 'get',
+            lambda q: q.select(columns).eq('group_id', group_id).eq('message_id', message_id)
+        )
+        return self._first(response)
+
+    async def insert_message(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute('telegram_messages', 'insert', lambda q: q.insert(row))
+        return self._first(response)
+
+    async def upsert_messages(self, rows: List[Dict[str, Any]], chunk_size: Optional[int] = None) -> Dict[str, Any]:
+        """Пакетный upsert сообщений с ключом конфликта (group_id, message_id)"""
+        return await self.bulk_upsert(
+            'telegram_messages',
+            rows,
+            on_conflict='group_id,message_id',
+            chunk_size=chunk_size or settings.MESSAGES_UPSERT_CHUNK_SIZE
+        )
+
+    # ==================== TELEGRAM_SYNC_STATE ====================
+
+    async def get_sync_state(self, sync_key: str) -> Optional[Dict[str, Any]]:
+        """Получить high-water mark инкрементальной синхронизации"""
+        response = await self.execute(
+            'telegram_sync_state', 'get',
+            lambda q: q.select('*').eq('sync_key', sync_key)
+        )
+        return self._first(response)
+
+    async def upsert_sync_state(self, sync_key: str, group_id: str, last_message_id: int) -> None:
+        """Сохранить high-water mark (последний обработанный message_id)"""
+        row = {
+            'sync_key': sync_key,
+            'group_id': str(group_id),
+            'last_message_id': last_message_id,
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }
+        await self.execute(
+            'telegram_sync_state', 'upsert',
+            lambda q: q.upsert(row, on_conflict='sync_key', returning=ReturnMethod.minimal)
+        )
+
+    # ==================== SCHEDULER_LEASES ====================
+
+    async def list_live_scheduler_leases(self, now: str) -> List[Dict[str, Any]]:
+        """Неистекшие аренды планировщика"""
+        response = await self.execute(
+            'scheduler_leases', 'list_live',
+            lambda q: q.select('lease_key,holder_id,expires_at').gt('expires_at', now)
+        )
+        return response.data or []
+
+    async def insert_scheduler_lease(self, lease_key: str, holder_id: str, expires_at: str) -> bool:
+        """Создать аренду, если ее еще нет; False - строка уже существует"""
+        row = {
+            'lease_key': lease_key,
+            'holder_id': holder_id,
+            'expires_at': expires_at,
+            'renewed_at': datetime.now(timezone.utc).isoformat()
+        }
+        response = await self.execute(
+            'scheduler_leases', 'insert',
+            lambda q: q.upsert(row, on_conflict='lease_key', ignore_duplicates=True)
+        )
+        return bool(response.data)
+
+    async def renew_scheduler_lease(self, lease_key: str, holder_id: str, expires_at: str) -> bool:
+        """Продлить аренду, только если она все еще принадлежит holder_id"""
+        data = {'expires_at': expires_at, 'renewed_at': datetime.now(timezone.utc).isoformat()}
+        response = await self.execute(
+            'scheduler_leases', 'renew',
+            lambda q: q.update(data).eq('lease_key', lease_key).eq('holder_id', holder_id)
+        )
+        return bool(response.data)
+
+    async def take_over_scheduler_lease(self, lease_key: str, holder_id: str, expires_at: str, now: str) -> bool:
+        """Забрать аренду, только если она истекла (compare-and-set по expires_at)"""
+        data = {'holder_id': holder_id, 'expires_at': expires_at, 'renewed_at': now}
+        response = await self.execute(
+            'scheduler_leases', 'take_over',
+            lambda q: q.update(data).eq('lease_key', lease_key).lt('expires_at', now)
+        )
+        return bool(response.data)
+
+    async def release_scheduler_leases(self, holder_id: str, lease_keys: List[str]) -> None:
+        """Освободить аренды holder_id"""
+        if not lease_keys:
+            return
+        await self.execute(
+            'scheduler_leases', 'release',
+            lambda q: q.delete().eq('holder_id', holder_id).in_('lease_key', lease_keys)
+        )
+
+    # ==================== TELEGRAM_USERS ====================
+
+    async def get_user_by_telegram_id(self, telegram_id: str, columns: str = "*") -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'telegram_users', 'get_by_telegram_id',
+            lambda q: q.select(columns).eq('telegram_id', telegram_id)
+        )
+        return self._first(response)
+
+    async def get_users_by_telegram_ids(self, telegram_ids: List[str], chunk_size: int = 200) -> List[Dict[str, Any]]:
+        """Получить пользователей по списку Telegram ID (пачками, чтобы не упереться в длину URL)"""
+        rows: List[Dict[str, Any]] = []
+        for start in range(0, len(telegram_ids), chunk_size):
+            chunk = telegram_ids[start:start + chunk_size]
+            response = await self.execute(
+                'telegram_users', 'get_many',
+                lambda q: q.select('telegram_id, username, first_name, last_name, is_bot').in_('telegram_id', chunk)
+            )
+            rows.extend(response.data or [])
+        return rows
+
+    async def upsert_users(self, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Пакетный upsert профилей пользователей по telegram_id"""
+        return await self.bulk_upsert('telegram_users', rows, on_conflict='telegram_id')
+
+    async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'telegram_users', 'get_by_username',
+            lambda q: q.select('*').eq('username', username)
+        )
+        return self._first(response)
+
+    async def insert_user(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute('telegram_users', 'insert', lambda q: q.insert(data))
+        return self._first(response)
+
+    async def update_user(self, user_id: Any, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'telegram_users', 'update',
+            lambda q: q.update(data).eq('id', user_id)
+        )
+        return self._first(response)
+
+    # ==================== USER_GROUP_RELATIONS ====================
+
+    async def get_user_group_relation(self, user_id: Any, group_id: Any) -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'user_group_relations', 'get',
+            lambda q: q.select('id').eq('user_id', user_id).eq('group_id', group_id)
+        )
+        return self._first(response)
+
+    async def insert_user_group_relation(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute('user_group_relations', 'insert', lambda q: q.insert(data))
+        return self._first(response)
+
+    # ==================== ANALYSIS_REPORTS ====================
+
+    async def insert_analysis_report(self, report: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute('analysis_reports', 'insert', lambda q: q.insert(report))
+        return self._first(response)
+
+    async def get_latest_analysis_report(self, group_id: str) -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'analysis_reports', 'get_latest',
+            lambda q: q.select("*").eq('group_id', group_id).order('created_at', desc=True).limit(1)
+        )
+        return self._first(response)
+
+    async def list_analysis_reports(
+        self,
+        group_id: str,
+        limit: int = 10,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        def build(q):
+            query = q.select("id, created_at, type, results, prompt, analyzed_moderators").eq('group_id', group_id)
+            if from_date:
+                query = query.gte('created_at', from_date)
+            if to_date:
+                query = query.lte('created_at', to_date)
+            return query.order('created_at', desc=True).limit(limit)
+
+        response = await self.execute('analysis_reports', 'list', build)
+        return response.data or []
+
+    # ==================== PRODUCT_TEMPLATES ====================
+
+    async def list_product_templates(self, user_id: int, active_only: bool = False) -> List[Dict[str, Any]]:
+        def build(q):
+            query = q.select('*').eq('user_id', user_id)
+            if active_only:
+                return query.eq('is_active', True)
+            return query.order('created_at', desc=True)
+
+        response = await self.execute('product_templates', 'list', build)
+        return response.data or []
+
+    async def insert_product_template(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute('product_templates', 'insert', lambda q: q.insert(data))
+        return self._first(response)
+
+    async def update_product_template(self, template_id: int, user_id: int, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'product_templates', 'update',
+            lambda q: q.update(data).eq('id', template_id).eq('user_id', user_id)
+        )
+        return self._first(response)
+
+    async def delete_product_template(self, template_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'product_templates', 'delete',
+            lambda q: q.delete().eq('id', template_id).eq('user_id', user_id)
+        )
+        return self._first(response)
+
+    # ==================== MONITORING_SETTINGS ====================
+
+    async def get_monitoring_settings(self, user_id: int) -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'monitoring_settings', 'get',
+            lambda q: q.select('*').eq('user_id', user_id)
+        )
+        return self._first(response)
+
+    async def list_active_monitoring_settings(self) -> List[Dict[str, Any]]:
+        response = await self.execute(
+            'monitoring_settings', 'list_active',
+            lambda q: q.select('*').eq('is_active', True)
+        )
+        return response.data or []
+
+    async def get_latest_monitoring_settings_update(self) -> Optional[str]:
+        """updated_at последнего изменения настроек мониторинга (маркер для других процессов)"""
+        response = await self.execute(
+            'monitoring_settings', 'latest_update',
+            lambda q: q.select('updated_at').order('updated_at', desc=True).limit(1)
+        )
+        row = self._first(response)
+        return row.get('updated_at') if row else None
+
+    async def insert_monitoring_settings(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute('monitoring_settings', 'insert', lambda q: q.insert(data))
+        return self._first(response)
+
+    async def update_monitoring_settings(self, user_id: int, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'monitoring_settings', 'update',
+            lambda q: q.update(data).eq('user_id', user_id)
+        )
+        return self._first(response)
+
+    async def ping(self):
+        """Легкий запрос для проверки доступности БД"""
+        return await self.execute('monitoring_settings', 'ping', lambda q: q.select('count'))
+
+    # ==================== POTENTIAL_CLIENTS ====================
+
+    async def list_potential_clients(
+        self,
+        user_id: int,
+        status: Optional[str] = None,
+        limit: int = 50,
+        offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        def build(q):
+            query = q.select('*').eq('user_id', user_id)
+            if status:
+                query = query.eq('client_status', status)
+            return query.order('created_at', desc=True).range(offset, offset + limit - 1)
+
+        response = await self.execute('potential_clients', 'list', build)
+        return response.data or []
+
+    async def count_potential_clients(
+        self,
+        user_id: int,
+        status: Optional[str] = None,
+        since: Optional[str] = None
+    ) -> int:
+        def build(q):
+            query = q.select('id', count='exact').eq('user_id', user_id)
+            if status:
+                query = query.eq('client_status', status)
+            if since:
+                query = query.gte('created_at', since)
+            return query
+
+        response = await self.execute('potential_clients', 'count', build)
+        return response.count or 0
+
+    async def update_potential_client_status(self, client_id: int, user_id: int, status: str) -> Optional[Dict[str, Any]]:
+        response = await self.execute(
+            'potential_clients', 'update_status',
+            lambda q: q.update({'client_status': status}).eq('id', client_id).eq('user_id', user_id)
+        )
+        return self._first(response)
+
+    async def list_potential_client_keys(self, user_id: int, message_ids: List[str]) -> List[Dict[str, Any]]:
+        """Ключи (chat_id, message_id) уже сохраненных клиентов среди переданных сообщений"""
+        if not message_ids:
+            return []
+        response = await self.execute(
+            'potential_clients', 'keys',
+            lambda q: q.select('chat_id,message_id').eq('user_id', user_id).in_('message_id', message_ids)
+        )
+        return response.data or []
+
+    async def list_recent_potential_client_keys(self, since: str, limit: int) -> List[Dict[str, Any]]:
+        """Ключи клиентов всех пользователей, найденных начиная с since (самые новые первыми)"""
+        def build(q):
+            query = q.select('user_id,chat_id,message_id').gte('created_at', since)
+            return query.order('created_at', desc=True).limit(limit)
+
+        response = await self.execute('potential_clients', 'recent_keys', build)
+        return response.data or []
+
+    async def insert_potential_client(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.execute('potential_clients', 'insert', lambda q: q.insert(data))
+        return self._first(response)
+
+
+# Глобальный экземпляр
+repository = SupabaseRepository()
@@ -4,9 +4,12 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from .api.v1 import telegram, moderators, analytics, auth, client_monitoring
 from .core.config import settings
-from .core.database import supabase_client
+from .core.repository import repository
 from .services.telegram_service import TelegramService
 from .services.scheduler_service import scheduler_service
+from .services.message_cache import message_cache
+from .services.processed_messages import processed_messages
+from .services.chat_fetch_coalescer import chat_fetch_coalescer
 import asyncio
 import logging
 
@@ -21,16 +24,21 @@ async def lifespan(app: FastAPI):
     logger.info("Starting Multi-Channel Analyzer API...")
     
     # Запускаем планировщик задач для мониторинга клиентов
-    try:
-        print("🔧 MAIN: Starting scheduler service...")
-        await scheduler_service.start()  # ← ИСПРАВЛЕНО: добавлен await
-        print("✅ MAIN: Scheduler started successfully")
-        logger.info("Scheduler started successfully")
-    except Exception as e:
-        print(f"❌ MAIN: Failed to start scheduler: {e}")
-        logger.error(f"Failed to start scheduler: {e}")
-        import traceback
-        logger.error(f"❌ MAIN: Traceback: {traceback.format_exc()}")
+    # (при RUN_SCHEDULER_IN_API=False его выполняет отдельный процесс python -m app.worker)
+    if settings.RUN_SCHEDULER_IN_API:
+        try:
+            print("🔧 MAIN: Starting scheduler service...")
+            await scheduler_service.start()  # ← ИСПРАВЛЕНО: добавлен await
+            print("✅ MAIN: Scheduler started successfully")
+            logger.info("Scheduler started successfully")
+        except Exception as e:
+            print(f"❌ MAIN: Failed to start scheduler: {e}")
+            logger.error(f"Failed to start scheduler: {e}")
+            import traceback
+            logger.error(f"❌ MAIN: Traceback: {traceback.format_exc()}")
+    else:
+        print("ℹ️ MAIN: Scheduler runs in the monitoring worker process")
+        logger.info("Scheduler runs in the monitoring worker process")
     
     print("✅ MAIN: Application started successfully. Telegram client will be initialized on demand.")
     logger.info("Application started successfully. Telegram client will be initialized on demand.")
@@ -62,11 +70,14 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"❌ MAIN: Error closing Telegram client: {e}")
         logger.error(f"Error closing Telegram client: {e}")
-    
-    # Явно очищаем ресурсы
-    if hasattr(telegram_service, 'client') and telegram_service.client:
-        telegram_service.client = None
-    
+
+    # Останавливаем пул потоков для запросов к БД
+    repository.shutdown()
+
+    # Закрываем локальный кэш сообщений
+    if message_cache is not None:
+        message_cache.close()
+
     print("✅ MAIN: Application shutdown complete")
 
 # Создаем FastAPI приложение с lifespan
@@ -104,7 +115,7 @@ async def monitoring_health():
     """Проверка состояния системы мониторинга"""
     try:
         # Проверяем подключение к БД
-        result = supabase_client.table('monitoring_settings').select('count').execute()
+        await repository.ping()
         
         # Проверяем планировщик
         scheduler_running = scheduler_service.scheduler.running if scheduler_service.scheduler else False
@@ -113,6 +124,13 @@ async def monitoring_health():
             "status": "healthy",
             "database": "connected",
             "scheduler": "running" if scheduler_running else "stopped",
+            "scheduler_process": "api" if settings.RUN_SCHEDULER_IN_API else "worker",
+            "scheduler_stats": scheduler_service.get_stats(),
+            "realtime_ingestion": scheduler_service.realtime_service.get_stats(),
+            "database_stats": repository.get_stats(),
+            "message_cache": message_cache.get_stats() if message_cache is not None else None,
+            "processed_messages": processed_messages.get_stats(),
+            "chat_fetches": chat_fetch_coalescer.get_stats(),
             "timestamp": asyncio.get_event_loop().time()
         }
     except Exception as e:
@@ -0,0 +1,83 @@
+# backend/app/scripts/benchmark_message_memory.py
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+# Добавляем путь к приложению в PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from app.services.message_record import MessageRecord
+
+
+def _fields(index: int, start: datetime):
+    """Поля синтетического сообщения, как их заполняет TelegramService.message_to_record"""
+    return {
+        'message_id': str(1_000_000 + index),
+        'text': f"Сообщение номер {index}: есть ли в продаже квартиры у метро?",
+        'date': (start + timedelta(seconds=index * 30)).isoformat(),
+        'sender_id': str(500_000 + index % 300),
+        'is_reply': index % 4 == 0,
+        'reply_to_message_id': str(1_000_000 + index - 1) if index % 4 == 0 else None,
+        'forward_from': None,
+        'media_type': 'photo' if index % 10 == 0 else None,
+        'edit_date': None,
+        'views': None,
+        'user_info': None
+    }
+
+
+def build_dicts(count: int):
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return [_fields(index, start) for index in range(count)]
+
+
+def build_records(count: int):
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return [MessageRecord(**_fields(index, start)) for index in range(count)]
+
+
+def build_dicts_for_db(count: int):
+    """Текущий путь сохранения: словарь сообщения плюс копия для строки БД"""
+    messages = build_dicts(count)
+    rows = [{**msg, 'group_id': '-100123', 'created_at': '2025-01-01T00:00:00'} for msg in messages]
+    return messages, rows
+
+
+def measure(builder, count: int):
+    """Память, удерживаемая результатом builder(count), и пик при построении (в байтах)"""
+    gc.collect()
+    tracemalloc.start()
+    result = builder(count)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память на сообщение: dict против MessageRecord")
+    parser.add_argument('--count', type=int, default=100_000, help="Количество сообщений")
+    args = parser.parse_args()
+
+    print(f"Messages: {args.count}")
+    print(f"{'representation':<22}{'retained, MB':>14}{'peak, MB':>12}{'bytes/msg':>12}")
+
+    results = {}
+    for name, builder in (
+        ('dict', build_dicts),
+        ('MessageRecord', build_records),
+        ('dict + db row copy', build_dicts_for_db)
+    ):
+        current, peak = measure(builder, args.count)
+        results[name] = current
+        print(f"{name:<22}{current / 2**20:>14.2f}{peak / 2**20:>12.2f}{current / args.count:>12.0f}")
+
+    saved = 1 - results['MessageRecord'] / results['dict']
+    print(f"MessageRecord saves {saved:.0%} of retained memory compared to dicts")
+
+
+if __name__ == "__main__":
+    main()
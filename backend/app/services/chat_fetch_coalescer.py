@@ -0,0 +1,165 @@
+# backend/app/services/chat_fetch_coalescer.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from ..core.config import settings
+from .message_record import MessageRecord
+from .telegram_service import TelegramService
+
+logger = logging.getLogger(__name__)
+
+
+class _ChatState:
+    __slots__ = ('buffer', 'last_fetch', 'inflight', 'fetches', 'served')
+
+    def __init__(self):
+        # message_id -> сообщение, по возрастанию id
+        self.buffer: "OrderedDict[int, MessageRecord]" = OrderedDict()
+        self.last_fetch = 0.0
+        self.inflight: Optional[asyncio.Future] = None
+        self.fetches = 0
+        self.served = 0
+
+
+class ChatFetchCoalescer:
+    """
+    Общая для всех пользователей загрузка мониторинговых чатов
+
+    Чат загружается из Telegram не чаще раза в CHAT_FETCH_TTL_SECONDS, сколько бы
+    пользователей его ни мониторили: одновременные запросы ждут одну загрузку
+    (single-flight). Загрузка инкрементальная по общей отметке чата
+    (sync_key chat:{чат}), новые сообщения складываются в скользящий буфер.
+    Каждый пользователь получает из буфера сообщения новее своей отметки
+    monitor:{user_id}:{чат}; отметку сдвигает advance() после того, как
+    сообщения обработаны, поэтому упавший или прерванный прогон их не теряет.
+    """
+
+    def __init__(self, telegram_service: TelegramService):
+        self.telegram_service = telegram_service
+        self._chats: Dict[str, _ChatState] = {}
+        self.stats = {'fetches': 0, 'coalesced': 0, 'served': 0}
+
+    def _state(self, chat_ref: str) -> _ChatState:
+        # Ключ - ссылка как в monitored_chats: записи буфера общие, и у всех подписчиков
+        # в сообщениях должен оказаться один и тот же chat
+        key = str(chat_ref)
+        state = self._chats.get(key)
+        if state is None:
+            state = self._chats[key] = _ChatState()
+        return state
+
+    async def get_new_messages(
+        self,
+        chat_ref: str,
+        lookback_minutes: int,
+        user_id: Optional[int] = None
+    ) -> List[MessageRecord]:
+        """
+        Сообщения чата за lookback_minutes, которые пользователь еще не получал
+
+        Args:
+            chat_ref: Чат из monitored_chats
+            lookback_minutes: Окно мониторинга пользователя
+            user_id: ID пользователя (None - без учета отметки пользователя)
+
+        Returns:
+            Сообщения от новых к старым (после обработки - advance())
+        """
+        state = self._state(chat_ref)
+        await self._refresh(chat_ref, state, lookback_minutes)
+
+        sync_key = f"monitor:{user_id}:{chat_ref}" if user_id is not None else None
+        since_id = (await self.telegram_service._get_high_water_mark(sync_key) or 0) if sync_key else 0
+        cutoff_ts = (datetime.now(timezone.utc) - timedelta(minutes=lookback_minutes)).timestamp()
+
+        messages = []
+        for message_id, message in reversed(state.buffer.items()):
+            if message_id <= since_id:
+                break
+            if self._timestamp(message) >= cutoff_ts:
+                messages.append(message)
+
+        state.served += len(messages)
+        self.stats['served'] += len(messages)
+        return messages
+
+    async def advance(self, chat_ref: str, user_id: int, messages: List[MessageRecord]):
+        """Сдвинуть отметку пользователя по обработанным сообщениям из get_new_messages"""
+        if not messages:
+            return
+        newest_id = max(int(msg['message_id']) for msg in messages)
+        await self.telegram_service._update_high_water_mark(f"monitor:{user_id}:{chat_ref}", chat_ref, newest_id)
+
+    async def _refresh(self, chat_ref: str, state: _ChatState, lookback_minutes: int):
+        """Догрузить чат, если буфер старше TTL; одновременные вызовы ждут одну загрузку"""
+        if state.inflight is not None:
+            self.stats['coalesced'] += 1
+            await asyncio.shield(state.inflight)
+            return
+
+        if time.monotonic() - state.last_fetch < settings.CHAT_FETCH_TTL_SECONDS:
+            self.stats['coalesced'] += 1
+            return
+
+        state.inflight = asyncio.get_running_loop().create_future()
+        try:
+            sync_key = f"chat:{chat_ref}"
+            cold_start = state.fetches == 0
+            lookback_days = max(1, lookback_minutes // (24 * 60))  # Минимум 1 день
+            
+            # Первая загрузка в процессе заполняет буфер окном целиком, дальше - только новое
+            fetched = await self.telegram_service.get_group_messages(
+                group_id=chat_ref,
+                limit=100,  # Ограничиваем количество для скорости
+                days_back=lookback_days,
+                get_users=True,
+                sync_key=None if cold_start else sync_key
+            )
+            if cold_start and fetched:
+                newest_id = max(int(msg['message_id']) for msg in fetched)
+                await self.telegram_service._update_high_water_mark(sync_key, chat_ref, newest_id)
+            
+            state.last_fetch = time.monotonic()
+            state.fetches += 1
+            self.stats['fetches'] += 1
+            self._merge(state, fetched)
+        except Exception as e:
+            logger.error(f"Error fetching monitored chat {chat_ref}: {e}")
+        finally:
+            state.inflight.set_result(None)
+            state.inflight = None
+
+    def _merge(self, state: _ChatState, fetched: List[MessageRecord]):
+        """Добавить новые сообщения в буфер и обрезать его по возрасту и размеру"""
+        for message in sorted(fetched, key=lambda msg: int(msg['message_id'])):
+            state.buffer[int(message['message_id'])] = message
+
+        max_age_ts = (datetime.now(timezone.utc) - timedelta(minutes=settings.CHAT_FETCH_BUFFER_MINUTES)).timestamp()
+        while state.buffer:
+            oldest_id, oldest = next(iter(state.buffer.items()))
+            if len(state.buffer) > settings.CHAT_FETCH_BUFFER_SIZE or self._timestamp(oldest) < max_age_ts:
+                state.buffer.pop(oldest_id)
+            else:
+                break
+
+    @staticmethod
+    def _timestamp(message: MessageRecord) -> float:
+        try:
+            return datetime.fromisoformat(message['date'].replace('Z', '+00:00')).timestamp()
+        except (TypeError, ValueError):
+            return 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'chats': len(self._chats),
+            'buffered_messages': sum(len(state.buffer) for state in self._chats.values())
+        }
+
+
+# Глобальный экземпляр: общий для планировщика и API
+chat_fetch_coalescer = ChatFetchCoalescer(TelegramService())
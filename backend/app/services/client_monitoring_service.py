@@ -1,13 +1,16 @@
 # backend/app/services/client_monitoring_service.py
-import asyncio
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import List, Dict, Any, Optional
 import re
 
-from ..core.database import supabase_client
+from ..core.repository import repository
 from .telegram_service import TelegramService
 from .openai_service import OpenAIService
+from .keyword_matcher import keyword_matcher_cache
+from .lead_classifier import LeadClassifier
+from .processed_messages import processed_messages
+from .chat_fetch_coalescer import chat_fetch_coalescer
 
 logger = logging.getLogger(__name__)
 
@@ -15,66 +18,7 @@ class ClientMonitoringService:
     def __init__(self):
         self.telegram_service = TelegramService()
         self.openai_service = OpenAIService()
-        self.active_monitoring = {}  # Словарь активных мониторингов по user_id
-        
-    async def start_monitoring(self, user_id: int):
-        """Запустить мониторинг для пользователя"""
-        try:
-            logger.info(f"Starting monitoring for user {user_id}")
-            self.active_monitoring[user_id] = True
-            
-            # Запускаем фоновую задачу мониторинга
-            asyncio.create_task(self._monitoring_loop(user_id))
-            
-        except Exception as e:
-            logger.error(f"Error starting monitoring for user {user_id}: {e}")
-            raise
-    
-    async def stop_monitoring(self, user_id: int):
-        """Остановить мониторинг для пользователя"""
-        try:
-            logger.info(f"Stopping monitoring for user {user_id}")
-            self.active_monitoring[user_id] = False
-            
-        except Exception as e:
-            logger.error(f"Error stopping monitoring for user {user_id}: {e}")
-            raise
-    
-    async def _monitoring_loop(self, user_id: int):
-        """Основной цикл мониторинга для пользователя"""
-        while self.active_monitoring.get(user_id, False):
-            try:
-                # Получаем настройки пользователя
-                settings = await self._get_user_settings(user_id)
-                
-                if not settings or not settings.get('is_active', False):
-                    await asyncio.sleep(60)  # Ждем минуту если мониторинг выключен
-                    continue
-                
-                # Выполняем поиск и анализ
-                await self._search_and_analyze(user_id, settings)
-                
-                # Ждем следующий цикл
-                interval = settings.get('check_interval_minutes', 5) * 60
-                await asyncio.sleep(interval)
-                
-            except Exception as e:
-                logger.error(f"Error in monitoring loop for user {user_id}: {e}")
-                await asyncio.sleep(60)  # Ждем минуту при ошибке
-    
-    async def _get_user_settings(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Получить настройки мониторинга пользователя"""
-        try:
-            result = supabase_client.table('monitoring_settings').select('*').eq('user_id', user_id).execute()
-            
-            if result.data:
-                return result.data[0]
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error getting user settings for {user_id}: {e}")
-            return None
-
+        self.lead_classifier = LeadClassifier.from_settings(self.openai_service.client)
     
     async def _search_and_analyze(self, user_id: int, settings: Dict[str, Any]):
         """Поиск ключевых слов и анализ найденных сообщений"""
@@ -99,29 +43,15 @@ class ClientMonitoringService:
             for chat_id in monitored_chats:
                 try:
                     # Получаем последние сообщения из чата
-                    recent_messages = await self._get_recent_messages(chat_id, lookback_minutes)
+                    recent_messages = await self._get_recent_messages(chat_id, lookback_minutes, user_id)
                     
-                    # Для каждого шаблона ищем ключевые слова
-                    for template in templates:
-                        keywords = template.get('keywords', [])
-                        if not keywords:
-                            continue
-                        
-                        # Ищем сообщения с ключевыми словами
-                        for message in recent_messages:
-                            message_text = message.get('text', '')
-                            matched_keywords = self._find_keywords_in_text(message_text, keywords)
-                            
-                            if matched_keywords:
-                                # Подготавливаем данные для анализа ИИ
-                                message_data = {
-                                    'message': message,
-                                    'template': template,
-                                    'matched_keywords': matched_keywords
-                                }
-                                
-                                # Анализируем через ИИ
-                                await self._analyze_message_with_ai(user_id, message_data, settings)
+                    # Поиск ключевых слов и ИИ-анализ
+                    processed = await self.process_messages(user_id, recent_messages, templates, settings, chat_ref=chat_id)
+                    
+                    # Отметку сдвигаем только после полной обработки чата (включая сохранение
+                    # клиентов): упавший, прерванный или остановленный прогон перечитает сообщения
+                    if processed:
+                        await chat_fetch_coalescer.advance(chat_id, user_id, recent_messages)
                 
                 except Exception as e:
                     logger.error(f"Error processing chat {chat_id}: {e}")
@@ -130,155 +60,176 @@ class ClientMonitoringService:
         except Exception as e:
             logger.error(f"Error in search and analyze: {e}")
     
+    async def process_messages(
+        self,
+        user_id: int,
+        messages: List[Dict[str, Any]],
+        templates: List[Dict[str, Any]],
+        settings: Dict[str, Any],
+        chat_ref: Optional[str] = None
+    ) -> bool:
+        """
+        Прогнать сообщения через поиск ключевых слов и ИИ-анализ
+        
+        Общий этап для периодического опроса и real-time обработки событий.
+        
+        Args:
+            user_id: ID пользователя
+            messages: Сообщения в формате TelegramService.message_to_record
+            templates: Активные шаблоны продуктов пользователя
+            settings: Настройки мониторинга пользователя
+            chat_ref: Чат из monitored_chats пользователя, откуда пришли сообщения
+        
+        Returns:
+            True, если все сообщения обработаны: у кандидатов есть вердикт ИИ,
+            а найденные клиенты сохранены в potential_clients. Только после этого
+            вызывающий код сдвигает high-water mark
+        """
+        if chat_ref is not None and messages:
+            chat_info = await self._get_chat_info(chat_ref)
+            for message in messages:
+                message['chat'] = chat_info
+        
+        # Ключевые слова всех шаблонов ищутся одним проходом по каждому сообщению
+        matcher = keyword_matcher_cache.get(user_id, templates)
+        
+        candidates = []
+        for message in messages:
+            message_text = message.get('text', '')
+            matches = matcher.match(message_text)
+            
+            for template_index, matched_keywords in matches.items():
+                # Подготавливаем данные для анализа ИИ
+                candidates.append({
+                    'message': message,
+                    'template': templates[template_index],
+                    'matched_keywords': matched_keywords
+                })
+        
+        # Анализируем через ИИ - пакетами, а не запросом на каждое совпадение
+        if candidates:
+            return await self._analyze_candidates_with_ai(user_id, candidates, settings)
+        return True
+    
     async def _get_user_templates(self, user_id: int) -> List[Dict[str, Any]]:
         """Получить активные шаблоны пользователя"""
         try:
-            result = supabase_client.table('product_templates').select('*').eq('user_id', user_id).eq('is_active', True).execute()
-            
-            return result.data or []
+            return await repository.list_product_templates(user_id, active_only=True)
             
         except Exception as e:
             logger.error(f"Error getting user templates: {e}")
             return []
     
-    async def _get_recent_messages(self, chat_id: str, lookback_minutes: int) -> List[Dict[str, Any]]:
-        """Получить последние сообщения из чата"""
+    async def _get_recent_messages(self, chat_id: str, lookback_minutes: int, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Получить последние сообщения из чата
+        
+        Загрузка общая для всех пользователей, мониторящих чат (ChatFetchCoalescer);
+        для известного пользователя возвращаются только сообщения, появившиеся
+        после его прошлого опроса.
+        """
         try:
-            # Рассчитываем время для поиска сообщений
-            lookback_days = max(1, lookback_minutes // (24 * 60))  # Минимум 1 день
+            # Пока бюджет истории заблокирован FloodWait, фоновый мониторинг уступает
+            # интерактивным запросам; пропущенное догрузится по high-water mark
+            if self.telegram_service.is_flood_limited('history'):
+                logger.info(f"History requests are flood-limited, skipping chat {chat_id} this cycle")
+                return []
             
-            # Получаем сообщения через Telegram service
-            messages = await self.telegram_service.get_group_messages(
-                group_id=chat_id,
-                limit=100,  # Ограничиваем количество для скорости
-                days_back=lookback_days,
-                get_users=True
-            )
-            
-            # Фильтруем сообщения по времени
-            cutoff_time = datetime.now() - timedelta(minutes=lookback_minutes)
-            
-            recent_messages = []
-            for msg in messages:
-                try:
-                    msg_time = datetime.fromisoformat(msg['date'].replace('Z', '+00:00'))
-                    if msg_time >= cutoff_time:
-                        recent_messages.append(msg)
-                except:
-                    continue
-            
-            return recent_messages
+            # Сообщения за окно lookback_minutes из общего буфера чата
+            return await chat_fetch_coalescer.get_new_messages(chat_id, lookback_minutes, user_id)
             
         except Exception as e:
             logger.error(f"Error getting recent messages from {chat_id}: {e}")
             return []
     
-    def _find_keywords_in_text(self, text: str, keywords: List[str]) -> List[str]:
-        """Найти ключевые слова в тексте"""
-        if not text:
-            return []
-        
-        text_lower = text.lower()
-        matched_keywords = []
-        
-        for keyword in keywords:
-            keyword_lower = keyword.lower().strip()
-            
-            # Простой поиск подстроки
-            if keyword_lower in text_lower:
-                matched_keywords.append(keyword)
-        
-        return matched_keywords
-    
-    async def _analyze_message_with_ai(
-        self, 
-        user_id: int, 
-        message_data: Dict[str, Any], 
+    async def _analyze_candidates_with_ai(
+        self,
+        user_id: int,
+        candidates: List[Dict[str, Any]],
         settings: Dict[str, Any]
-    ):
-        """Анализ сообщения через ИИ и сохранение результата"""
+    ) -> bool:
+        """
+        Пакетный анализ кандидатов через ИИ и сохранение результатов
+        
+        Returns:
+            False, если часть сообщений осталась без вердикта, клиент не сохранился
+            или анализ упал
+        """
         try:
-            message = message_data['message']
-            template = message_data['template']
-            matched_keywords = message_data['matched_keywords']
-            
-            # Проверяем, не анализировали ли мы уже это сообщение
-            if await self._is_message_already_processed(message.get('message_id'), user_id):
-                return
-            
-            # Создаем промпт для ИИ анализа
-            ai_prompt = f"""
-            Проанализируй сообщение пользователя на предмет намерения купить товар/услугу.
-            
-            Продукт: {template['name']}
-            Ключевые слова: {', '.join(template['keywords'])}
-            Сообщение: "{message.get('text', '')}"
-            Найденные ключевые слова: {', '.join(matched_keywords)}
-            
-            Оцени по шкале от 1 до 10:
-            1. Уверенность в том, что это потенциальный покупатель
-            2. Тип намерения (поиск информации, готовность к покупке, сравнение вариантов)
-            
-            Ответь в формате JSON:
-            {{
-                "confidence": число от 1 до 10,
-                "intent_type": "информация/покупка/сравнение/другое",
-                "reasoning": "объяснение анализа"
-            }}
-            """
-            
-            # Отправляем запрос к ИИ (здесь используется заглушка)
-            ai_result = await self._call_ai_analysis(ai_prompt)
+            # Проверяем, не анализировали ли мы уже эти сообщения: память процесса,
+            # затем один запрос к БД на весь цикл
+            keys = [self._message_key(candidate['message']) for candidate in candidates]
+            unprocessed = await processed_messages.filter_unprocessed(user_id, keys)
+            pending = [candidate for candidate, key in zip(candidates, keys) if key in unprocessed]
+            
+            if not pending:
+                return True
+            
+            ai_results = await self.lead_classifier.classify(pending)
+            
+            # Сообщения без вердикта (ошибка запроса, битый ответ) остаются необработанными
+            failed_keys = {
+                self._message_key(candidate['message'])
+                for candidate, ai_result in zip(pending, ai_results)
+                if ai_result.get('error')
+            }
             
-            # Проверяем минимальную уверенность
+            # Проверяем минимальную уверенность; сообщение сохраняется один раз -
+            # по первому шаблону, для которого ИИ уверен в намерении
             min_confidence = settings.get('min_ai_confidence', 7)
-            if ai_result.get('confidence', 0) >= min_confidence:
-                # Сохраняем потенциального клиента
-                await self._save_potential_client(user_id, message_data, ai_result)
+            saved_messages = set()
+            for message_data, ai_result in zip(pending, ai_results):
+                key = self._message_key(message_data['message'])
+                if key in saved_messages or key in failed_keys or ai_result.get('confidence', 0) < min_confidence:
+                    continue
+                
+                # Сохраняем потенциального клиента; не сохраненный лид разберем заново
+                if not await self._save_potential_client(user_id, message_data, ai_result):
+                    failed_keys.add(key)
+                    continue
+                saved_messages.add(key)
                 
                 # Отправляем уведомление
                 notification_account = settings.get('notification_account')
                 await self._send_notification(notification_account, message_data, ai_result)
             
-        except Exception as e:
-            logger.error(f"Error analyzing message with AI: {e}")
-    
-    async def _is_message_already_processed(self, message_id: str, user_id: int) -> bool:
-        """Проверить, обрабатывалось ли уже это сообщение"""
-        try:
-            if not message_id:
-                return False
+            # Повторно на ИИ не отправляем, даже если клиент не подтвердился:
+            # окна опроса пересекаются, а ответ модели для сообщения не изменится
+            for chat_id, message_id in {self._message_key(candidate['message']) for candidate in pending} - failed_keys:
+                processed_messages.add(user_id, chat_id, message_id)
+            if failed_keys:
+                logger.warning(f"AI analysis for user {user_id}: {len(failed_keys)} messages not processed, will retry")
             
-            result = supabase_client.table('potential_clients').select('id').eq('message_id', message_id).eq('user_id', user_id).execute()
-            
-            return bool(result.data)
+            logger.info(f"AI analysis for user {user_id}: {len(pending)} candidates, {len(saved_messages)} potential clients")
+            return not failed_keys
             
         except Exception as e:
-            logger.error(f"Error checking if message processed: {e}")
+            logger.error(f"Error analyzing messages with AI: {e}")
             return False
     
-    async def _call_ai_analysis(self, prompt: str) -> Dict[str, Any]:
-        """Вызов ИИ для анализа (заглушка)"""
+    @staticmethod
+    def _message_key(message: Dict[str, Any]):
+        """Ключ дедупликации сообщения: (chat_id, message_id)"""
+        chat_id = (message.get('chat') or {}).get('id')
+        return (str(chat_id) if chat_id is not None else '', str(message.get('message_id')))
+    
+    async def _get_chat_info(self, chat_ref: str) -> Dict[str, Any]:
+        """id и название чата для сохранения клиента и уведомления (entity из кэша)"""
+        chat_info = {'id': str(chat_ref), 'title': None}
         try:
-            # TODO: Реализовать реальный вызов OpenAI API
-            # Сейчас возвращаем заглушку
-            return {
-                "confidence": 8,
-                "intent_type": "покупка",
-                "reasoning": "Пользователь явно ищет товар и готов к покупке"
-            }
-            
+            entity = await self.telegram_service.get_entity(chat_ref)
+            chat_info['title'] = getattr(entity, 'title', None)
         except Exception as e:
-            logger.error(f"Error calling AI analysis: {e}")
-            return {"confidence": 0, "intent_type": "unknown", "reasoning": "Ошибка анализа"}
+            logger.warning(f"Failed to get chat info for {chat_ref}: {e}")
+        return chat_info
     
     async def _save_potential_client(
         self, 
         user_id: int, 
         message_data: Dict[str, Any], 
         ai_result: Dict[str, Any]
-    ):
-        """Сохранить потенциального клиента в базу данных"""
+    ) -> bool:
+        """Сохранить потенциального клиента в базу данных; False, если запись не сохранилась"""
         try:
             message = message_data['message']
             template = message_data['template']
@@ -304,13 +255,15 @@ class ClientMonitoringService:
                 'created_at': datetime.now().isoformat()
             }
             
-            result = supabase_client.table('potential_clients').insert(client_data).execute()
+            result = await repository.insert_potential_client(client_data)
             
-            if result.data:
+            if result:
                 logger.info(f"Saved potential client: {author.get('username', 'unknown')}")
+            return bool(result)
             
         except Exception as e:
             logger.error(f"Error saving potential client: {e}")
+            return False
     
     async def _send_notification(
         self, 
@@ -0,0 +1,126 @@
+# backend/app/services/entity_cache.py
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from telethon import utils
+from telethon.tl.types import User
+
+logger = logging.getLogger(__name__)
+
+_TME_LINK_RE = re.compile(r'^(?:https?://)?(?:www\.)?(?:t\.me|telegram\.me)/(.+)$', re.IGNORECASE)
+
+
+def entity_ref_key(entity_ref: Any) -> str:
+    """
+    Нормализовать ссылку на группу/пользователя в ключ кэша
+
+    Поддерживаемые формы:
+    - числовой id (123, "123") -> id:123
+    - marked id ("-100123", -100123) -> peer:-100123
+    - @username, username, t.me/username -> username:username
+    - t.me/+hash, t.me/joinchat/hash -> invite:hash
+    """
+    if isinstance(entity_ref, int):
+        return f"peer:{entity_ref}" if entity_ref < 0 else f"id:{entity_ref}"
+
+    ref = str(entity_ref).strip()
+
+    if ref.lstrip('-').isdigit():
+        return entity_ref_key(int(ref))
+
+    link_match = _TME_LINK_RE.match(ref)
+    if link_match:
+        path = link_match.group(1).strip('/')
+        if path.startswith('+'):
+            return f"invite:{path[1:]}"
+        if path.startswith('joinchat/'):
+            return f"invite:{path[len('joinchat/'):]}"
+        ref = path.split('/')[0]
+
+    return f"username:{ref.lstrip('@').lower()}"
+
+
+def entity_keys(entity) -> List[str]:
+    """Все ключи, под которыми сущность может быть запрошена повторно"""
+    # Голый id канала/чата пересекается с id пользователей (id:123 у пользователя
+    # и у канала -100123), поэтому группы хранятся только под marked id
+    keys = [f"id:{entity.id}"] if isinstance(entity, User) else []
+    try:
+        keys.append(f"peer:{utils.get_peer_id(entity)}")
+    except Exception:
+        pass
+
+    username = getattr(entity, 'username', None)
+    if username:
+        keys.append(f"username:{username.lower()}")
+    return keys
+
+
+class EntityCache:
+    """
+    Кэш разрешенных сущностей Telegram.
+
+    Хранит сами объекты сущностей (вместе с access_hash), поэтому повторные
+    вызовы передают в Telethon готовую сущность и обходятся без RPC.
+    Неудачные разрешения кэшируются отдельно с коротким TTL.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, negative_ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._items: "OrderedDict[str, Tuple[float, Optional[Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, entity_ref: Any) -> Tuple[bool, Optional[Any]]:
+        """Вернуть (найдено, сущность). Сущность None — закэшированный промах"""
+        key = entity_ref_key(entity_ref)
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return False, None
+
+        expires_at, entity = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            self.misses += 1
+            return False, None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return True, entity
+
+    def set(self, entity_ref: Any, entity):
+        """Сохранить сущность под ключом запроса и всеми ее собственными ключами"""
+        expires_at = time.monotonic() + self.ttl_seconds
+        keys = {entity_ref_key(entity_ref), *entity_keys(entity)}
+        for key in keys:
+            self._put(key, expires_at, entity)
+
+    def set_negative(self, entity_ref: Any):
+        """Запомнить, что ссылка не разрешается"""
+        self._put(entity_ref_key(entity_ref), time.monotonic() + self.negative_ttl_seconds, None)
+
+    def invalidate(self, entity_ref: Any):
+        self._items.pop(entity_ref_key(entity_ref), None)
+
+    def clear(self):
+        self._items.clear()
+
+    def _put(self, key: str, expires_at: float, entity):
+        self._items[key] = (expires_at, entity)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
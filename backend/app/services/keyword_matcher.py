@@ -0,0 +1,148 @@
+# backend/app/services/keyword_matcher.py
+import logging
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class KeywordMatcher:
+    """
+    Поиск ключевых слов всех шаблонов пользователя за один проход по тексту
+
+    Ключевые слова всех шаблонов (без учета регистра) компилируются в один автомат
+    Ахо-Корасик; каждое совпадение отображается обратно в (шаблон, ключевое слово).
+    Семантика та же, что у поиска подстроки: ключевое слово совпадает, если входит в текст.
+    """
+
+    def __init__(self, templates: List[Dict[str, Any]]):
+        self.templates = templates
+
+        # Автомат: переходы, суффиксные ссылки и номера паттернов, заканчивающихся в узле
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[int]] = [[]]
+
+        # Паттерн (ключевое слово в нижнем регистре) -> [(индекс шаблона, позиция слова, исходное слово)]
+        self._targets: List[List[Tuple[int, int, str]]] = []
+        pattern_ids: Dict[str, int] = {}
+
+        for template_index, template in enumerate(templates):
+            for position, keyword in enumerate(template.get('keywords') or []):
+                pattern = str(keyword).lower().strip()
+                if not pattern:
+                    continue
+                if pattern not in pattern_ids:
+                    pattern_ids[pattern] = len(self._targets)
+                    self._targets.append([])
+                    self._add_pattern(pattern, pattern_ids[pattern])
+                self._targets[pattern_ids[pattern]].append((template_index, position, keyword))
+
+        self._build_failure_links()
+        self.patterns_count = len(self._targets)
+
+    def _add_pattern(self, pattern: str, pattern_id: int):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+                self._goto[node][char] = next_node
+            node = next_node
+        self._outputs[node].append(pattern_id)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                if node:
+                    fail = self._fail[node]
+                    while fail and char not in self._goto[fail]:
+                        fail = self._fail[fail]
+                    self._fail[child] = self._goto[fail].get(char, 0)
+                # Паттерны, оканчивающиеся в суффиксе, тоже оканчиваются здесь
+                self._outputs[child] = self._outputs[child] + self._outputs[self._fail[child]]
+
+    def match(self, text: str) -> Dict[int, List[str]]:
+        """
+        Найти ключевые слова в тексте
+
+        Returns:
+            {индекс шаблона: совпавшие ключевые слова в порядке шаблона}
+        """
+        if not text or not self._targets:
+            return {}
+
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        found = set()
+
+        node = 0
+        for char in text.lower():
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if outputs[node]:
+                found.update(outputs[node])
+
+        hits: Dict[int, List[Tuple[int, str]]] = {}
+        for pattern_id in found:
+            for template_index, position, keyword in self._targets[pattern_id]:
+                hits.setdefault(template_index, []).append((position, keyword))
+
+        return {
+            template_index: [keyword for _, keyword in sorted(matches, key=lambda item: item[0])]
+            for template_index, matches in sorted(hits.items())
+        }
+
+
+class KeywordMatcherCache:
+    """
+    Скомпилированные автоматы по пользователям
+
+    Автомат пересобирается, если изменился набор шаблонов (id и updated_at)
+    или кэш пользователя сброшен явно при изменении шаблона через API.
+    """
+
+    def __init__(self):
+        self._matchers: Dict[int, Tuple[Tuple, KeywordMatcher]] = {}
+        self.stats = {'hits': 0, 'compilations': 0, 'invalidations': 0}
+
+    @staticmethod
+    def _fingerprint(templates: List[Dict[str, Any]]) -> Tuple:
+        return tuple(
+            (template.get('id'), template.get('updated_at'), tuple(template.get('keywords') or []))
+            for template in templates
+        )
+
+    def get(self, user_id: int, templates: List[Dict[str, Any]]) -> KeywordMatcher:
+        fingerprint = self._fingerprint(templates)
+        cached: Optional[Tuple[Tuple, KeywordMatcher]] = self._matchers.get(user_id)
+        if cached and cached[0] == fingerprint:
+            self.stats['hits'] += 1
+            # Шаблоны могли перечитаться из БД - отдаем актуальные объекты
+            cached[1].templates = templates
+            return cached[1]
+
+        matcher = KeywordMatcher(templates)
+        self._matchers[user_id] = (fingerprint, matcher)
+        self.stats['compilations'] += 1
+        logger.info(f"Compiled keyword matcher for user {user_id}: {len(templates)} templates, {matcher.patterns_count} keywords")
+        return matcher
+
+    def invalidate(self, user_id: int):
+        if self._matchers.pop(user_id, None) is not None:
+            self.stats['invalidations'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, 'users': len(self._matchers)}
+
+
+# Глобальный кэш автоматов
+keyword_matcher_cache = KeywordMatcherCache()
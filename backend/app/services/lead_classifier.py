@@ -0,0 +1,197 @@
+# backend/app/services/lead_classifier.py
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Сколько символов сообщения отправлять модели
+MAX_MESSAGE_CHARS = 1000
+
+SYSTEM_PROMPT = """Ты - эксперт по поиску потенциальных клиентов в сообщениях Telegram-чатов.
+Для каждого сообщения оцени намерение автора купить товар/услугу из указанного продукта.
+
+Оцени по шкале от 1 до 10:
+1. Уверенность в том, что это потенциальный покупатель
+2. Тип намерения (поиск информации, готовность к покупке, сравнение вариантов)
+
+Ответь строго JSON-объектом:
+{
+    "results": [
+        {
+            "id": номер сообщения из запроса,
+            "confidence": число от 1 до 10,
+            "intent_type": "информация/покупка/сравнение/другое",
+            "reasoning": "краткое объяснение анализа"
+        }
+    ]
+}
+Верни результат для каждого сообщения из запроса."""
+
+
+def _fallback_result(reasoning: str) -> Dict[str, Any]:
+    """Результат без вердикта модели: error отличает его от настоящего "не клиент" """
+    return {"confidence": 0, "intent_type": "unknown", "reasoning": reasoning, "error": reasoning}
+
+
+class OpenAILeadBackend:
+    """Классификация через OpenAI Chat Completions с JSON-ответом"""
+
+    def __init__(self, client, model: str):
+        self.client = client
+        self.model = model
+
+    async def complete(self, system_prompt: str, user_prompt: str, items: List[Dict[str, Any]]) -> str:
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.2,
+            max_tokens=150 * len(items) + 200
+        )
+        return response.choices[0].message.content
+
+
+class StubLeadBackend:
+    """
+    Локальная заглушка модели для тестов и разработки
+
+    Не обращается к API: отвечает в том же JSON-формате, что и модель,
+    поэтому упаковка и разбор ответа проверяются так же, как в бою.
+    """
+
+    def __init__(self, confidence: int = 8, intent_type: str = "покупка"):
+        self.confidence = confidence
+        self.intent_type = intent_type
+        self.calls = 0
+
+    async def complete(self, system_prompt: str, user_prompt: str, items: List[Dict[str, Any]]) -> str:
+        self.calls += 1
+        return json.dumps({
+            "results": [
+                {
+                    "id": item['id'],
+                    "confidence": self.confidence,
+                    "intent_type": self.intent_type,
+                    "reasoning": f"Заглушка: найдены ключевые слова {', '.join(item['matched_keywords'])}"
+                }
+                for item in items
+            ]
+        }, ensure_ascii=False)
+
+
+class LeadClassifier:
+    """
+    Пакетная классификация сообщений-кандидатов в потенциальные клиенты
+
+    Кандидаты (сообщение + шаблон + найденные ключевые слова) упаковываются
+    по batch_size в один запрос со структурированным JSON-ответом; пакеты
+    выполняются параллельно, не более concurrency одновременно.
+    """
+
+    def __init__(self, backend, batch_size: int = 20, concurrency: int = 3):
+        self.backend = backend
+        self.batch_size = max(1, batch_size)
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.stats = {'requests': 0, 'candidates': 0, 'failed_requests': 0, 'missing_results': 0}
+
+    @classmethod
+    def from_settings(cls, openai_client=None) -> "LeadClassifier":
+        if settings.LEAD_CLASSIFIER_BACKEND == "stub" or openai_client is None:
+            backend = StubLeadBackend()
+        else:
+            backend = OpenAILeadBackend(openai_client, settings.LEAD_CLASSIFIER_MODEL)
+        return cls(
+            backend,
+            batch_size=settings.LEAD_CLASSIFIER_BATCH_SIZE,
+            concurrency=settings.LEAD_CLASSIFIER_CONCURRENCY
+        )
+
+    async def classify(self, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Классифицировать кандидатов
+
+        Args:
+            candidates: [{'message', 'template', 'matched_keywords'}]
+
+        Returns:
+            Результаты {'confidence', 'intent_type', 'reasoning', 'error'} в порядке кандидатов;
+            error не None, если модель не дала вердикта (ошибка запроса, битый ответ, пропуск)
+        """
+        if not candidates:
+            return []
+
+        batches = [
+            candidates[start:start + self.batch_size]
+            for start in range(0, len(candidates), self.batch_size)
+        ]
+        results = await asyncio.gather(*(self._classify_batch(batch) for batch in batches))
+        return [result for batch_results in results for result in batch_results]
+
+    async def _classify_batch(self, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        items = [
+            {
+                'id': index,
+                'product': candidate['template'].get('name'),
+                'product_keywords': candidate['template'].get('keywords') or [],
+                'matched_keywords': candidate['matched_keywords'],
+                'text': (candidate['message'].get('text') or '')[:MAX_MESSAGE_CHARS]
+            }
+            for index, candidate in enumerate(candidates)
+        ]
+        user_prompt = "Сообщения для анализа:\n" + json.dumps(items, ensure_ascii=False, indent=1)
+
+        async with self._semaphore:
+            self.stats['requests'] += 1
+            self.stats['candidates'] += len(items)
+            try:
+                response_text = await self.backend.complete(SYSTEM_PROMPT, user_prompt, items)
+            except Exception as e:
+                self.stats['failed_requests'] += 1
+                logger.error(f"Lead classification request failed for {len(items)} messages: {e}")
+                return [_fallback_result("Ошибка анализа") for _ in items]
+
+        return self._parse_results(response_text, len(items))
+
+    def _parse_results(self, response_text: Optional[str], count: int) -> List[Dict[str, Any]]:
+        """Разобрать JSON-ответ модели в результаты по номерам сообщений"""
+        try:
+            payload = json.loads(response_text or '{}')
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse lead classification response: {e}")
+            self.stats['failed_requests'] += 1
+            return [_fallback_result("Некорректный ответ модели") for _ in range(count)]
+
+        entries = payload.get('results', []) if isinstance(payload, dict) else []
+        by_id: Dict[int, Dict[str, Any]] = {}
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            try:
+                item_id = int(entry.get('id'))
+                confidence = int(round(float(entry.get('confidence', 0))))
+            except (TypeError, ValueError):
+                continue
+            if 0 <= item_id < count:
+                by_id[item_id] = {
+                    'confidence': max(0, min(10, confidence)),
+                    'intent_type': str(entry.get('intent_type') or 'unknown'),
+                    'reasoning': str(entry.get('reasoning') or ''),
+                    'error': None
+                }
+
+        missing = count - len(by_id)
+        if missing:
+            self.stats['missing_results'] += missing
+            logger.warning(f"Lead classification response has no result for {missing} of {count} messages")
+
+        return [by_id.get(index) or _fallback_result("Нет ответа модели") for index in range(count)]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, 'backend': type(self.backend).__name__, 'batch_size': self.batch_size}
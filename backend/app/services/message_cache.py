@@ -0,0 +1,231 @@
+# backend/app/services/message_cache.py
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from ..core.config import settings
+from .message_record import MessageRecord
+
+logger = logging.getLogger(__name__)
+
+# Как часто удалять сообщения старше срока хранения
+PRUNE_INTERVAL_SECONDS = 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    group_id TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    date_ts REAL NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (group_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_group_date ON messages (group_id, date_ts);
+CREATE TABLE IF NOT EXISTS coverage (
+    group_id TEXT PRIMARY KEY,
+    covered_from_ts REAL NOT NULL,
+    covered_to_id INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    revalidated_at REAL NOT NULL DEFAULT 0
+);
+"""
+
+# Профиль отправителя не затирается загрузкой без get_users (user_info = null)
+_UPSERT_MESSAGES = """
+INSERT INTO messages (group_id, message_id, date_ts, data) VALUES (?, ?, ?, ?)
+ON CONFLICT(group_id, message_id) DO UPDATE SET
+    date_ts = excluded.date_ts,
+    data = CASE
+        WHEN json_extract(excluded.data, '$.user_info') IS NULL
+             AND json_extract(messages.data, '$.user_info') IS NOT NULL
+        THEN json_set(excluded.data, '$.user_info', json(json_extract(messages.data, '$.user_info')))
+        ELSE excluded.data
+    END
+"""
+
+
+def _timestamp(iso_date: str) -> float:
+    return datetime.fromisoformat(iso_date.replace('Z', '+00:00')).timestamp()
+
+
+class MessageCache:
+    """
+    Локальный кэш сообщений групп в SQLite (WAL)
+
+    Сообщения хранятся по ключу (group_id, message_id) с индексом по дате.
+    Для каждой группы ведется покрытие: все сообщения с датой не раньше
+    covered_from_ts и id не больше covered_to_id гарантированно есть в кэше
+    (covered_from_ts = 0 - вся история группы). Запросы внутри покрытия
+    отвечаются локально, из Telegram догружается только то, что новее covered_to_id.
+    revalidated_at - время последней полной загрузки покрытия: правки и удаления
+    старых сообщений попадают в кэш, когда покрытие перезагружается целиком.
+
+    Все обращения к SQLite идут через один поток, WAL позволяет читать
+    файл параллельно из других процессов.
+    """
+
+    def __init__(self, path: str, retention_days: int):
+        self.path = path
+        self.retention_days = retention_days
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="message-cache")
+        self._connection: Optional[sqlite3.Connection] = None
+        self._last_prune = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'deleted': 0, 'revalidations': 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            try:
+                # Файлы кэша, созданные до появления revalidated_at
+                connection.execute("ALTER TABLE coverage ADD COLUMN revalidated_at REAL NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError:
+                pass
+            self._connection = connection
+            logger.info(f"Message cache opened at {self.path}")
+        return self._connection
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # ==================== ПОКРЫТИЕ ====================
+
+    async def get_coverage(self, group_id: str) -> Optional[Dict[str, Any]]:
+        """Покрытие группы: {'covered_from_ts', 'covered_to_id', 'revalidated_at'} или None"""
+        def query():
+            row = self._connect().execute(
+                "SELECT covered_from_ts, covered_to_id, revalidated_at FROM coverage WHERE group_id = ?",
+                (group_id,)
+            ).fetchone()
+            return {'covered_from_ts': row[0], 'covered_to_id': row[1], 'revalidated_at': row[2]} if row else None
+
+        return await self._run(query)
+
+    async def set_coverage(self, group_id: str, covered_from_ts: float, covered_to_id: int, revalidated: bool = False):
+        """Записать покрытие; revalidated - покрытие целиком только что загружено из Telegram"""
+        def write():
+            connection = self._connect()
+            now = time.time()
+            connection.execute(
+                "INSERT INTO coverage (group_id, covered_from_ts, covered_to_id, updated_at, revalidated_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(group_id) DO UPDATE SET covered_from_ts = excluded.covered_from_ts, "
+                "covered_to_id = excluded.covered_to_id, updated_at = excluded.updated_at, "
+                "revalidated_at = MAX(coverage.revalidated_at, excluded.revalidated_at)",
+                (group_id, covered_from_ts, covered_to_id, now, now if revalidated else 0)
+            )
+            connection.commit()
+
+        await self._run(write)
+
+    async def drop_coverage(self, group_id: str):
+        def write():
+            connection = self._connect()
+            connection.execute("DELETE FROM coverage WHERE group_id = ?", (group_id,))
+            connection.commit()
+
+        await self._run(write)
+
+    # ==================== СООБЩЕНИЯ ====================
+
+    async def store(self, group_id: str, messages: List[Dict[str, Any]]):
+        """Сохранить (или обновить) сообщения группы"""
+        if not messages:
+            return
+
+        rows = [
+            (group_id, int(msg['message_id']), _timestamp(msg['date']), json.dumps(dict(msg), ensure_ascii=False))
+            for msg in messages
+        ]
+
+        def write():
+            connection = self._connect()
+            connection.executemany(_UPSERT_MESSAGES, rows)
+            connection.commit()
+            self._prune_if_due(connection)
+
+        await self._run(write)
+        self.stats['stored'] += len(rows)
+
+    async def delete_missing(self, group_id: str, keep_ids: List[int], from_ts: float, to_id: int):
+        """
+        Удалить сообщения непрерывного участка (date_ts >= from_ts, id <= to_id),
+        которых нет среди только что загруженных - они удалены в Telegram
+        """
+        def write():
+            connection = self._connect()
+            existing = connection.execute(
+                "SELECT message_id FROM messages WHERE group_id = ? AND date_ts >= ? AND message_id <= ?",
+                (group_id, from_ts, to_id)
+            ).fetchall()
+            missing = [(group_id, row[0]) for row in existing if row[0] not in keep]
+            if missing:
+                connection.executemany("DELETE FROM messages WHERE group_id = ? AND message_id = ?", missing)
+                connection.commit()
+            return len(missing)
+
+        keep = set(keep_ids)
+        deleted = await self._run(write)
+        self.stats['deleted'] += deleted
+
+    async def query(self, group_id: str, since_ts: float, limit: int) -> List[MessageRecord]:
+        """Самые новые сообщения группы с датой не раньше since_ts (от новых к старым)"""
+        def read():
+            rows = self._connect().execute(
+                "SELECT data FROM messages WHERE group_id = ? AND date_ts >= ? "
+                "ORDER BY message_id DESC LIMIT ?",
+                (group_id, since_ts, limit)
+            ).fetchall()
+            return [MessageRecord.from_dict(json.loads(row[0])) for row in rows]
+
+        return await self._run(read)
+
+    def _prune_if_due(self, connection: sqlite3.Connection):
+        """Удалить сообщения старше срока хранения и сузить покрытие"""
+        now = time.time()
+        if now - self._last_prune < PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+
+        cutoff_ts = now - self.retention_days * 24 * 60 * 60
+        deleted = connection.execute("DELETE FROM messages WHERE date_ts < ?", (cutoff_ts,)).rowcount
+        connection.execute(
+            "UPDATE coverage SET covered_from_ts = ? WHERE covered_from_ts < ?",
+            (cutoff_ts, cutoff_ts)
+        )
+        connection.commit()
+        if deleted:
+            logger.info(f"Message cache pruned {deleted} messages older than {self.retention_days} days")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, 'path': self.path}
+
+    def close(self):
+        def shutdown():
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+        try:
+            self._executor.submit(shutdown).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"Error closing message cache: {e}")
+        self._executor.shutdown(wait=False)
+
+
+# Глобальный экземпляр (None, если кэш выключен)
+message_cache: Optional[MessageCache] = (
+    MessageCache(settings.MESSAGE_CACHE_PATH, settings.MESSAGE_CACHE_RETENTION_DAYS)
+    if settings.MESSAGE_CACHE_ENABLED else None
+)
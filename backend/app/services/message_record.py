@@ -0,0 +1,112 @@
+# backend/app/services/message_record.py
+from typing import Any, Dict, Iterator, List, Optional
+
+# Поля сообщения в порядке, в котором их отдает API
+MESSAGE_FIELDS = (
+    'message_id',
+    'text',
+    'date',
+    'sender_id',
+    'is_reply',
+    'reply_to_message_id',
+    'forward_from',
+    'media_type',
+    'edit_date',
+    'views',
+    'user_info'
+)
+_FIELD_SET = frozenset(MESSAGE_FIELDS)
+
+
+class MessageRecord:
+    """
+    Компактное представление сообщения внутри сервисов
+
+    Поля хранятся в __slots__ вместо словаря на каждое сообщение. Для совместимости
+    с кодом, который работает со словарями сообщений, поддерживаются msg['key'],
+    msg.get(), 'key' in msg, присваивание и распаковка {**msg}. Ключи вне
+    MESSAGE_FIELDS (например, chat) хранятся в extra, которое создается только при
+    первом таком присваивании. В словарь запись превращается только на границе
+    API / сериализации (to_dict).
+    """
+
+    __slots__ = MESSAGE_FIELDS + ('extra',)
+
+    def __init__(
+        self,
+        message_id: str,
+        text: str,
+        date: str,
+        sender_id: Optional[str] = None,
+        is_reply: bool = False,
+        reply_to_message_id: Optional[str] = None,
+        forward_from: Optional[Dict[str, Any]] = None,
+        media_type: Optional[str] = None,
+        edit_date: Optional[str] = None,
+        views: Optional[int] = None,
+        user_info: Optional[Dict[str, Any]] = None
+    ):
+        self.message_id = message_id
+        self.text = text
+        self.date = date
+        self.sender_id = sender_id
+        self.is_reply = is_reply
+        self.reply_to_message_id = reply_to_message_id
+        self.forward_from = forward_from
+        self.media_type = media_type
+        self.edit_date = edit_date
+        self.views = views
+        self.user_info = user_info
+        self.extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MessageRecord":
+        record = cls(**{field: data.get(field) for field in MESSAGE_FIELDS if field in data})
+        for key, value in data.items():
+            if key not in _FIELD_SET:
+                record[key] = value
+        return record
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _FIELD_SET:
+            return getattr(self, key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key in _FIELD_SET:
+            setattr(self, key, value)
+            return
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __contains__(self, key: object) -> bool:
+        return key in _FIELD_SET or (self.extra is not None and key in self.extra)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(MESSAGE_FIELDS) + (len(self.extra) if self.extra else 0)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> List[str]:
+        if self.extra:
+            return list(MESSAGE_FIELDS) + list(self.extra)
+        return list(MESSAGE_FIELDS)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {field: getattr(self, field) for field in MESSAGE_FIELDS}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __repr__(self) -> str:
+        return f"MessageRecord(message_id={self.message_id!r}, date={self.date!r})"
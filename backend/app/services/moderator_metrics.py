@@ -0,0 +1,150 @@
+# backend/app/services/moderator_metrics.py
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .reply_index import ReplyIndex
+
+# Перцентили времени ответа в отчете
+RESPONSE_TIME_PERCENTILES = (50, 90, 99)
+
+
+def _sender_id(msg: Dict[str, Any]) -> int:
+    try:
+        return int(msg.get('sender_id') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _response_time_stats(values: np.ndarray) -> Dict[str, Optional[float]]:
+    """Среднее, минимум, максимум и перцентили времени ответа (в минутах)"""
+    if values.size == 0:
+        stats = {'avg': None, 'min': None, 'max': None}
+        stats.update({f'p{p}': None for p in RESPONSE_TIME_PERCENTILES})
+        return stats
+
+    percentiles = np.percentile(values, RESPONSE_TIME_PERCENTILES)
+    stats = {'avg': float(values.mean()), 'min': float(values.min()), 'max': float(values.max())}
+    stats.update({f'p{p}': float(value) for p, value in zip(RESPONSE_TIME_PERCENTILES, percentiles)})
+    return stats
+
+
+class MessageArrays:
+    """
+    Окно сообщений в виде массивов NumPy
+
+    Строится один раз по ReplyIndex: время (epoch, NaN - без даты), отправитель
+    (0 - неизвестен), позиция родителя и корня цепочки (-1 - родителя нет в окне).
+    """
+
+    def __init__(self, index: ReplyIndex):
+        self.ids: List[str] = list(index.messages)
+        positions = {message_id: pos for pos, message_id in enumerate(self.ids)}
+
+        self.timestamps = np.array(
+            [np.nan if index.timestamps[message_id] is None else index.timestamps[message_id] for message_id in self.ids],
+            dtype=np.float64
+        )
+        self.senders = np.array([_sender_id(index.messages[message_id]) for message_id in self.ids], dtype=np.int64)
+        self.parents = np.array([positions.get(index.parents.get(message_id), -1) for message_id in self.ids], dtype=np.int64)
+        self.roots = np.array([positions[index.root_id(message_id)] for message_id in self.ids], dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def calculate_moderator_metrics(
+    index: ReplyIndex,
+    moderators: List[Dict[str, Any]]
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Метрики работы модераторов по окну сообщений
+
+    Модератор определяется по telegram_id из списка модераторов группы.
+    Время первого ответа - от корня цепочки (сообщения не модератора) до самого
+    раннего сообщения модератора в этой цепочке; оно засчитывается ответившему модератору.
+
+    Args:
+        index: Граф ответов окна
+        moderators: Модераторы группы (get_moderators)
+
+    Returns:
+        (метрики, {id корня цепочки: {'moderator_involved', 'first_moderator_response_time'}})
+    """
+    arrays = MessageArrays(index)
+    count = len(arrays)
+    positions = np.arange(count)
+
+    moderator_ids = np.array(
+        sorted({int(mod['telegram_id']) for mod in moderators if mod.get('telegram_id')}),
+        dtype=np.int64
+    )
+    moderators_count = len(moderator_ids)
+    slots = max(moderators_count, 1)
+
+    # Цепочки: корни, у которых в окне есть ответы
+    thread_sizes = np.bincount(arrays.roots, minlength=count)
+    is_root = arrays.roots == positions
+    thread_roots = positions[is_root & (thread_sizes > 1)]
+    in_thread = thread_sizes[arrays.roots] > 1
+
+    # Сообщения модераторов и номер модератора в moderator_ids
+    is_moderator = np.isin(arrays.senders, moderator_ids)
+    moderator_pos = np.searchsorted(moderator_ids, arrays.senders)
+
+    messages_sent = np.bincount(moderator_pos[is_moderator], minlength=moderators_count)
+
+    moderator_in_thread = is_moderator & in_thread
+    participation = np.unique(arrays.roots[moderator_in_thread] * slots + moderator_pos[moderator_in_thread])
+    threads_participated = np.bincount(participation % slots, minlength=moderators_count)
+    involved_roots = np.unique(arrays.roots[moderator_in_thread])
+
+    # Первый ответ модератора в каждой цепочке, начатой не модератором
+    latency = (arrays.timestamps - arrays.timestamps[arrays.roots]) / 60
+    candidates = is_moderator & ~is_root & ~is_moderator[arrays.roots] & ~np.isnan(latency)
+    candidate_roots = arrays.roots[candidates]
+    candidate_latency = latency[candidates]
+    candidate_moderators = moderator_pos[candidates]
+
+    order = np.lexsort((candidate_latency, candidate_roots))
+    sorted_roots = candidate_roots[order]
+    _, first = np.unique(sorted_roots, return_index=True)
+    first_roots = sorted_roots[first]
+    first_latency = candidate_latency[order][first]
+    first_moderators = candidate_moderators[order][first]
+
+    response_stats = _response_time_stats(first_latency)
+    metrics = {
+        'total_threads': int(thread_roots.size),
+        'moderator_involved_threads': int(involved_roots.size),
+        'response_times': first_latency.tolist(),
+        'response_time_avg': response_stats['avg'],
+        'response_time_min': response_stats['min'],
+        'response_time_max': response_stats['max'],
+        **{f'response_time_p{p}': response_stats[f'p{p}'] for p in RESPONSE_TIME_PERCENTILES},
+        'moderator_activity': {},
+        'thread_length_avg': float(thread_sizes[thread_roots].mean()) if thread_roots.size else 0
+    }
+
+    for pos, moderator_id in enumerate(moderator_ids):
+        response_times = first_latency[first_moderators == pos]
+        moderator_stats = _response_time_stats(response_times)
+        metrics['moderator_activity'][str(moderator_id)] = {
+            'threads_participated': int(threads_participated[pos]),
+            'messages_sent': int(messages_sent[pos]),
+            'avg_response_time': moderator_stats['avg'],
+            **{f'response_time_p{p}': moderator_stats[f'p{p}'] for p in RESPONSE_TIME_PERCENTILES},
+            'response_times': response_times.tolist()
+        }
+
+    first_response = dict(zip(first_roots.tolist(), first_latency.tolist()))
+    involved = set(involved_roots.tolist())
+    threads = {
+        arrays.ids[root]: {
+            'moderator_involved': root in involved,
+            'first_moderator_response_time': first_response.get(root)
+        }
+        for root in thread_roots.tolist()
+    }
+
+    return metrics, threads
@@ -7,6 +7,7 @@ import asyncio
 from datetime import datetime
 import logging
 from ..core.config import settings
+from .reply_index import ReplyIndex
 
 logger = logging.getLogger(__name__)
 
@@ -91,7 +92,7 @@ class OpenAIService:
                 'text': msg['text'][:500],  # Ограничиваем длину для экономии токенов
                 'date': msg['date'],
                 'is_reply': msg['is_reply'],
-                'has_media': msg['has_media']
+                'has_media': msg.get('media_type') is not None
             }
             
             if is_moderator:
@@ -110,12 +111,13 @@ class OpenAIService:
     def _identify_threads(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Определение цепочек диалогов"""
         threads = []
+        index = ReplyIndex(messages)
         
         # Группируем сообщения по reply_to_message_id
         for msg in messages[:10]:  # Анализируем только последние 10 для экономии
             if msg['is_reply'] and msg['reply_to_message_id']:
                 # Ищем исходное сообщение
-                original_msg = next((m for m in messages if m['message_id'] == msg['reply_to_message_id']), None)
+                original_msg = index.parent(msg['message_id'])
                 if original_msg:
                     threads.append({
                         'original': {
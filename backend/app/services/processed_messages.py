@@ -0,0 +1,109 @@
+# backend/app/services/processed_messages.py
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Set, Tuple
+
+from ..core.config import settings
+from ..core.repository import repository
+
+logger = logging.getLogger(__name__)
+
+ProcessedKey = Tuple[int, str, str]
+
+
+class ProcessedMessageIndex:
+    """
+    Уже обработанные сообщения мониторинга: (user_id, chat_id, message_id)
+
+    Стоит перед таблицей potential_clients: сообщения, известные в процессе
+    (сохраненные клиенты и сообщения, уже отправленные на ИИ-анализ),
+    отсекаются без запроса к БД, остальные проверяются одним запросом на цикл.
+    Индекс ограничен по размеру и вытесняет самые старые ключи.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._keys: "OrderedDict[ProcessedKey, None]" = OrderedDict()
+        self.stats = {'memory_hits': 0, 'db_lookups': 0, 'db_hits': 0, 'seeded': 0}
+
+    @staticmethod
+    def _key(user_id: int, chat_id: Any, message_id: Any) -> ProcessedKey:
+        return (int(user_id), str(chat_id) if chat_id is not None else '', str(message_id))
+
+    def add(self, user_id: int, chat_id: Any, message_id: Any):
+        key = self._key(user_id, chat_id, message_id)
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+    def contains(self, user_id: int, chat_id: Any, message_id: Any) -> bool:
+        return self._key(user_id, chat_id, message_id) in self._keys
+
+    async def seed(self, days: int):
+        """Загрузить ключи клиентов, найденных за последние days дней (при старте)"""
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+        try:
+            rows = await repository.list_recent_potential_client_keys(since, limit=self.max_size)
+        except Exception as e:
+            logger.warning(f"Failed to seed processed messages index: {e}")
+            return
+
+        for row in reversed(rows):
+            self.add(row['user_id'], row.get('chat_id'), row['message_id'])
+        self.stats['seeded'] += len(rows)
+        logger.info(f"Processed messages index seeded with {len(rows)} keys from the last {days} days")
+
+    async def filter_unprocessed(
+        self,
+        user_id: int,
+        keys: Iterable[Tuple[Any, Any]]
+    ) -> Set[Tuple[str, str]]:
+        """
+        Оставить только необработанные сообщения
+
+        Args:
+            user_id: ID пользователя
+            keys: Пары (chat_id, message_id) сообщений цикла
+
+        Returns:
+            Необработанные пары (chat_id, message_id) в строковом виде
+        """
+        candidates = {(str(chat_id) if chat_id is not None else '', str(message_id)) for chat_id, message_id in keys}
+
+        unknown = set()
+        for chat_id, message_id in candidates:
+            if self.contains(user_id, chat_id, message_id):
+                self.stats['memory_hits'] += 1
+            else:
+                unknown.add((chat_id, message_id))
+
+        if not unknown:
+            return set()
+
+        # Один запрос на весь цикл вместо запроса на каждое сообщение
+        self.stats['db_lookups'] += 1
+        rows = await repository.list_potential_client_keys(user_id, sorted({message_id for _, message_id in unknown}))
+
+        processed_chats: Dict[str, Set[str]] = {}
+        for row in rows:
+            processed_chats.setdefault(str(row['message_id']), set()).add(str(row.get('chat_id') or ''))
+
+        unprocessed = set()
+        for chat_id, message_id in unknown:
+            chats = processed_chats.get(message_id)
+            # Старые записи без chat_id считаются обработанными для любого чата
+            if chats and (chat_id in chats or '' in chats):
+                self.stats['db_hits'] += 1
+                self.add(user_id, chat_id, message_id)
+            else:
+                unprocessed.add((chat_id, message_id))
+        return unprocessed
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, 'size': len(self._keys), 'max_size': self.max_size}
+
+
+# Глобальный индекс
+processed_messages = ProcessedMessageIndex(settings.PROCESSED_MESSAGES_INDEX_SIZE)
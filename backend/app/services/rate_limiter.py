@@ -0,0 +1,134 @@
+# backend/app/services/rate_limiter.py
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Базовые лимиты по типам RPC: (запросов в секунду, размер всплеска)
+DEFAULT_RATE_LIMITS: Dict[str, Tuple[float, float]] = {
+    'history': (1.0, 5),        # GetHistory (iter_messages / get_messages)
+    'replies': (1.0, 5),        # GetReplies (iter_messages с reply_to)
+    'participants': (0.5, 2),   # GetParticipants (iter_participants)
+    'entity': (0.5, 3),         # ResolveUsername / GetChannels / GetUsers
+    'default': (2.0, 10)
+}
+
+# За сколько секунд скорость полностью восстанавливается после FloodWait
+RECOVERY_SECONDS = 300.0
+
+
+class TokenBucket:
+    """
+    Token bucket, который подстраивается под FloodWait.
+
+    При FloodWaitError бакет блокируется на указанное Telegram время и
+    вдвое снижает скорость; затем скорость линейно возвращается к базовой.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float, min_rate_ratio: float = 0.1):
+        self.name = name
+        self.base_rate = rate
+        self.rate = rate
+        self.min_rate = rate * min_rate_ratio
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.flood_waits = 0
+        self.last_flood_wait: Optional[int] = None
+        self.total_wait_seconds = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if elapsed <= 0:
+            return
+
+        if now >= self.blocked_until and self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * elapsed / RECOVERY_SECONDS)
+
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+
+    async def acquire(self) -> float:
+        """Взять один токен, при необходимости подождать. Возвращает время ожидания"""
+        waited = 0.0
+        # Замок выстраивает ожидающих в очередь, чтобы они не просыпались все разом
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self.blocked_until:
+                    delay = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    self.total_wait_seconds += waited
+                    return waited
+                else:
+                    delay = (1 - self.tokens) / self.rate
+
+                await asyncio.sleep(delay)
+                waited += delay
+
+    def on_flood_wait(self, seconds: int):
+        """Учесть FloodWait: заблокировать бакет и снизить скорость"""
+        now = time.monotonic()
+        self._refill(now)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+        self.flood_waits += 1
+        self.last_flood_wait = seconds
+        logger.warning(
+            f"FloodWait {seconds}s on '{self.name}': blocked, rate lowered to {self.rate:.2f} req/s"
+        )
+
+    def is_blocked(self) -> bool:
+        return time.monotonic() < self.blocked_until
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            'rate_per_second': round(self.rate, 3),
+            'base_rate_per_second': self.base_rate,
+            'tokens_available': round(self.tokens, 2),
+            'capacity': self.capacity,
+            'blocked_for_seconds': round(max(0.0, self.blocked_until - now), 1),
+            'flood_waits': self.flood_waits,
+            'last_flood_wait_seconds': self.last_flood_wait,
+            'total_wait_seconds': round(self.total_wait_seconds, 1)
+        }
+
+
+class TelegramRateLimiter:
+    """Набор token bucket'ов по типам RPC для одного аккаунта Telegram"""
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.limits = dict(limits or DEFAULT_RATE_LIMITS)
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def bucket(self, rate_key: str) -> TokenBucket:
+        if rate_key not in self._buckets:
+            rate, capacity = self.limits.get(rate_key, self.limits['default'])
+            self._buckets[rate_key] = TokenBucket(rate_key, rate, capacity)
+        return self._buckets[rate_key]
+
+    async def acquire(self, rate_key: str) -> float:
+        waited = await self.bucket(rate_key).acquire()
+        if waited > 1:
+            logger.info(f"Rate limiter delayed '{rate_key}' request by {waited:.1f}s")
+        return waited
+
+    def on_flood_wait(self, rate_key: str, seconds: int):
+        self.bucket(rate_key).on_flood_wait(seconds)
+
+    def is_blocked(self, rate_key: str) -> bool:
+        return rate_key in self._buckets and self._buckets[rate_key].is_blocked()
+
+    def budgets(self) -> Dict[str, Any]:
+        """Текущие бюджеты по всем типам RPC"""
+        return {rate_key: self.bucket(rate_key).snapshot() for rate_key in self.limits}
@@ -0,0 +1,364 @@
+# backend/app/services/realtime_ingestion_service.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from telethon import events, utils
+
+from ..core.config import settings
+from ..core.repository import repository
+from .chat_fetch_coalescer import chat_fetch_coalescer
+from .client_monitoring_service import ClientMonitoringService
+from .task_supervisor import task_supervisor
+from .telegram_service import TelegramService
+
+logger = logging.getLogger(__name__)
+
+# Сколько ключей обработанных событий помнить для дедупликации
+SEEN_EVENTS_LIMIT = 20000
+
+# Как часто сторож проверяет состояние соединений
+WATCHDOG_INTERVAL_SECONDS = 5
+
+# Имя задачи сторожа в task_supervisor
+WATCHDOG_TASK = "realtime:watchdog"
+
+# Префикс имен задач-обработчиков очереди событий
+WORKER_TASK_PREFIX = "realtime:worker:"
+
+
+class RealtimeIngestionService:
+    """
+    Real-time обработка сообщений мониторинга по событиям Telethon
+
+    Все клиенты пула подписаны на events.NewMessage и events.MessageEdited;
+    сообщения из чатов, которые мониторит хотя бы один пользователь, сразу
+    проходят этап ClientMonitoringService.process_messages.
+
+    Обработчик события только отсеивает дубли и кладет сообщение в очередь:
+    Telethon вызывает обработчики по очереди, и медленный запрос к ИИ задержал
+    бы все последующие обновления аккаунта. Очереди разбирают
+    MONITORING_REALTIME_CONCURRENCY задач; сообщения одного чата попадают
+    в одну очередь и обрабатываются по порядку.
+
+    Пока соединение непрерывно, обработанные сообщения сдвигают high-water mark
+    (sync_key monitor:{user_id}:{chat}). После переподключения чаты считаются
+    "с разрывом": сторож догружает пропущенное через get_group_messages от
+    сохраненной отметки, и только после этого события снова двигают отметку.
+    """
+
+    def __init__(self, monitoring_service: ClientMonitoringService):
+        self.monitoring_service = monitoring_service
+        self.telegram_service = TelegramService()
+        self.running = False
+        # Какие пользователи обслуживаются этим процессом (None - все)
+        self.user_filter: Optional[Callable[[int], bool]] = None
+
+        # peer id чата -> {user_id: ссылка на чат в monitored_chats этого пользователя}
+        self.subscriptions: Dict[int, Dict[int, str]] = {}
+        self.user_settings: Dict[int, Dict[str, Any]] = {}
+        self.user_templates: Dict[int, List[Dict[str, Any]]] = {}
+
+        # Чаты, по которым с момента последней догрузки не было разрыва соединения
+        self._live_chats: Set[int] = set()
+        self._seen: "OrderedDict[Tuple[int, int, int], None]" = OrderedDict()
+        self._queues: List[asyncio.Queue] = []
+        self._connection_state: Dict[str, bool] = {}
+        self._subscribed_clients: List[Any] = []
+        self._last_gap_fill = 0.0
+
+        self.stats = {
+            'events_received': 0,
+            'messages_processed': 0,
+            'duplicates_skipped': 0,
+            'gap_fills': 0,
+            'gap_fill_messages': 0,
+            'processing_failures': 0,
+            'reconnects_detected': 0
+        }
+
+    async def start(self):
+        """Загрузить подписки, подключить аккаунты и подписаться на события"""
+        if self.running:
+            return
+
+        await self.refresh_subscriptions()
+
+        connected = await self.telegram_service.ensure_all_connected()
+        if not connected:
+            raise RuntimeError("No Telegram accounts available for real-time ingestion")
+
+        self._queues = [asyncio.Queue() for _ in range(max(1, settings.MONITORING_REALTIME_CONCURRENCY))]
+        for index, queue in enumerate(self._queues):
+            task_supervisor.spawn(f"{WORKER_TASK_PREFIX}{index}", lambda queue=queue: self._worker_loop(queue), restart=True)
+
+        for account in self.telegram_service.pool.accounts:
+            client = account.client
+            client.add_event_handler(self._on_new_message, events.NewMessage())
+            client.add_event_handler(self._on_message_edited, events.MessageEdited())
+            self._subscribed_clients.append(client)
+            self._connection_state[account.name] = client.is_connected()
+
+        self.running = True
+        # Первая догрузка закрывает разрыв между прошлым запуском и подпиской
+        task_supervisor.spawn(WATCHDOG_TASK, self._watchdog_loop, restart=True)
+        logger.info(
+            f"Real-time ingestion started: {len(self.subscriptions)} chats, "
+            f"{len(connected)}/{len(self.telegram_service.pool.accounts)} accounts connected"
+        )
+
+    async def stop(self):
+        """Отписаться от событий и остановить сторожа"""
+        if not self.running:
+            return
+
+        self.running = False
+        for client in self._subscribed_clients:
+            client.remove_event_handler(self._on_new_message)
+            client.remove_event_handler(self._on_message_edited)
+        self._subscribed_clients.clear()
+
+        await task_supervisor.cancel(WATCHDOG_TASK)
+        await task_supervisor.cancel_prefix(WORKER_TASK_PREFIX)
+
+        # Необработанные события из очередей и все, что придет до следующего
+        # запуска, подберет догрузка: забываем их и ждем ее, прежде чем двигать отметки
+        self._queues = []
+        self._seen.clear()
+        self._live_chats.clear()
+        logger.info("Real-time ingestion stopped")
+
+    async def refresh_subscriptions(self):
+        """Пересобрать объединение monitored_chats всех активных пользователей"""
+        users = await repository.list_active_monitoring_settings()
+
+        subscriptions: Dict[int, Dict[int, str]] = {}
+        user_settings: Dict[int, Dict[str, Any]] = {}
+        user_templates: Dict[int, List[Dict[str, Any]]] = {}
+
+        for user_data in users:
+            user_id = user_data['user_id']
+            if self.user_filter is not None and not self.user_filter(user_id):
+                continue
+            templates = await repository.list_product_templates(user_id, active_only=True)
+            if not templates:
+                continue
+
+            user_settings[user_id] = user_data
+            user_templates[user_id] = templates
+
+            for chat_ref in user_data.get('monitored_chats', []) or []:
+                peer_id = await self._resolve_peer_id(chat_ref)
+                if peer_id is None:
+                    continue
+                subscriptions.setdefault(peer_id, {})[user_id] = str(chat_ref)
+
+        # Новые чаты еще не догружены - до догрузки события не сдвигают их отметки
+        self._live_chats &= set(subscriptions)
+        self.subscriptions = subscriptions
+        self.user_settings = user_settings
+        self.user_templates = user_templates
+        logger.info(f"Real-time subscriptions refreshed: {len(subscriptions)} chats, {len(user_settings)} users")
+
+    async def _resolve_peer_id(self, chat_ref: str) -> Optional[int]:
+        """peer id чата (как event.chat_id) для ссылки из monitored_chats"""
+        try:
+            entity = await self.telegram_service.get_entity(chat_ref)
+            return utils.get_peer_id(entity)
+        except Exception as e:
+            logger.warning(f"Cannot subscribe to chat {chat_ref}: {e}")
+            return None
+
+    async def _on_new_message(self, event):
+        await self._handle_event(event, advance_high_water_mark=True)
+
+    async def _on_message_edited(self, event):
+        # Правка может добавить ключевые слова; отметку не трогаем - это старое сообщение
+        await self._handle_event(event, advance_high_water_mark=False)
+
+    async def _handle_event(self, event, advance_high_water_mark: bool):
+        chat_id = event.chat_id
+        subscribers = self.subscriptions.get(chat_id)
+        if not subscribers or not self._queues:
+            return
+
+        self.stats['events_received'] += 1
+        message = event.message
+        if not self._mark_seen(chat_id, message.id, message.edit_date):
+            self.stats['duplicates_skipped'] += 1
+            return
+
+        # Очередь выбирается по чату, чтобы его сообщения обрабатывались по порядку
+        queue = self._queues[hash(chat_id) % len(self._queues)]
+        queue.put_nowait((event.client, chat_id, message, advance_high_water_mark))
+
+    async def _worker_loop(self, queue: asyncio.Queue):
+        """Разбирать очередь событий: профили отправителей, ключевые слова и ИИ-анализ"""
+        while True:
+            client, chat_id, message, advance_high_water_mark = await queue.get()
+            try:
+                await self._process_event(client, chat_id, message, advance_high_water_mark)
+            finally:
+                queue.task_done()
+
+    async def _process_event(self, client, chat_id: int, message, advance_high_water_mark: bool):
+        account = self._account_for_client(client)
+        try:
+            with self.telegram_service.using_account(account):
+                msg_data = self.telegram_service.message_to_record(message)
+                known_senders = {message.sender_id: message.sender} if message.sender is not None else {}
+                await self.telegram_service._attach_user_info([msg_data], known_senders)
+
+                processed = await self._process(
+                    chat_id, [msg_data],
+                    advance_high_water_mark=advance_high_water_mark and chat_id in self._live_chats
+                )
+        except Exception as e:
+            processed = False
+            logger.error(f"Error handling real-time message {message.id} from chat {chat_id}: {e}")
+
+        # Необработанное событие забываем, а следующие события чата больше не двигают
+        # отметку: иначе она ушла бы дальше этого сообщения. Догрузка подберет его снова
+        if not processed:
+            self.stats['processing_failures'] += 1
+            self._seen.pop((chat_id, message.id, int(message.edit_date.timestamp()) if message.edit_date else 0), None)
+            self._live_chats.discard(chat_id)
+
+    async def _process(self, chat_id: int, messages: List[Dict[str, Any]], advance_high_water_mark: bool = False) -> bool:
+        """
+        Передать сообщения чата на поиск ключевых слов и ИИ-анализ всем подписанным пользователям
+
+        Отметка пользователя сдвигается, только если его обработка прошла полностью.
+
+        Returns:
+            True, если сообщения обработаны для всех подписчиков
+        """
+        processed_all = True
+        for user_id, chat_ref in self.subscriptions.get(chat_id, {}).items():
+            templates = self.user_templates.get(user_id)
+            user_settings = self.user_settings.get(user_id)
+            if not templates or not user_settings:
+                continue
+            processed = await self.monitoring_service.process_messages(user_id, messages, templates, user_settings, chat_ref=chat_ref)
+            if processed and advance_high_water_mark:
+                newest_id = max(int(msg['message_id']) for msg in messages)
+                await self.telegram_service._update_high_water_mark(f"monitor:{user_id}:{chat_ref}", chat_ref, newest_id)
+            processed_all = processed_all and processed
+        self.stats['messages_processed'] += len(messages)
+        return processed_all
+
+    def _mark_seen(self, chat_id: int, message_id: int, edit_date) -> bool:
+        """Запомнить событие; False, если оно уже обрабатывалось (дубль с другого аккаунта или догрузки)"""
+        key = (chat_id, message_id, int(edit_date.timestamp()) if edit_date else 0)
+        if key in self._seen:
+            return False
+        self._seen[key] = None
+        while len(self._seen) > SEEN_EVENTS_LIMIT:
+            self._seen.popitem(last=False)
+        return True
+
+    def _account_for_client(self, client):
+        for account in self.telegram_service.pool.accounts:
+            if account.client is client:
+                return account
+        return self.telegram_service.pool.primary
+
+    async def _watchdog_loop(self):
+        """Следить за переподключениями и периодически догружать пропущенное"""
+        gap_fill_needed = True
+        while self.running:
+            try:
+                for account in self.telegram_service.pool.accounts:
+                    connected = account.client.is_connected()
+                    was_connected = self._connection_state.get(account.name, False)
+                    if was_connected and not connected:
+                        # Пока соединения нет, события теряются: до догрузки отметки не двигаем
+                        logger.warning(f"Account {account.name} disconnected, real-time stream has a gap")
+                        self.stats['reconnects_detected'] += 1
+                        self._live_chats.clear()
+                        gap_fill_needed = True
+                    self._connection_state[account.name] = connected
+
+                if any(not state for state in self._connection_state.values()):
+                    await self.telegram_service.ensure_all_connected()
+                    for account in self.telegram_service.pool.accounts:
+                        self._connection_state[account.name] = account.client.is_connected()
+
+                interval_elapsed = time.monotonic() - self._last_gap_fill >= settings.MONITORING_GAP_FILL_INTERVAL_SECONDS
+                if gap_fill_needed or interval_elapsed:
+                    gap_fill_needed = not await self._gap_fill()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in real-time watchdog: {e}")
+
+            await asyncio.sleep(WATCHDOG_INTERVAL_SECONDS)
+
+    async def _gap_fill(self) -> bool:
+        """
+        Догрузить сообщения, пришедшие после high-water mark, минуя уже обработанные события
+
+        Returns:
+            False, если догрузка отложена (история под FloodWait на всех аккаунтах)
+        """
+        if self.telegram_service.is_flood_limited('history'):
+            logger.info("History requests are flood-limited, postponing real-time gap fill")
+            return False
+
+        self._last_gap_fill = time.monotonic()
+        self.stats['gap_fills'] += 1
+
+        for chat_id, subscribers in list(self.subscriptions.items()):
+            filled_ids = set()
+            caught_up = True
+            for user_id, chat_ref in list(subscribers.items()):
+                user_settings = self.user_settings.get(user_id)
+                templates = self.user_templates.get(user_id)
+                if not user_settings or not templates:
+                    continue
+
+                messages = await self.monitoring_service._get_recent_messages(
+                    chat_ref,
+                    user_settings.get('lookback_minutes', 5),
+                    user_id
+                )
+                fresh = [
+                    msg for msg in messages
+                    if (chat_id, int(msg['message_id']), 0) not in self._seen
+                ]
+                processed = True
+                if fresh:
+                    processed = await self.monitoring_service.process_messages(user_id, fresh, templates, user_settings, chat_ref=chat_ref)
+                    self.stats['gap_fill_messages'] += len(fresh)
+
+                # Не обработанное полностью догрузится в следующий раз: отметку не двигаем
+                if processed:
+                    filled_ids.update(int(msg['message_id']) for msg in fresh)
+                    await chat_fetch_coalescer.advance(chat_ref, user_id, messages)
+                else:
+                    caught_up = False
+
+            # Помечаем после всех пользователей, иначе второй подписчик чата их бы не увидел;
+            # если кто-то из подписчиков не обработал догрузку, сообщения должны остаться "свежими"
+            if caught_up:
+                for message_id in filled_ids:
+                    self._mark_seen(chat_id, message_id, None)
+
+            # Отметка догнала поток событий - дальше ее можно сдвигать по событиям
+            if caught_up:
+                self._live_chats.add(chat_id)
+
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'running': self.running,
+            'subscribed_chats': len(self.subscriptions),
+            'live_chats': len(self._live_chats),
+            'queued_events': sum(queue.qsize() for queue in self._queues),
+            'connections': dict(self._connection_state)
+        }
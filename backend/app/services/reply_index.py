@@ -0,0 +1,107 @@
+# backend/app/services/reply_index.py
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+
+def _parse_timestamp(value: Any) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+class ReplyIndex:
+    """
+    Граф ответов для пачки сообщений
+
+    Строится одним проходом: id -> сообщение, родитель -> ответы, время
+    сообщения (ISO-дата разбирается один раз). Корень и глубина цепочки
+    вычисляются по требованию с мемоизацией, поэтому разбор цепочек линеен
+    по числу сообщений. Корень - самое верхнее сообщение цепочки, которое
+    есть в пачке; ответы на сообщения вне пачки сами становятся корнями.
+    """
+
+    def __init__(self, messages: Iterable[Dict[str, Any]]):
+        self.messages: Dict[str, Dict[str, Any]] = {}
+        self.children: Dict[str, List[str]] = {}
+        self.parents: Dict[str, str] = {}
+        self.timestamps: Dict[str, Optional[float]] = {}
+        self._roots: Dict[str, str] = {}
+        self._depths: Dict[str, int] = {}
+
+        for msg in messages:
+            message_id = str(msg['message_id'])
+            self.messages[message_id] = msg
+            self.timestamps[message_id] = _parse_timestamp(msg.get('date'))
+
+            parent_id = msg.get('reply_to_message_id')
+            if msg.get('is_reply') and parent_id:
+                parent_id = str(parent_id)
+                self.parents[message_id] = parent_id
+                self.children.setdefault(parent_id, []).append(message_id)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __contains__(self, message_id: Any) -> bool:
+        return str(message_id) in self.messages
+
+    def get(self, message_id: Any) -> Optional[Dict[str, Any]]:
+        return self.messages.get(str(message_id))
+
+    def parent(self, message_id: Any) -> Optional[Dict[str, Any]]:
+        """Сообщение, на которое ответили (None, если его нет в пачке)"""
+        parent_id = self.parents.get(str(message_id))
+        return self.messages.get(parent_id) if parent_id else None
+
+    def replies(self, message_id: Any) -> List[Dict[str, Any]]:
+        """Прямые ответы на сообщение"""
+        return [self.messages[child_id] for child_id in self.children.get(str(message_id), [])]
+
+    def timestamp(self, message_id: Any) -> Optional[float]:
+        return self.timestamps.get(str(message_id))
+
+    def root_id(self, message_id: Any) -> str:
+        """id корня цепочки, в которую входит сообщение"""
+        message_id = str(message_id)
+        path: List[str] = []
+        visited = set()
+        current = message_id
+        while current not in self._roots:
+            parent_id = self.parents.get(current)
+            if parent_id is None or parent_id not in self.messages or parent_id in visited:
+                self._roots[current] = current
+                self._depths[current] = 0
+                break
+            path.append(current)
+            visited.add(current)
+            current = parent_id
+
+        # Сжимаем путь: все пройденные сообщения получают корень и глубину
+        root = self._roots[current]
+        depth = self._depths[current]
+        for node in reversed(path):
+            depth += 1
+            self._roots[node] = root
+            self._depths[node] = depth
+        return self._roots[message_id]
+
+    def depth(self, message_id: Any) -> int:
+        """Число ответов от корня цепочки до сообщения (у корня 0)"""
+        self.root_id(message_id)
+        return self._depths[str(message_id)]
+
+    def threads(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Цепочки с ответами: id корня -> все ответы цепочки (в порядке пачки)
+
+        Корни без ответов не включаются.
+        """
+        threads: Dict[str, List[Dict[str, Any]]] = {}
+        for message_id, msg in self.messages.items():
+            root = self.root_id(message_id)
+            if root != message_id:
+                threads.setdefault(root, []).append(msg)
+        return threads
@@ -0,0 +1,164 @@
+# backend/app/services/scheduler_lease.py
+import logging
+import math
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Set
+
+from ..core.config import settings
+from ..core.repository import repository
+
+logger = logging.getLogger(__name__)
+
+MEMBER_PREFIX = "scheduler:member:"
+SHARD_PREFIX = "scheduler:shard:"
+
+
+class SchedulerLease:
+    """
+    Аренда мониторинга в БД: при нескольких процессах (uvicorn --workers N)
+    каждого пользователя обслуживает ровно один планировщик
+
+    Пользователи делятся на SCHEDULER_SHARDS диапазонов (user_id % SCHEDULER_SHARDS),
+    каждый диапазон - строка scheduler:shard:{n} в таблице scheduler_leases
+    (lease_key PK, holder_id, expires_at, renewed_at). Держатель продлевает аренду
+    каждые SCHEDULER_LEASE_RENEW_SECONDS; истекшую аренду забирает другой процесс
+    условным UPDATE ... WHERE expires_at < now, поэтому забрать ее может только один.
+
+    Живые процессы отмечаются строками scheduler:member:{holder_id}; каждый держит
+    не больше справедливой доли диапазонов и отпускает лишние, когда процессов
+    становится больше. Сроки считаются по часам процессов - часы серверов должны
+    быть синхронизированы с точностью заметно лучше SCHEDULER_LEASE_TTL_SECONDS.
+
+    При SCHEDULER_LEASE_ENABLED=False процесс считает своими все диапазоны.
+    """
+
+    def __init__(self):
+        self.enabled = settings.SCHEDULER_LEASE_ENABLED
+        self.shards = max(1, settings.SCHEDULER_SHARDS)
+        self.holder_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.owned_shards: Set[int] = set() if self.enabled else set(range(self.shards))
+        self.live_members = 1
+        # До какого момента (time.monotonic) аренда гарантированно наша
+        self._valid_until = 0.0
+        self.stats = {'heartbeats': 0, 'heartbeat_errors': 0, 'acquired': 0, 'lost': 0, 'released': 0}
+
+    def shard_for_user(self, user_id: int) -> int:
+        return int(user_id) % self.shards
+
+    def is_valid(self) -> bool:
+        return not self.enabled or time.monotonic() < self._valid_until
+
+    def owns_user(self, user_id: int) -> bool:
+        """Обслуживает ли этот процесс пользователя"""
+        return self.is_valid() and self.shard_for_user(user_id) in self.owned_shards
+
+    async def heartbeat(self) -> bool:
+        """
+        Продлить свои аренды и забрать свободные в пределах своей доли
+
+        Returns:
+            True, если набор своих диапазонов изменился
+        """
+        if not self.enabled:
+            return False
+
+        before = set(self.owned_shards)
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        now_iso = now.isoformat()
+        expires_at = (now + timedelta(seconds=settings.SCHEDULER_LEASE_TTL_SECONDS)).isoformat()
+        self.stats['heartbeats'] += 1
+
+        try:
+            await self._claim(MEMBER_PREFIX + self.holder_id, expires_at, now_iso)
+            live = {row['lease_key']: row['holder_id'] for row in await repository.list_live_scheduler_leases(now_iso)}
+
+            members = {holder for key, holder in live.items() if key.startswith(MEMBER_PREFIX)} | {self.holder_id}
+            self.live_members = len(members)
+            fair_share = math.ceil(self.shards / len(members))
+            if settings.SCHEDULER_MAX_SHARDS_PER_INSTANCE > 0:
+                fair_share = min(fair_share, settings.SCHEDULER_MAX_SHARDS_PER_INSTANCE)
+
+            owned: Set[int] = set()
+            excess = []
+            # Сначала продлеваем свои, чтобы не терять диапазоны при перебалансировке
+            for shard in range(self.shards):
+                key = SHARD_PREFIX + str(shard)
+                if live.get(key) != self.holder_id:
+                    continue
+                if len(owned) >= fair_share:
+                    excess.append(key)
+                elif await repository.renew_scheduler_lease(key, self.holder_id, expires_at):
+                    owned.add(shard)
+
+            # Затем забираем свободные и истекшие
+            for shard in range(self.shards):
+                key = SHARD_PREFIX + str(shard)
+                if len(owned) >= fair_share:
+                    break
+                if key in live or shard in owned:
+                    continue
+                if await self._claim(key, expires_at, now_iso):
+                    owned.add(shard)
+
+            if excess:
+                await repository.release_scheduler_leases(self.holder_id, excess)
+                self.stats['released'] += len(excess)
+
+            self.owned_shards = owned
+            # Запас на время самого heartbeat: аренда в БД истекает позже
+            self._valid_until = started + settings.SCHEDULER_LEASE_TTL_SECONDS - settings.SCHEDULER_LEASE_RENEW_SECONDS
+
+        except Exception as e:
+            self.stats['heartbeat_errors'] += 1
+            logger.warning(f"Scheduler lease heartbeat failed: {e}")
+            # Продлить не удалось - после истечения срока диапазоны могли забрать другие
+            if not self.is_valid():
+                self.owned_shards = set()
+
+        acquired = self.owned_shards - before
+        lost = before - self.owned_shards
+        self.stats['acquired'] += len(acquired)
+        self.stats['lost'] += len(lost)
+        if acquired or lost:
+            logger.info(
+                f"Scheduler lease {self.holder_id}: shards {sorted(self.owned_shards)} of {self.shards} "
+                f"(+{sorted(acquired)} -{sorted(lost)}, {self.live_members} live instances)"
+            )
+        return bool(acquired or lost)
+
+    async def _claim(self, lease_key: str, expires_at: str, now: str) -> bool:
+        """Продлить свою аренду, создать отсутствующую или забрать истекшую"""
+        return (
+            await repository.renew_scheduler_lease(lease_key, self.holder_id, expires_at)
+            or await repository.insert_scheduler_lease(lease_key, self.holder_id, expires_at)
+            or await repository.take_over_scheduler_lease(lease_key, self.holder_id, expires_at, now)
+        )
+
+    async def release(self):
+        """Отпустить все аренды (при остановке), чтобы другие процессы забрали их сразу"""
+        if not self.enabled:
+            return
+        keys = [SHARD_PREFIX + str(shard) for shard in self.owned_shards] + [MEMBER_PREFIX + self.holder_id]
+        self.owned_shards = set()
+        self._valid_until = 0.0
+        try:
+            await repository.release_scheduler_leases(self.holder_id, keys)
+            self.stats['released'] += len(keys) - 1
+        except Exception as e:
+            logger.warning(f"Failed to release scheduler leases: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'enabled': self.enabled,
+            'holder_id': self.holder_id,
+            'shards': self.shards,
+            'owned_shards': sorted(self.owned_shards),
+            'live_instances': self.live_members,
+            'valid': self.is_valid()
+        }
@@ -1,19 +1,56 @@
 # backend/app/services/scheduler_service.py
 import asyncio
+import heapq
 import logging
-from datetime import datetime, timezone
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
 
-from ..core.database import supabase_client
+from ..core.config import settings as app_settings
+from ..core.repository import repository
 from .client_monitoring_service import ClientMonitoringService
+from .processed_messages import processed_messages
+from .realtime_ingestion_service import RealtimeIngestionService
+from .scheduler_lease import SchedulerLease
+from .task_supervisor import task_supervisor
 
 logger = logging.getLogger(__name__)
 
+# Как часто в real-time режиме перечитывать подписки
+REALTIME_REFRESH_SECONDS = 60
+
+# Через сколько повторить перестроение расписания, если чтение настроек из БД упало
+SCHEDULE_REBUILD_RETRY_SECONDS = 15
+
+# Имена фоновых задач в task_supervisor
+LOOP_TASK = "scheduler:loop"
+LEASE_TASK = "scheduler:lease"
+SETTINGS_WATCH_TASK = "scheduler:settings_watch"
+USER_TASK_PREFIX = "monitoring:user:"
+
 class SchedulerService:
     def __init__(self):
         self.monitoring_service = ClientMonitoringService()
-        self.task = None
+        self.realtime_service = RealtimeIngestionService(self.monitoring_service)
         self.running = False
-        self.background_tasks = set()  # Сохраняем strong references
+        
+        # Прогоны пользователей выполняются параллельно, но не больше лимита одновременно
+        self.user_semaphore = asyncio.Semaphore(app_settings.MONITORING_USER_CONCURRENCY)
+        self.user_metrics: Dict[int, Dict[str, Any]] = {}
+        
+        # Расписание прогонов: куча (время следующего прогона, user_id)
+        self._schedule: List[Tuple[float, int]] = []
+        self._next_due: Dict[int, float] = {}
+        self._scheduled_settings: Dict[int, Dict[str, Any]] = {}
+        self._settings_dirty = asyncio.Event()
+        self._last_resync = 0.0
+        self.schedule_lag = {'last_seconds': None, 'max_seconds': 0.0}
+        
+        # При нескольких процессах пользователей делят между собой держатели аренды
+        self.lease = SchedulerLease()
+        self.realtime_service.user_filter = self.lease.owns_user
+        self._realtime_unavailable = False
+        self._settings_marker: Optional[str] = None
         
     async def start(self):
         """Запустить планировщик"""
@@ -25,21 +62,27 @@ class SchedulerService:
             print("🚀 SCHEDULER: Starting scheduler with asyncio approach...")
             logger.info("🚀 SCHEDULER: Starting scheduler with asyncio approach...")
             
-            # Создаем asyncio task для мониторинга
-            print("📋 SCHEDULER: Creating asyncio task...")
-            self.task = asyncio.create_task(self._monitoring_loop())
-            print(f"📋 SCHEDULER: Task created: {self.task}")
-            
-            # ← КРИТИЧЕСКИ ВАЖНО: Сохраняем strong reference
-            self.background_tasks.add(self.task)
-            print("📋 SCHEDULER: Task added to background_tasks set")
-            
-            # Удаляем task из set после завершения
-            self.task.add_done_callback(self.background_tasks.discard)
+            # Первая попытка взять аренду до построения расписания
+            await self.lease.heartbeat()
+            print(f"🔐 SCHEDULER: Lease holder {self.lease.holder_id}, shards {sorted(self.lease.owned_shards)} of {self.lease.shards}")
+            logger.info(f"🔐 SCHEDULER: Lease holder {self.lease.holder_id}, shards {sorted(self.lease.owned_shards)} of {self.lease.shards}")
             
             self.running = True
             print("✅ SCHEDULER: self.running = True")
             
+            # Фоновые циклы живут в task_supervisor: он держит ссылки и перезапускает упавшие
+            print("📋 SCHEDULER: Spawning supervised tasks...")
+            task_supervisor.spawn(LOOP_TASK, self._monitoring_loop, restart=True)
+            if self.lease.enabled:
+                task_supervisor.spawn(LEASE_TASK, self._lease_loop, restart=True)
+            if app_settings.MONITORING_SETTINGS_POLL_SECONDS > 0:
+                task_supervisor.spawn(SETTINGS_WATCH_TASK, self._settings_watch_loop, restart=True)
+            
+            # Ключи уже найденных клиентов: дедупликация без запроса к БД на каждое сообщение
+            await processed_messages.seed(app_settings.PROCESSED_MESSAGES_SEED_DAYS)
+            
+            await self._sync_realtime_with_lease()
+            
             print("✅ SCHEDULER: Scheduler started successfully")
             logger.info("✅ SCHEDULER: Scheduler started successfully")
             
@@ -61,18 +104,18 @@ class SchedulerService:
             logger.info("🛑 SCHEDULER: Stopping scheduler...")
             self.running = False
             
-            if self.task and not self.task.done():
-                self.task.cancel()
-                try:
-                    # Ждем завершения task с timeout
-                    await asyncio.wait_for(self.task, timeout=5.0)
-                except asyncio.TimeoutError:
-                    logger.warning("⏰ SCHEDULER: Task cancellation timeout")
-                except asyncio.CancelledError:
-                    logger.info("✅ SCHEDULER: Task cancelled successfully")
-                
-            # Очищаем background tasks
-            self.background_tasks.clear()
+            await self.realtime_service.stop()
+            
+            # Ждем завершения циклов с timeout и прерываем незавершенные прогоны пользователей
+            await asyncio.gather(
+                task_supervisor.cancel(LOOP_TASK),
+                task_supervisor.cancel(LEASE_TASK),
+                task_supervisor.cancel(SETTINGS_WATCH_TASK),
+                task_supervisor.cancel_prefix(USER_TASK_PREFIX)
+            )
+            
+            # Отпускаем аренду, чтобы другой процесс подхватил пользователей сразу
+            await self.lease.release()
             
             print("✅ SCHEDULER: Scheduler stopped successfully")
             logger.info("✅ SCHEDULER: Scheduler stopped successfully")
@@ -80,22 +123,113 @@ class SchedulerService:
         except Exception as e:
             logger.error(f"❌ SCHEDULER: Error stopping scheduler: {e}")
     
+    def mark_settings_changed(self):
+        """Настройки мониторинга изменились - перестроить расписание при ближайшей возможности"""
+        self._settings_dirty.set()
+    
+    async def _sync_realtime_with_lease(self):
+        """
+        Event-driven режим: сообщения обрабатываются по мере поступления,
+        периодический опрос заменяется догрузкой пропусков. Подключаемся к событиям,
+        только пока процесс держит аренду хотя бы одного диапазона.
+        """
+        if not app_settings.MONITORING_REALTIME_ENABLED or self._realtime_unavailable:
+            return
+        
+        if self.lease.owned_shards and not self.realtime_service.running:
+            try:
+                await self.realtime_service.start()
+                print("⚡ SCHEDULER: Real-time ingestion started")
+                logger.info("⚡ SCHEDULER: Real-time ingestion started")
+            except Exception as e:
+                self._realtime_unavailable = True
+                print(f"⚠️ SCHEDULER: Real-time ingestion unavailable, falling back to polling: {e}")
+                logger.warning(f"⚠️ SCHEDULER: Real-time ingestion unavailable, falling back to polling: {e}")
+        elif not self.lease.owned_shards and self.realtime_service.running:
+            await self.realtime_service.stop()
+            print("⚡ SCHEDULER: Real-time ingestion stopped, no leased shards")
+            logger.info("⚡ SCHEDULER: Real-time ingestion stopped, no leased shards")
+    
+    async def _lease_loop(self):
+        """Продление аренды; при смене своих диапазонов перестраиваем расписание"""
+        while self.running:
+            try:
+                await asyncio.sleep(app_settings.SCHEDULER_LEASE_RENEW_SECONDS)
+                if not await self.lease.heartbeat():
+                    continue
+                
+                print(f"🔐 SCHEDULER: Leased shards changed to {sorted(self.lease.owned_shards)} of {self.lease.shards}")
+                logger.info(f"🔐 SCHEDULER: Leased shards changed to {sorted(self.lease.owned_shards)} of {self.lease.shards}")
+                
+                # Пользователей потерянных диапазонов теперь обслуживает другой процесс
+                for name in task_supervisor.running_names(USER_TASK_PREFIX):
+                    user_id = int(name[len(USER_TASK_PREFIX):])
+                    if not self.lease.owns_user(user_id):
+                        await task_supervisor.cancel(name)
+                
+                await self._sync_realtime_with_lease()
+                self.mark_settings_changed()
+                
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ SCHEDULER: Error in lease loop: {e}")
+    
+    async def _settings_watch_loop(self):
+        """
+        Изменения настроек, сделанные в другом процессе (API при отдельном воркере
+        или другой воркер uvicorn): mark_settings_changed там до нас не доходит,
+        поэтому дешево опрашиваем updated_at последнего изменения
+        """
+        while self.running:
+            try:
+                marker = await repository.get_latest_monitoring_settings_update()
+                if self._settings_marker is not None and marker != self._settings_marker:
+                    print("🔄 SCHEDULER: Monitoring settings changed in another process")
+                    logger.info("🔄 SCHEDULER: Monitoring settings changed in another process")
+                    self.mark_settings_changed()
+                self._settings_marker = marker
+            except Exception as e:
+                logger.warning(f"⚠️ SCHEDULER: Failed to check monitoring settings changes: {e}")
+            
+            try:
+                await asyncio.sleep(app_settings.MONITORING_SETTINGS_POLL_SECONDS)
+            except asyncio.CancelledError:
+                break
+    
     async def _monitoring_loop(self):
-        """Основной цикл мониторинга (запускается каждую минуту)"""
+        """
+        Основной цикл мониторинга
+        
+        Расписание - куча (время следующего прогона, user_id) в памяти. Цикл спит
+        ровно до ближайшего прогона; БД перечитывается только при изменении
+        настроек (mark_settings_changed) и раз в MONITORING_SCHEDULE_RESYNC_SECONDS
+        на случай изменений из другого процесса.
+        """
         print("🚀 SCHEDULER: Monitoring loop started")
         logger.info("🚀 SCHEDULER: Monitoring loop started")
         
-        iteration_count = 0
+        # Первый проход строит расписание
+        self._settings_dirty.set()
         
         while self.running:
-            iteration_count += 1
-            print(f"🔄 SCHEDULER: Loop iteration #{iteration_count} started (running={self.running})")
-            
             try:
-                print("📞 SCHEDULER: Calling _monitor_all_users()...")
-                # Выполняем мониторинг
-                await self._monitor_all_users()
-                print("✅ SCHEDULER: _monitor_all_users() completed successfully")
+                resync_due = time.monotonic() - self._last_resync >= self._resync_interval()
+                if self._settings_dirty.is_set() or resync_due:
+                    self._settings_dirty.clear()
+                    self._last_resync = time.monotonic()
+                    
+                    if self.realtime_service.running:
+                        # Сообщения приходят событиями, здесь только подхватываем изменения настроек
+                        print("⚡ SCHEDULER: Refreshing real-time subscriptions...")
+                        await self.realtime_service.refresh_subscriptions()
+                    else:
+                        await self._rebuild_schedule()
+                
+                if not self.realtime_service.running:
+                    self._launch_due_users()
+                
+                await self._sleep_until_next_due()
                 
             except asyncio.CancelledError:
                 print("📴 SCHEDULER: Monitoring loop cancelled")
@@ -108,75 +242,126 @@ class SchedulerService:
                 logger.error(f"❌ SCHEDULER: Traceback: {traceback.format_exc()}")
                 
                 print("⏳ SCHEDULER: Waiting 30 seconds after error...")
-                # При ошибке ждем 30 секунд и продолжаем
+                # При ошибке ждем 30 секунд и перечитываем расписание
                 await asyncio.sleep(30)
-                print("⏰ SCHEDULER: 30 second wait completed")
+                self._settings_dirty.set()
                 continue
             
-            # Ждем 60 секунд до следующей проверки
-            print("💤 SCHEDULER: Starting 60 second sleep...")
-            await asyncio.sleep(60)
-            print("⏰ SCHEDULER: 60 second sleep completed, next iteration...")
-            
         print("🔚 SCHEDULER: Monitoring loop ended")
         logger.info("🔚 SCHEDULER: Monitoring loop ended")
     
-    async def _monitor_all_users(self):
-        """Проверить всех пользователей на необходимость мониторинга"""
+    def _resync_interval(self) -> float:
+        if self.realtime_service.running:
+            return REALTIME_REFRESH_SECONDS
+        return app_settings.MONITORING_SCHEDULE_RESYNC_SECONDS
+    
+    async def _rebuild_schedule(self):
+        """
+        Перестроить кучу расписания по настройкам из БД
+
+        Если БД недоступна, прежнее расписание остается в силе, а перестроение
+        повторяется через SCHEDULE_REBUILD_RETRY_SECONDS.
+        """
         try:
-            print("🔍 SCHEDULER: Running scheduled client monitoring check")
-            logger.info("🔍 SCHEDULER: Running scheduled client monitoring check")
-            
-            # Получаем всех пользователей с активным мониторингом
-            print("📊 SCHEDULER: Getting active monitoring users...")
             active_users = await self._get_active_monitoring_users()
-            print(f"📊 SCHEDULER: Retrieved {len(active_users)} users from database")
+        except Exception as e:
+            print(f"⚠️ SCHEDULER: Keeping previous schedule, rebuild retry in {SCHEDULE_REBUILD_RETRY_SECONDS}s: {e}")
+            logger.warning(f"⚠️ SCHEDULER: Keeping previous schedule, rebuild retry in {SCHEDULE_REBUILD_RETRY_SECONDS}s: {e}")
+            # Сдвигаем отметку пересинхронизации так, чтобы она наступила через паузу
+            self._last_resync = time.monotonic() - self._resync_interval() + SCHEDULE_REBUILD_RETRY_SECONDS
+            return
+        
+        now = time.time()
+        
+        heap = []
+        next_due: Dict[int, float] = {}
+        for user_data in active_users:
+            user_id = user_data['user_id']
+            due_at = self._due_time(user_data)
+            due_ts = due_at.timestamp() if due_at is not None else now
+            heap.append((due_ts, user_id))
+            next_due[user_id] = due_ts
+        
+        heapq.heapify(heap)
+        self._schedule = heap
+        self._next_due = next_due
+        self._scheduled_settings = {user_data['user_id']: user_data for user_data in active_users}
+        
+        if heap:
+            print(f"📅 SCHEDULER: Schedule rebuilt for {len(heap)} users, next run in {max(0.0, heap[0][0] - now):.0f}s")
+            logger.info(f"📅 SCHEDULER: Schedule rebuilt for {len(heap)} users, next run in {max(0.0, heap[0][0] - now):.0f}s")
+        else:
+            print("❌ SCHEDULER: No active monitoring users found")
+            logger.warning("❌ SCHEDULER: No active monitoring users found")
+    
+    def _launch_due_users(self):
+        """Запустить прогоны всех пользователей, чье время наступило, и запланировать следующие"""
+        now = time.time()
+        while self._schedule and self._schedule[0][0] <= now:
+            due_ts, user_id = heapq.heappop(self._schedule)
+            
+            # Устаревшая запись: пользователь перепланирован или удален из расписания
+            if self._next_due.get(user_id) != due_ts:
+                continue
             
-            if not active_users:
-                print("❌ SCHEDULER: No active monitoring users found")
-                logger.warning("❌ SCHEDULER: No active monitoring users found")
-                return
+            settings = self._scheduled_settings[user_id]
+            lag = now - due_ts
+            self.schedule_lag['last_seconds'] = round(lag, 3)
+            self.schedule_lag['max_seconds'] = round(max(self.schedule_lag['max_seconds'], lag), 3)
+            
+            # Следующий прогон - через интервал от запланированного, без накопления дрейфа
+            interval = settings.get('check_interval_minutes', 5) * 60
+            next_ts = due_ts + interval
+            if next_ts <= now:
+                next_ts = now + interval
+            self._next_due[user_id] = next_ts
+            heapq.heappush(self._schedule, (next_ts, user_id))
+            
+            if task_supervisor.is_running(self._user_task_name(user_id)):
+                print(f"⏳ SCHEDULER: Previous run for user {user_id} still in progress, skipping")
+                logger.info(f"⏳ SCHEDULER: Previous run for user {user_id} still in progress, skipping")
+                continue
             
-            logger.info(f"✅ SCHEDULER: Found {len(active_users)} active monitoring users")
+            print(f"🚀 SCHEDULER: Queueing monitoring for user {user_id} (lag {lag:.1f}s)")
+            logger.info(f"🚀 SCHEDULER: Queueing monitoring for user {user_id} (lag {lag:.1f}s)")
             
-            for user_data in active_users:
-                user_id = user_data['user_id']
-                settings = user_data
-                
-                print(f"🔍 SCHEDULER: Checking monitoring for user {user_id}")
-                logger.info(f"🔍 SCHEDULER: Checking monitoring for user {user_id}")
-                
-                # Проверяем, пора ли запускать мониторинг для этого пользователя
-                should_run = self._should_run_monitoring(settings)
-                print(f"🎯 SCHEDULER: Should run monitoring for user {user_id}: {should_run}")
-                logger.info(f"🎯 SCHEDULER: Should run monitoring for user {user_id}: {should_run}")
-                
-                if should_run:
-                    print(f"🚀 SCHEDULER: Running monitoring for user {user_id}")
-                    logger.info(f"🚀 SCHEDULER: Running monitoring for user {user_id}")
-                    
-                    # Запускаем мониторинг
-                    await self._run_monitoring_for_user(user_id, settings)
-                    print(f"✅ SCHEDULER: Monitoring for user {user_id} completed")
-                else:
-                    print(f"⏰ SCHEDULER: Skipping monitoring for user {user_id} - too early")
-                    logger.info(f"⏰ SCHEDULER: Skipping monitoring for user {user_id} - too early")
-                    
-        except Exception as e:
-            print(f"❌ SCHEDULER: Error in scheduled monitoring: {e}")
-            logger.error(f"❌ SCHEDULER: Error in scheduled monitoring: {e}")
-            import traceback
-            logger.error(f"❌ SCHEDULER: Traceback: {traceback.format_exc()}")
+            # Запускаем мониторинг в фоне: медленный пользователь не задерживает остальных
+            task_supervisor.spawn(
+                self._user_task_name(user_id),
+                lambda user_id=user_id, settings=settings, lag=lag: self._run_user_isolated(user_id, settings, lag)
+            )
+    
+    @staticmethod
+    def _user_task_name(user_id: int) -> str:
+        return f"{USER_TASK_PREFIX}{user_id}"
+    
+    async def cancel_user_run(self, user_id: int):
+        """Прервать текущий прогон пользователя в этом процессе (мониторинг выключен)"""
+        await task_supervisor.cancel(self._user_task_name(user_id))
+    
+    async def _sleep_until_next_due(self):
+        """Спать до ближайшего прогона, пересинхронизации или изменения настроек"""
+        timeout = self._resync_interval() - (time.monotonic() - self._last_resync)
+        if not self.realtime_service.running and self._schedule:
+            timeout = min(timeout, self._schedule[0][0] - time.time())
+        
+        if timeout <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._settings_dirty.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
     
     async def _get_active_monitoring_users(self) -> list:
-        """Получить всех пользователей с активным мониторингом"""
+        """Получить всех пользователей с активным мониторингом (ошибка БД пробрасывается)"""
         try:
             print("📊 SCHEDULER: Querying database for active monitoring users")
             logger.info("📊 SCHEDULER: Querying database for active monitoring users")
-            result = supabase_client.table('monitoring_settings').select('*').eq('is_active', True).execute()
-            
-            users = result.data or []
+            users = await repository.list_active_monitoring_settings()
             print(f"📊 SCHEDULER: Database returned {len(users)} active monitoring users")
+            
+            # Остальных пользователей обслуживают процессы, держащие их диапазоны
+            users = [user for user in users if self.lease.owns_user(user['user_id'])]
             logger.info(f"📊 SCHEDULER: Retrieved {len(users)} active monitoring users from database")
             
             for user in users:
@@ -190,67 +375,87 @@ class SchedulerService:
         except Exception as e:
             print(f"❌ SCHEDULER: Error getting active monitoring users: {e}")
             logger.error(f"❌ SCHEDULER: Error getting active monitoring users: {e}")
-            return []
+            raise
     
-    def _should_run_monitoring(self, settings: dict) -> bool:
-        """Проверить, нужно ли запускать мониторинг для пользователя"""
-        try:
-            last_check = settings.get('last_monitoring_check')
-            interval_minutes = settings.get('check_interval_minutes', 5)
-            
-            print(f"⏰ SCHEDULER: Checking interval - last_check: {last_check}, interval: {interval_minutes}min")
-            logger.info(f"⏰ SCHEDULER: Checking interval - last_check: {last_check}, interval: {interval_minutes}min")
-            
-            if not last_check:
-                print("⏰ SCHEDULER: No last check time, running monitoring")
-                logger.info("⏰ SCHEDULER: No last check time, running monitoring")
-                return True
+    async def _run_user_isolated(self, user_id: int, settings: dict, lag_seconds: float):
+        """Прогон пользователя в общем пуле: лимит параллельности, таймаут и метрики"""
+        metrics = self.user_metrics.setdefault(user_id, {
+            'runs': 0,
+            'failures': 0,
+            'timeouts': 0,
+            'last_status': None,
+            'last_error': None,
+            'last_queue_wait_seconds': None,
+            'last_lag_seconds': None,
+            'last_duration_seconds': None,
+            'avg_duration_seconds': None,
+            'last_finished_at': None
+        })
+        queued_at = time.monotonic()
+        
+        async with self.user_semaphore:
+            started_at = time.monotonic()
+            metrics['last_queue_wait_seconds'] = round(started_at - queued_at, 3)
+            # Насколько прогон опоздал относительно расписания (с учетом ожидания слота)
+            metrics['last_lag_seconds'] = round(max(0.0, lag_seconds) + (started_at - queued_at), 3)
             
-            # Обрабатываем время с учетом timezone
             try:
-                # Парсим время из БД (может быть с timezone)
-                if isinstance(last_check, str):
-                    # Убираем Z и заменяем на +00:00 если есть
-                    time_str = last_check.replace('Z', '+00:00')
-                    last_check_time = datetime.fromisoformat(time_str)
-                else:
-                    last_check_time = last_check
-                
-                # Приводим к UTC если есть timezone info
-                if last_check_time.tzinfo is not None:
-                    last_check_utc = last_check_time.astimezone(timezone.utc)
-                else:
-                    # Если timezone нет, считаем что это UTC
-                    last_check_utc = last_check_time.replace(tzinfo=timezone.utc)
-                
-                # Текущее время в UTC
-                now_utc = datetime.now(timezone.utc)
-                
-                # Вычисляем разницу в минутах
-                time_diff_minutes = (now_utc - last_check_utc).total_seconds() / 60
-                
-                print(f"⏰ SCHEDULER: Time difference: {time_diff_minutes:.1f} minutes (need {interval_minutes})")
-                logger.info(f"⏰ SCHEDULER: Time difference: {time_diff_minutes:.1f} minutes (need {interval_minutes})")
-                
-                if time_diff_minutes >= interval_minutes:
-                    print("✅ SCHEDULER: Interval elapsed, running monitoring")
-                    logger.info("✅ SCHEDULER: Interval elapsed, running monitoring")
-                    return True
-                else:
-                    print(f"⏳ SCHEDULER: Too early, need to wait {interval_minutes - time_diff_minutes:.1f} more minutes")
-                    logger.info(f"⏳ SCHEDULER: Too early, need to wait {interval_minutes - time_diff_minutes:.1f} more minutes")
-                    return False
-                    
-            except Exception as time_error:
-                print(f"⚠️ SCHEDULER: Error parsing time, running monitoring anyway: {time_error}")
-                logger.warning(f"⚠️ SCHEDULER: Error parsing time, running monitoring anyway: {time_error}")
-                return True
-            
-        except Exception as e:
-            print(f"❌ SCHEDULER: Error checking if should run monitoring: {e}")
-            logger.error(f"❌ SCHEDULER: Error checking if should run monitoring: {e}")
-            # При ошибке все равно запускаем мониторинг
-            return True
+                await asyncio.wait_for(
+                    self._run_monitoring_for_user(user_id, settings),
+                    timeout=app_settings.MONITORING_USER_TIMEOUT_SECONDS
+                )
+                metrics['last_status'] = 'ok'
+                metrics['last_error'] = None
+            except asyncio.TimeoutError:
+                metrics['timeouts'] += 1
+                metrics['last_status'] = 'timeout'
+                print(f"⏰ SCHEDULER: Monitoring for user {user_id} timed out after {app_settings.MONITORING_USER_TIMEOUT_SECONDS}s")
+                logger.warning(f"⏰ SCHEDULER: Monitoring for user {user_id} timed out after {app_settings.MONITORING_USER_TIMEOUT_SECONDS}s")
+            except asyncio.CancelledError:
+                metrics['last_status'] = 'cancelled'
+                raise
+            except Exception as e:
+                metrics['failures'] += 1
+                metrics['last_status'] = 'error'
+                metrics['last_error'] = str(e)
+            finally:
+                duration = time.monotonic() - started_at
+                metrics['runs'] += 1
+                metrics['last_duration_seconds'] = round(duration, 3)
+                previous_avg = metrics['avg_duration_seconds']
+                metrics['avg_duration_seconds'] = round(
+                    duration if previous_avg is None else previous_avg + (duration - previous_avg) / metrics['runs'], 3
+                )
+                metrics['last_finished_at'] = datetime.now(timezone.utc).isoformat()
+                print(f"✅ SCHEDULER: Monitoring for user {user_id} finished ({metrics['last_status']}, {duration:.1f}s)")
+    
+    @staticmethod
+    def _due_time(settings: dict) -> Optional[datetime]:
+        """Момент, когда пользователю по расписанию положен следующий прогон"""
+        last_check = settings.get('last_monitoring_check')
+        if not last_check:
+            return None
+        try:
+            if isinstance(last_check, str):
+                last_check = datetime.fromisoformat(last_check.replace('Z', '+00:00'))
+            if last_check.tzinfo is None:
+                last_check = last_check.replace(tzinfo=timezone.utc)
+        except ValueError:
+            return None
+        return last_check + timedelta(minutes=settings.get('check_interval_minutes', 5))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики прогонов по пользователям"""
+        return {
+            'running': self.running,
+            'concurrency': app_settings.MONITORING_USER_CONCURRENCY,
+            'active_runs': len(task_supervisor.running_names(USER_TASK_PREFIX)),
+            'scheduled_users': len(self._next_due),
+            'next_run_in_seconds': round(max(0.0, self._schedule[0][0] - time.time()), 3) if self._schedule else None,
+            'schedule_lag': self.schedule_lag,
+            'lease': self.lease.get_stats(),
+            'users': self.user_metrics
+        }
     
     async def _run_monitoring_for_user(self, user_id: int, settings: dict):
         """Запустить мониторинг для конкретного пользователя"""
@@ -293,15 +498,16 @@ class SchedulerService:
             logger.error(f"❌ SCHEDULER: Error running monitoring for user {user_id}: {e}")
             import traceback
             logger.error(f"❌ SCHEDULER: Traceback: {traceback.format_exc()}")
+            raise
     
     async def _update_last_check_time(self, user_id: int):
         """Обновить время последней проверки"""
         try:
             current_time = datetime.now(timezone.utc).isoformat()
             
-            supabase_client.table('monitoring_settings').update({
+            await repository.update_monitoring_settings(user_id, {
                 'last_monitoring_check': current_time
-            }).eq('user_id', user_id).execute()
+            })
             
             print(f"🕐 SCHEDULER: Updated last check time for user {user_id} to {current_time}")
             logger.info(f"🕐 SCHEDULER: Updated last check time for user {user_id} to {current_time}")
@@ -313,9 +519,7 @@ class SchedulerService:
     async def _get_user_templates(self, user_id: int) -> list:
         """Получить активные шаблоны пользователя"""
         try:
-            result = supabase_client.table('product_templates').select('*').eq('user_id', user_id).eq('is_active', True).execute()
-            
-            templates = result.data or []
+            templates = await repository.list_product_templates(user_id, active_only=True)
             print(f"📝 SCHEDULER: Retrieved {len(templates)} active templates for user {user_id}")
             logger.info(f"📝 SCHEDULER: Retrieved {len(templates)} active templates for user {user_id}")
             return templates
@@ -0,0 +1,152 @@
+# backend/app/services/task_supervisor.py
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+TaskFactory = Callable[[], Awaitable[Any]]
+
+
+class SupervisedTask:
+    """Фоновая задача под надзором: текущий asyncio.Task, статус и тайминги"""
+
+    def __init__(self, name: str, factory: TaskFactory, restart: bool):
+        self.name = name
+        self.factory = factory
+        self.restart = restart
+        self.task: Optional[asyncio.Task] = None
+        self.status = 'pending'
+        self.runs = 0
+        self.failures = 0
+        self.restarts = 0
+        self.last_error: Optional[str] = None
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.last_duration_seconds: Optional[float] = None
+        self._run_started: Optional[float] = None
+
+    def is_running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'status': self.status,
+            'restart': self.restart,
+            'runs': self.runs,
+            'failures': self.failures,
+            'restarts': self.restarts,
+            'last_error': self.last_error,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'running_seconds': round(time.monotonic() - self._run_started, 3) if self.is_running() and self._run_started else None,
+            'last_duration_seconds': self.last_duration_seconds
+        }
+
+
+class TaskSupervisor:
+    """
+    Единый реестр фоновых задач мониторинга
+
+    Задачи регистрируются по имени (scheduler:loop, monitoring:user:{id}, ...):
+    повторный spawn уже работающей задачи возвращает ее же, поэтому один
+    пользователь не мониторится дважды. Долгоживущие циклы (restart=True)
+    после падения перезапускаются с экспоненциальной задержкой
+    TASK_RESTART_BACKOFF_SECONDS..TASK_RESTART_BACKOFF_MAX_SECONDS.
+    Реестр держит ссылки на задачи, так что их не соберет сборщик мусора.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, SupervisedTask] = {}
+
+    def spawn(self, name: str, factory: TaskFactory, restart: bool = False) -> asyncio.Task:
+        """
+        Запустить задачу, если задача с таким именем еще не работает
+
+        Args:
+            name: Уникальное имя задачи
+            factory: Функция без аргументов, возвращающая корутину (вызывается на каждый запуск)
+            restart: Перезапускать ли задачу после падения
+        """
+        entry = self._tasks.get(name)
+        if entry is not None and entry.is_running():
+            return entry.task
+
+        entry = SupervisedTask(name, factory, restart)
+        entry.task = asyncio.create_task(self._supervise(entry), name=name)
+        self._tasks[name] = entry
+        return entry.task
+
+    async def _supervise(self, entry: SupervisedTask):
+        backoff = settings.TASK_RESTART_BACKOFF_SECONDS
+        while True:
+            entry.runs += 1
+            entry.status = 'running'
+            entry.started_at = datetime.now(timezone.utc).isoformat()
+            entry._run_started = time.monotonic()
+            try:
+                await entry.factory()
+                entry.status = 'finished'
+                return
+            except asyncio.CancelledError:
+                entry.status = 'cancelled'
+                raise
+            except Exception as e:
+                entry.failures += 1
+                entry.last_error = str(e)
+                entry.status = 'failed'
+                logger.error(f"Supervised task {entry.name} failed: {e}")
+                if not entry.restart:
+                    return
+            finally:
+                entry.finished_at = datetime.now(timezone.utc).isoformat()
+                entry.last_duration_seconds = round(time.monotonic() - entry._run_started, 3)
+
+            # После долгой нормальной работы задержка начинается заново
+            if entry.last_duration_seconds >= settings.TASK_RESTART_BACKOFF_MAX_SECONDS:
+                backoff = settings.TASK_RESTART_BACKOFF_SECONDS
+            entry.status = 'restarting'
+            logger.info(f"Restarting supervised task {entry.name} in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            entry.restarts += 1
+            backoff = min(backoff * 2, settings.TASK_RESTART_BACKOFF_MAX_SECONDS)
+
+    def is_running(self, name: str) -> bool:
+        entry = self._tasks.get(name)
+        return entry is not None and entry.is_running()
+
+    def running_names(self, prefix: str = "") -> List[str]:
+        return [name for name, entry in self._tasks.items() if name.startswith(prefix) and entry.is_running()]
+
+    async def cancel(self, name: str, timeout: float = 5.0):
+        """Отменить задачу и дождаться ее завершения (не дольше timeout)"""
+        entry = self._tasks.get(name)
+        if entry is None or not entry.is_running():
+            return
+        entry.task.cancel()
+        try:
+            await asyncio.wait_for(asyncio.shield(entry.task), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Supervised task {name} did not stop within {timeout}s")
+        except asyncio.CancelledError:
+            # Отменили вызывающего, а не саму задачу - пробрасываем
+            if not entry.task.done():
+                raise
+        except Exception:
+            pass
+
+    async def cancel_prefix(self, prefix: str, timeout: float = 5.0):
+        """Отменить все задачи, имя которых начинается с prefix"""
+        await asyncio.gather(*(self.cancel(name, timeout) for name in self.running_names(prefix)))
+
+    def get_stats(self, prefix: str = "") -> List[Dict[str, Any]]:
+        return [entry.to_dict() for name, entry in sorted(self._tasks.items()) if name.startswith(prefix)]
+
+
+# Глобальный реестр задач процесса
+task_supervisor = TaskSupervisor()
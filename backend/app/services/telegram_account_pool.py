@@ -0,0 +1,204 @@
+# backend/app/services/telegram_account_pool.py
+import asyncio
+import bisect
+import hashlib
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+
+from ..core.config import settings
+from .entity_cache import EntityCache, entity_ref_key
+from .rate_limiter import TelegramRateLimiter
+from .telegram_operation_scheduler import TelegramOperationScheduler
+
+logger = logging.getLogger(__name__)
+
+# Количество виртуальных узлов каждого аккаунта на кольце consistent hashing
+VIRTUAL_NODES = 64
+
+
+def _hash(value: str) -> int:
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest(), 16)
+
+
+def shard_key(entity_ref: Any) -> str:
+    """
+    Ключ шардирования для группы/канала
+
+    Числовые формы одного чата (123, -100123) дают один ключ.
+    Username и числовой id одной группы - разные ключи: шардирование
+    идет по тому идентификатору, с которым группа хранится в настройках.
+    """
+    key = entity_ref_key(entity_ref)
+    if key.startswith('peer:-100'):
+        return f"id:{key[len('peer:-100'):]}"
+    if key.startswith('peer:-'):
+        return f"id:{key[len('peer:-'):]}"
+    return key
+
+
+class TelegramAccount:
+    """
+    Один аккаунт Telegram пула со своими ресурсами
+
+    У каждого аккаунта собственные клиент (MTProto-соединение), планировщик
+    операций, rate limiter, кэш сущностей (access_hash привязан к аккаунту)
+    и замок переподключения.
+    """
+
+    def __init__(self, session_string: str, api_id: int, api_hash: str):
+        self.session_string = session_string
+        # Имя стабильно при перестановке сессий в конфигурации и не раскрывает саму сессию
+        self.name = f"acc-{hashlib.sha1(session_string.encode('utf-8')).hexdigest()[:8]}"
+
+        self.client = TelegramClient(
+            StringSession(session_string),
+            api_id,
+            api_hash,
+            flood_sleep_threshold=settings.TELEGRAM_FLOOD_SLEEP_THRESHOLD
+        )
+        self.operation_scheduler = TelegramOperationScheduler(
+            max_parallel=settings.TELEGRAM_MAX_PARALLEL_OPERATIONS,
+            class_limits={
+                'history': settings.TELEGRAM_HISTORY_CONCURRENCY,
+                'participants': settings.TELEGRAM_PARTICIPANTS_CONCURRENCY,
+                'entity': settings.TELEGRAM_ENTITY_CONCURRENCY
+            }
+        )
+        self.rate_limiter = TelegramRateLimiter()
+        self.entity_cache = EntityCache(
+            max_size=settings.ENTITY_CACHE_SIZE,
+            ttl_seconds=settings.ENTITY_CACHE_TTL_SECONDS,
+            negative_ttl_seconds=settings.ENTITY_CACHE_NEGATIVE_TTL_SECONDS
+        )
+        self.connect_lock = asyncio.Lock()
+        self.is_connected = False
+        self.unhealthy_until = 0.0
+        self.last_error: Optional[str] = None
+
+    def mark_unhealthy(self, error: Exception):
+        """Временно исключить аккаунт из выбора после ошибки подключения"""
+        self.unhealthy_until = time.monotonic() + settings.TELEGRAM_ACCOUNT_RETRY_SECONDS
+        self.last_error = str(error)
+        self.is_connected = False
+        logger.warning(f"Telegram account {self.name} marked unhealthy: {error}")
+
+    def mark_healthy(self):
+        self.unhealthy_until = 0.0
+        self.last_error = None
+        self.is_connected = True
+
+    def is_available(self, rate_key: str) -> bool:
+        """Аккаунт подключаем и не находится под FloodWait для данного типа RPC"""
+        return time.monotonic() >= self.unhealthy_until and not self.rate_limiter.is_blocked(rate_key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'connected': self.client.is_connected(),
+            'healthy': time.monotonic() >= self.unhealthy_until,
+            'last_error': self.last_error,
+            'scheduler': self.operation_scheduler.stats(),
+            'entity_cache': self.entity_cache.stats(),
+            'rate_limits': self.rate_limiter.budgets()
+        }
+
+
+class TelegramAccountPool:
+    """
+    Пул аккаунтов Telegram с распределением групп по consistent hashing
+
+    Каждая группа закреплена за аккаунтом-владельцем на кольце хэшей, поэтому
+    добавление аккаунта переносит лишь часть групп. Если владелец под FloodWait
+    или отключен, операция уходит следующему по кольцу доступному аккаунту.
+    """
+
+    def __init__(self, accounts: List[TelegramAccount], virtual_nodes: int = VIRTUAL_NODES):
+        if not accounts:
+            raise ValueError("Telegram account pool requires at least one session")
+
+        self.accounts = accounts
+        self.primary = accounts[0]
+        self._ring: List[int] = []
+        self._ring_accounts: List[TelegramAccount] = []
+
+        nodes = sorted(
+            [
+                (_hash(f"{account.name}#{index}"), account)
+                for account in accounts
+                for index in range(virtual_nodes)
+            ],
+            key=lambda node: node[0]
+        )
+        for point, account in nodes:
+            self._ring.append(point)
+            self._ring_accounts.append(account)
+
+        self.failovers = 0
+
+    @classmethod
+    def from_settings(cls) -> "TelegramAccountPool":
+        """Собрать пул из TELEGRAM_SESSION_STRING и TELEGRAM_SESSION_STRINGS"""
+        sessions = []
+        if settings.TELEGRAM_SESSION_STRING:
+            sessions.append(settings.TELEGRAM_SESSION_STRING)
+        if settings.TELEGRAM_SESSION_STRINGS:
+            sessions.extend(s.strip() for s in settings.TELEGRAM_SESSION_STRINGS.split(',') if s.strip())
+
+        # Без сессий оставляем один аккаунт с пустой сессией, как и раньше
+        unique_sessions = list(dict.fromkeys(sessions)) or ['']
+
+        accounts = [
+            TelegramAccount(session, settings.TELEGRAM_API_ID, settings.TELEGRAM_API_HASH)
+            for session in unique_sessions
+        ]
+        logger.info(f"Telegram account pool initialized with {len(accounts)} account(s)")
+        return cls(accounts)
+
+    def candidates(self, key: Optional[str]) -> List[TelegramAccount]:
+        """Аккаунты в порядке предпочтения для ключа: владелец, затем соседи по кольцу"""
+        if key is None or len(self.accounts) == 1:
+            return list(self.accounts)
+
+        start = bisect.bisect(self._ring, _hash(key)) % len(self._ring)
+        ordered: List[TelegramAccount] = []
+        for offset in range(len(self._ring)):
+            account = self._ring_accounts[(start + offset) % len(self._ring)]
+            if account not in ordered:
+                ordered.append(account)
+                if len(ordered) == len(self.accounts):
+                    break
+        return ordered
+
+    def pick(self, entity_ref: Any = None, rate_key: str = 'default') -> TelegramAccount:
+        """
+        Выбрать аккаунт для операции над группой
+
+        Args:
+            entity_ref: Группа/канал, над которой выполняется операция (None - без шардирования)
+            rate_key: Тип RPC, по бюджету которого проверяется доступность
+
+        Returns:
+            Первый доступный аккаунт по кольцу; если недоступны все - владелец группы
+        """
+        candidates = self.candidates(shard_key(entity_ref) if entity_ref is not None else None)
+        for index, account in enumerate(candidates):
+            if account.is_available(rate_key):
+                if index > 0:
+                    self.failovers += 1
+                    logger.info(f"Failover to {account.name} for {entity_ref} ({rate_key})")
+                return account
+        return candidates[0]
+
+    def all_blocked(self, rate_key: str) -> bool:
+        """Все аккаунты пула под FloodWait для данного типа RPC"""
+        return all(account.rate_limiter.is_blocked(rate_key) for account in self.accounts)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'accounts_count': len(self.accounts),
+            'failovers': self.failovers,
+            'accounts': {account.name: account.stats() for account in self.accounts}
+        }
@@ -0,0 +1,106 @@
+# backend/app/services/telegram_operation_scheduler.py
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPERATION_CLASS = 'default'
+
+
+class TelegramOperationScheduler:
+    """
+    Планировщик операций Telegram с ограничением параллелизма.
+
+    Telethon мультиплексирует запросы в одном MTProto-соединении, поэтому
+    вместо глобального мьютекса используется общий лимит одновременных операций
+    плюс отдельные лимиты по классам (history, participants, entity, ...).
+    Для каждого класса ведутся метрики очереди и времени выполнения.
+    """
+
+    def __init__(self, max_parallel: int, class_limits: Optional[Dict[str, int]] = None):
+        self.max_parallel = max_parallel
+        self.class_limits = dict(class_limits or {})
+        self._global = asyncio.Semaphore(max_parallel)
+        self._classes: Dict[str, asyncio.Semaphore] = {
+            op_class: asyncio.Semaphore(limit)
+            for op_class, limit in self.class_limits.items()
+        }
+        self.metrics: Dict[str, Dict[str, Any]] = {}
+
+    def _class_metrics(self, op_class: str) -> Dict[str, Any]:
+        return self.metrics.setdefault(op_class, {
+            'waiting': 0,
+            'running': 0,
+            'completed': 0,
+            'failed': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+            'total_run_ms': 0.0
+        })
+
+    @asynccontextmanager
+    async def slot(self, op_class: str = DEFAULT_OPERATION_CLASS):
+        """Дождаться свободного слота для операции указанного класса"""
+        metrics = self._class_metrics(op_class)
+        class_semaphore = self._classes.get(op_class)
+
+        metrics['waiting'] += 1
+        queued_at = time.perf_counter()
+        acquired_class = False
+        acquired_global = False
+        try:
+            if class_semaphore is not None:
+                await class_semaphore.acquire()
+                acquired_class = True
+            await self._global.acquire()
+            acquired_global = True
+        except BaseException:
+            if acquired_class:
+                class_semaphore.release()
+            raise
+        finally:
+            metrics['waiting'] -= 1
+
+        wait_ms = (time.perf_counter() - queued_at) * 1000
+        metrics['total_wait_ms'] += wait_ms
+        metrics['max_wait_ms'] = max(metrics['max_wait_ms'], wait_ms)
+        if wait_ms > 5000:
+            logger.warning(f"Telegram operation '{op_class}' waited {wait_ms:.0f}ms for a slot")
+
+        metrics['running'] += 1
+        started = time.perf_counter()
+        try:
+            yield
+            metrics['completed'] += 1
+        except BaseException:
+            metrics['failed'] += 1
+            raise
+        finally:
+            metrics['running'] -= 1
+            metrics['total_run_ms'] += (time.perf_counter() - started) * 1000
+            if acquired_global:
+                self._global.release()
+            if acquired_class:
+                class_semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Текущая глубина очередей и накопленные метрики по классам операций"""
+        classes = {}
+        for op_class, metrics in self.metrics.items():
+            finished = metrics['completed'] + metrics['failed']
+            classes[op_class] = {
+                **metrics,
+                'limit': self.class_limits.get(op_class),
+                'avg_wait_ms': metrics['total_wait_ms'] / finished if finished else 0.0,
+                'avg_run_ms': metrics['total_run_ms'] / finished if finished else 0.0
+            }
+
+        return {
+            'max_parallel': self.max_parallel,
+            'queue_depth': sum(m['waiting'] for m in self.metrics.values()),
+            'running': sum(m['running'] for m in self.metrics.values()),
+            'classes': classes
+        }
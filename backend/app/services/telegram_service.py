@@ -2,18 +2,32 @@
 from telethon import TelegramClient, types
 from telethon.sessions import StringSession
 from telethon.tl.types import Message, User, Channel, Chat
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
+from contextvars import ContextVar
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 import asyncio
+import time
 import uuid
 import logging
 import re
 from urllib.parse import urlparse
 from ..core.config import settings
-from ..core.database import supabase_client
+from ..core.repository import repository
+from .user_profile_cache import user_profile_resolver
+from .message_cache import message_cache
+from .reply_index import ReplyIndex
+from .message_record import MessageRecord
+from .moderator_metrics import calculate_moderator_metrics
+from .telegram_operation_scheduler import DEFAULT_OPERATION_CLASS
+from .telegram_account_pool import TelegramAccount, TelegramAccountPool
+from telethon import errors
 
 logger = logging.getLogger(__name__)
 
+# Аккаунт пула, выбранный для текущей операции (своя копия у каждой asyncio-задачи)
+_current_account: ContextVar[Optional[TelegramAccount]] = ContextVar('telegram_account', default=None)
+
 
 class TelegramService:
     _instance = None
@@ -30,24 +44,80 @@ class TelegramService:
             
         self.api_id = settings.TELEGRAM_API_ID
         self.api_hash = settings.TELEGRAM_API_HASH
-        self.session_string = settings.TELEGRAM_SESSION_STRING
-        
-        # Создаем клиента сразу, но не подключаемся
-        self.client = TelegramClient(
-            StringSession(self.session_string),
-            self.api_id,
-            self.api_hash
-        )
         
-        # Замок для синхронизации доступа к клиенту
-        self.client_lock = asyncio.Lock()
+        # Пул аккаунтов: у каждого свой клиент, планировщик операций, rate limiter,
+        # кэш сущностей и замок переподключения. Группы распределяются по
+        # аккаунтам consistent hashing'ом (см. execute_telegram_operation)
+        self.pool = TelegramAccountPool.from_settings()
         
-        # Отслеживаем состояние подключения
-        self.is_connected = False
+        # High-water marks инкрементальной синхронизации: sync_key -> последний message_id
+        self.sync_state: Dict[str, int] = {}
         self._initialized = True
         
         logger.info("TelegramService initialized")
     
+    @property
+    def account(self) -> TelegramAccount:
+        """Аккаунт текущей операции; вне execute_telegram_operation - основной аккаунт пула"""
+        return _current_account.get() or self.pool.primary
+    
+    @property
+    def client(self) -> TelegramClient:
+        return self.account.client
+    
+    @property
+    def session_string(self) -> str:
+        return self.account.session_string
+    
+    @property
+    def operation_scheduler(self):
+        return self.account.operation_scheduler
+    
+    @property
+    def rate_limiter(self):
+        return self.account.rate_limiter
+    
+    @property
+    def entity_cache(self):
+        return self.account.entity_cache
+    
+    @property
+    def connect_lock(self) -> asyncio.Lock:
+        return self.account.connect_lock
+    
+    @property
+    def is_connected(self) -> bool:
+        return self.account.is_connected
+    
+    @is_connected.setter
+    def is_connected(self, value: bool):
+        self.account.is_connected = value
+    
+    @contextmanager
+    def using_account(self, account: TelegramAccount):
+        """Выполнять вызовы сервиса от имени конкретного аккаунта пула (например, в обработчиках событий)"""
+        token = _current_account.set(account)
+        try:
+            yield account
+        finally:
+            _current_account.reset(token)
+    
+    async def ensure_all_connected(self) -> List[TelegramAccount]:
+        """Подключить все аккаунты пула, вернуть успешно подключенные"""
+        connected = []
+        for account in self.pool.accounts:
+            with self.using_account(account):
+                try:
+                    await self.ensure_connected()
+                    connected.append(account)
+                except Exception as e:
+                    logger.warning(f"Account {account.name} is not available: {e}")
+        return connected
+    
+    def is_flood_limited(self, rate_key: str = 'history') -> bool:
+        """Все аккаунты пула под FloodWait для данного типа RPC"""
+        return self.pool.all_blocked(rate_key)
+    
     async def start(self):
         """Запуск клиента при старте приложения"""
         try:
@@ -62,27 +132,32 @@ class TelegramService:
             raise
     
     async def close(self):
-        """Корректное закрытие клиента при завершении работы приложения"""
-        if self.is_connected:
-            logger.info("Disconnecting Telegram client...")
+        """Корректное закрытие клиентов всех аккаунтов при завершении работы приложения"""
+        for account in self.pool.accounts:
+            if not account.client.is_connected():
+                account.is_connected = False
+                continue
+            
+            logger.info(f"Disconnecting Telegram client {account.name}...")
             try:
-                # Освобождаем блокировку, если она активна
-                if self.client_lock.locked():
-                    self.client_lock.release()
-                    
                 # Отключаем клиента с таймаутом
-                await asyncio.wait_for(self.client.disconnect(), timeout=3.0)
-                self.is_connected = False
-                logger.info("Telegram client disconnected")
+                await asyncio.wait_for(account.client.disconnect(), timeout=3.0)
+                logger.info(f"Telegram client {account.name} disconnected")
             except Exception as e:
-                logger.error(f"Error during disconnect: {e}")
-                # Принудительно освобождаем ресурсы
-                self.client = None
-                self.is_connected = False
+                logger.error(f"Error during disconnect of {account.name}: {e}")
+            finally:
+                account.is_connected = False
     
     async def ensure_connected(self):
         """Проверка и восстановление соединения при необходимости"""
-        if not self.client.is_connected():
+        if self.client.is_connected():
+            return
+        
+        async with self.connect_lock:
+            # Пока ждали замок, соединение мог восстановить другой вызов
+            if self.client.is_connected():
+                return
+            
             logger.info("Client is not connected, reconnecting...")
             try:
                 await self.client.connect()
@@ -93,11 +168,12 @@ class TelegramService:
                     logger.warning("User is not authorized. Session might be invalid.")
                     raise ValueError("User is not authorized. Please provide a valid session string.")
                 
-                self.is_connected = True
-                logger.info("Reconnected successfully")
+                self.account.mark_healthy()
+                logger.info(f"Reconnected successfully ({self.account.name})")
             except Exception as e:
-                self.is_connected = False
-                logger.error(f"Failed to reconnect: {e}")
+                # Аккаунт временно выводится из ротации, операции уйдут на соседний по кольцу
+                self.account.mark_unhealthy(e)
+                logger.error(f"Failed to reconnect {self.account.name}: {e}")
                 raise
 
 
@@ -122,28 +198,51 @@ class TelegramService:
             raise
 
     
-    async def execute_telegram_operation(self, operation):
+    async def execute_telegram_operation(
+        self,
+        operation,
+        op_class: str = DEFAULT_OPERATION_CLASS,
+        shard_key: Optional[Any] = None
+    ):
         """
-        Выполняет операцию с Telegram API с обработкой соединения и блокировкой.
+        Выполняет операцию с Telegram API с обработкой соединения и ограничением параллелизма.
         
         Этот метод гарантирует, что:
-        1. Клиент подключен
-        2. Операция выполняется эксклюзивно (без конкурентного доступа)
-        3. Операция повторяется при временных проблемах
+        1. Операция выполняется аккаунтом пула, за которым закреплена группа shard_key;
+           если он под FloodWait или отключен - следующим доступным по кольцу
+        2. Клиент выбранного аккаунта подключен
+        3. Одновременно выполняется не больше операций, чем разрешено общим лимитом
+           и лимитом класса op_class (history, participants, entity, default) этого аккаунта
+        4. Операция повторяется при временных проблемах; при FloodWait повтор
+           происходит не раньше, чем разрешил Telegram (ожидание берет на себя rate limiter),
+           либо сразу на другом аккаунте
+        
+        Внутри operation self.client, self.rate_limiter и self.entity_cache относятся
+        к выбранному аккаунту.
         """
         max_retries = 3
         retry_delay = 2
         
         for attempt in range(max_retries):
+            # Аккаунт выбирается на каждой попытке, чтобы повтор ушел с заблокированного
+            account = self.pool.pick(shard_key, op_class)
+            account_token = _current_account.set(account)
             try:
-                # Используем блокировку для предотвращения конкурентного доступа
-                async with self.client_lock:
+                # Ждем свободный слот планировщика для этого класса операций
+                async with account.operation_scheduler.slot(op_class):
                     # Проверяем и восстанавливаем соединение
                     await self.ensure_connected()
                     
                     # Выполняем операцию
                     return await operation()
                     
+            except errors.FloodWaitError as e:
+                # Бакет уже заблокирован на e.seconds в _rate_limited/_paced,
+                # поэтому повторный запрос сам дождется окончания FloodWait
+                logger.warning(f"FloodWait {e.seconds}s (attempt {attempt+1}/{max_retries})")
+                if attempt == max_retries - 1 or e.seconds > settings.TELEGRAM_MAX_FLOOD_WAIT_SECONDS:
+                    raise
+                
             except asyncio.CancelledError:
                 logger.warning(f"Operation was cancelled (attempt {attempt+1}/{max_retries})")
                 if attempt == max_retries - 1:
@@ -161,6 +260,55 @@ class TelegramService:
                 
                 # Экспоненциальная задержка перед повторной попыткой
                 await asyncio.sleep(retry_delay * (2 ** attempt))
+            
+            finally:
+                _current_account.reset(account_token)
+    
+    async def _rate_limited(self, rate_key: str, call):
+        """
+        Выполнить одиночный RPC с учетом бюджета rate_key
+        
+        Args:
+            rate_key: Тип RPC (history, replies, participants, entity)
+            call: Функция без аргументов, возвращающая корутину запроса
+        """
+        await self.rate_limiter.acquire(rate_key)
+        try:
+            return await call()
+        except errors.FloodWaitError as e:
+            self.rate_limiter.on_flood_wait(rate_key, e.seconds)
+            raise
+    
+    async def _paced(self, rate_key: str, iterator, page_size: int = 100, rate_limiter=None, operation_scheduler=None):
+        """
+        Обернуть итератор Telethon так, чтобы каждая страница запроса брала токен
+        
+        Telethon запрашивает следующую страницу, когда заканчивается предыдущая,
+        поэтому токен берется перед каждым page_size-ым элементом.
+        rate_limiter передается явно, если генератор читается вне контекста операции.
+        operation_scheduler - слот планировщика берется только на загрузку страницы
+        (для потоков, которые читает медленный потребитель).
+        """
+        rate_limiter = rate_limiter or self.rate_limiter
+        iterator = iterator.__aiter__()
+        index = 0
+        while True:
+            page_start = index % page_size == 0
+            if page_start:
+                await rate_limiter.acquire(rate_key)
+            try:
+                if page_start and operation_scheduler is not None:
+                    async with operation_scheduler.slot(rate_key):
+                        item = await iterator.__anext__()
+                else:
+                    item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            except errors.FloodWaitError as e:
+                rate_limiter.on_flood_wait(rate_key, e.seconds)
+                raise
+            index += 1
+            yield item
     
     async def get_group_messages(
         self, 
@@ -170,26 +318,25 @@ class TelegramService:
         include_replies: bool = True,
         get_users: bool = True,
         save_to_db: bool = False,
-        days_back: Optional[int] = None  # НОВЫЙ параметр для фильтрации по дням
-    ) -> List[Dict[str, Any]]:
+        days_back: Optional[int] = None,  # НОВЫЙ параметр для фильтрации по дням
+        min_id: Optional[int] = None,
+        sync_key: Optional[str] = None,
+        max_id: Optional[int] = None
+    ) -> List[MessageRecord]:
         """
         БЕЗОПАСНЫЙ метод получения сообщений из группы
         Основан на рабочей версии + логика days_back из daysback.docx
+        
+        Окно выборки: нижняя граница - days_back / min_id, верхняя - offset_date
+        (только сообщения раньше этой даты) / max_id (только id меньше). Границы
+        передаются в GetHistory, поэтому запрос читает только страницы внутри окна,
+        а историческое окно не пролистывает все более новые сообщения.
+        
+        Если передан sync_key, работает в режиме инкрементальной синхронизации:
+        загружаются только сообщения новее сохраненного high-water mark
+        (через min_id), после чего отметка сдвигается на последний полученный id.
         """
         try:
-            # Подключаемся если нужно (как в рабочей версии)
-            await self.ensure_connected()
-            
-            # Получаем entity напрямую (БЕЗ execute_telegram_operation!)
-            try:
-                if str(group_id).lstrip('-').isdigit():
-                    entity = await self.client.get_entity(int(group_id))
-                else:
-                    entity = await self.client.get_entity(group_id)
-            except Exception as e:
-                logger.error(f"Failed to get entity for group {group_id}: {e}")
-                return []
-            
             # Логика фильтрации по дням (из daysback.docx)
             cutoff_date = None
             if days_back is not None and days_back > 0:
@@ -198,77 +345,41 @@ class TelegramService:
             else:
                 logger.info(f"Getting last {limit} messages (no date filtering)")
             
-            messages = []
-            users_cache = {}
-            
-            # Основной цикл получения сообщений (АДАПТИРОВАННЫЙ из daysback.docx для Telethon)
-            async for message in self.client.iter_messages(entity, limit=limit):
-                # КЛЮЧЕВАЯ ЛОГИКА: Если сообщение старше cutoff_date - останавливаемся
-                if cutoff_date is not None and message.date < cutoff_date:
-                    logger.info(f"Reached message from {message.date.strftime('%Y-%m-%d %H:%M:%S')} - stopping (older than {days_back} days)")
-                    break
+            offset_date = self._as_utc(offset_date)
+            if offset_date or max_id:
+                logger.info(f"Upper window edge for group {group_id}: before {offset_date or '-'}, id < {max_id or '-'}")
+            
+            # Инкрементальный режим: начинаем с последнего известного сообщения
+            if sync_key:
+                high_water_mark = await self._get_high_water_mark(sync_key)
+                if high_water_mark:
+                    min_id = max(min_id or 0, high_water_mark)
+            
+            # При известном min_id идем от старых к новым, чтобы при упоре в limit
+            # отметка сдвигалась без пропусков, а следующий вызов продолжил с нее
+            reverse = bool(min_id)
+            if reverse:
+                logger.info(f"Incremental fetch for group {group_id}: messages after id {min_id}")
+            
+            # Окно "последние N дней / N сообщений" сначала пробуем ответить из локального кэша.
+            # Окна с верхней границей идут в Telegram: покрытие кэша описывает только хвост истории
+            use_cache = message_cache is not None and not offset_date and not max_id
+            messages = None
+            if use_cache and not min_id:
+                messages = await self._read_through_cache(group_id, limit, cutoff_date, get_users)
+            
+            if messages is None:
+                messages = await self._fetch_group_messages(
+                    group_id, limit, min_id, reverse, cutoff_date, get_users,
+                    offset_date=offset_date, max_id=max_id
+                )
                 
-                # Обрабатываем сообщение (как в рабочей версии)
-                try:
-                    msg_data = {
-                        'message_id': str(message.id),
-                        'text': message.text or "",
-                        'date': message.date.isoformat(),
-                        'sender_id': str(message.sender_id) if message.sender_id else None,
-                        'is_reply': message.is_reply,
-                        'reply_to_message_id': str(message.reply_to_msg_id) if message.reply_to_msg_id else None,
-                        'forward_from': None,
-                        'media_type': None,
-                        'edit_date': message.edit_date.isoformat() if message.edit_date else None,
-                        'views': getattr(message, 'views', None),
-                        'user_info': None
-                    }
-                    
-                    # Информация о медиа
-                    if message.media:
-                        if hasattr(message.media, 'photo'):
-                            msg_data['media_type'] = 'photo'
-                        elif hasattr(message.media, 'document'):
-                            msg_data['media_type'] = 'document'
-                        elif hasattr(message.media, 'video'):
-                            msg_data['media_type'] = 'video'
-                        else:
-                            msg_data['media_type'] = 'other'
-                    
-                    # Информация о пересылке
-                    if message.forward:
-                        msg_data['forward_from'] = {
-                            'from_id': str(message.forward.from_id) if message.forward.from_id else None,
-                            'from_name': getattr(message.forward, 'from_name', None),
-                            'date': message.forward.date.isoformat() if message.forward.date else None
-                        }
-                    
-                    # Получаем информацию о пользователе (если нужно)
-                    if get_users and message.sender_id:
-                        if message.sender_id not in users_cache:
-                            try:
-                                user = await self.client.get_entity(message.sender_id)
-                                if user:
-                                    users_cache[message.sender_id] = {
-                                        'telegram_id': str(user.id),
-                                        'username': getattr(user, 'username', None),
-                                        'first_name': getattr(user, 'first_name', None),
-                                        'last_name': getattr(user, 'last_name', None),
-                                        'is_bot': getattr(user, 'bot', False)
-                                    }
-                                else:
-                                    users_cache[message.sender_id] = None
-                            except Exception as user_error:
-                                logger.warning(f"Failed to get user info for {message.sender_id}: {user_error}")
-                                users_cache[message.sender_id] = None
-                        
-                        msg_data['user_info'] = users_cache.get(message.sender_id)
-                    
-                    messages.append(msg_data)
-                    
-                except Exception as message_error:
-                    logger.warning(f"Failed to process message {message.id}: {message_error}")
-                    continue
+                # Возвращаем в привычном порядке: самые новые первыми
+                if reverse:
+                    messages.reverse()
+                
+                if use_cache:
+                    await self._fill_cache(group_id, messages, limit, cutoff_date, min_id)
             
             # Финальная статистика
             if cutoff_date:
@@ -276,44 +387,448 @@ class TelegramService:
             else:
                 logger.info(f"Retrieved {len(messages)} latest messages (limit={limit})")
             
-            # Сохранение в БД (если нужно) - как в рабочей версии
+            # Сохранение в БД (если нужно) - пачками, а не по одному сообщению
+            saved_all = True
             if save_to_db and messages:
+                saved_all = False
                 try:
-                    for msg in messages:
-                        msg_for_db = msg.copy()
-                        msg_for_db['group_id'] = group_id
-                        msg_for_db['created_at'] = datetime.now().isoformat()
-                        
-                        supabase_client.table('telegram_messages').upsert(msg_for_db).execute()
+                    created_at = datetime.now().isoformat()
+                    rows = [
+                        {**msg, 'group_id': group_id, 'created_at': created_at}
+                        for msg in messages
+                    ]
                     
-                    logger.info(f"Saved {len(messages)} messages to database")
+                    upsert_stats = await repository.upsert_messages(rows)
+                    logger.info(
+                        f"Saved {upsert_stats['saved']}/{len(messages)} messages to database "
+                        f"({upsert_stats['rows_per_second']} rows/s)"
+                    )
+                    saved_all = upsert_stats['saved'] == len(rows)
                 except Exception as db_error:
                     logger.warning(f"Failed to save messages to database: {db_error}")
             
+            # Сдвигаем high-water mark только после успешной обработки: если сохранились
+            # не все сообщения, следующий вызов загрузит их заново
+            if sync_key and messages and not saved_all:
+                logger.warning(f"Not all messages of group {group_id} were saved, keeping high-water mark for {sync_key}")
+            elif sync_key and messages:
+                await self._update_high_water_mark(
+                    sync_key,
+                    group_id,
+                    max(int(msg['message_id']) for msg in messages)
+                )
+            
             return messages
             
         except Exception as e:
             logger.error(f"Error getting messages from group {group_id}: {e}")
             return []
     
+    async def _fetch_group_messages(
+        self,
+        group_id: str,
+        limit: int,
+        min_id: Optional[int],
+        reverse: bool,
+        cutoff_date: Optional[datetime],
+        get_users: bool,
+        offset_date: Optional[datetime] = None,
+        max_id: Optional[int] = None
+    ) -> List[MessageRecord]:
+        """Загрузить сообщения из Telegram (в порядке обхода истории)"""
+        async def operation():
+            # Получаем entity через кэш аккаунта, выбранного для этой группы
+            try:
+                entity = await self.resolve_entity(group_id)
+            except errors.FloodWaitError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to get entity for group {group_id}: {e}")
+                return []
+            
+            # Одна пачка на весь limit: отправители разрешаются одним запросом, как и раньше
+            messages = []
+            async for batch in self._iter_message_batches(
+                self.account, entity, limit, min_id, reverse, cutoff_date, get_users, batch_size=limit,
+                offset_date=offset_date, max_id=max_id
+            ):
+                messages.extend(batch)
+            return messages
+        
+        return await self.execute_telegram_operation(operation, op_class='history', shard_key=group_id)
+    
+    async def _read_through_cache(
+        self,
+        group_id: str,
+        limit: int,
+        cutoff_date: Optional[datetime],
+        get_users: bool
+    ) -> Optional[List[MessageRecord]]:
+        """
+        Ответить на запрос окна из локального кэша, догрузив из Telegram только новые сообщения
+        
+        Returns:
+            Сообщения от новых к старым или None, если окно не покрыто кэшем
+        """
+        try:
+            coverage = await message_cache.get_coverage(group_id)
+            if not coverage:
+                message_cache.stats['misses'] += 1
+                return None
+            
+            # Правки и удаления старых сообщений видны только при полной загрузке окна
+            if time.time() - coverage['revalidated_at'] >= settings.MESSAGE_CACHE_REVALIDATE_SECONDS:
+                message_cache.stats['revalidations'] += 1
+                return None
+            
+            since_ts = cutoff_date.timestamp() if cutoff_date else coverage['covered_from_ts']
+            if since_ts < coverage['covered_from_ts']:
+                # Окно уходит глубже, чем покрыто кэшем
+                message_cache.stats['misses'] += 1
+                return None
+            
+            # Догружаем только то, что появилось после покрытия
+            gap_limit = settings.MESSAGE_CACHE_GAP_LIMIT
+            gap = await self._fetch_group_messages(
+                group_id, gap_limit, coverage['covered_to_id'], True, None, get_users
+            )
+            if len(gap) >= gap_limit:
+                # Разрыв слишком велик, чтобы считать покрытие непрерывным
+                await message_cache.drop_coverage(group_id)
+                message_cache.stats['misses'] += 1
+                return None
+            
+            if gap:
+                await message_cache.store(group_id, gap)
+                await message_cache.set_coverage(
+                    group_id,
+                    coverage['covered_from_ts'],
+                    max(int(msg['message_id']) for msg in gap)
+                )
+            
+            messages = await message_cache.query(group_id, since_ts, limit)
+            
+            # Без фильтра по дате покрытие должно вместить limit сообщений (или всю историю)
+            if cutoff_date is None and len(messages) < limit and coverage['covered_from_ts'] > 0:
+                message_cache.stats['misses'] += 1
+                return None
+            
+            # Сообщения, закэшированные загрузкой без get_users, получают профили из общего кэша
+            if get_users:
+                without_profiles = [msg for msg in messages if msg.get('sender_id') and not msg.get('user_info')]
+                if without_profiles:
+                    await self._attach_user_info(without_profiles, {})
+            
+            message_cache.stats['hits'] += 1
+            logger.info(f"Served {len(messages)} messages for group {group_id} from local cache ({len(gap)} new from Telegram)")
+            return messages
+            
+        except Exception as e:
+            logger.warning(f"Message cache read failed for group {group_id}: {e}")
+            return None
+    
+    async def _fill_cache(
+        self,
+        group_id: str,
+        messages: List[MessageRecord],
+        limit: int,
+        cutoff_date: Optional[datetime],
+        min_id: Optional[int]
+    ):
+        """Сохранить загруженные сообщения в локальный кэш и расширить покрытие группы"""
+        if not messages:
+            return
+        
+        try:
+            await message_cache.store(group_id, messages)
+            
+            newest_id = max(int(msg['message_id']) for msg in messages)
+            truncated = len(messages) >= limit
+            coverage = await message_cache.get_coverage(group_id)
+            
+            if min_id:
+                # Инкрементальная загрузка продолжает покрытие, только если начинается внутри него
+                # и не пропустила сообщения старше cutoff внутри покрытого окна
+                if (coverage and min_id <= coverage['covered_to_id'] and not truncated
+                        and (cutoff_date is None or coverage['covered_from_ts'] >= cutoff_date.timestamp())):
+                    await message_cache.set_coverage(
+                        group_id, coverage['covered_from_ts'], max(newest_id, coverage['covered_to_id'])
+                    )
+                return
+            
+            # Полная загрузка от новых к старым: непрерывный участок до самого старого сообщения,
+            # а если limit не исчерпан - до cutoff (или всей истории)
+            if truncated:
+                covered_from_ts = min(datetime.fromisoformat(msg['date'].replace('Z', '+00:00')).timestamp() for msg in messages)
+            else:
+                covered_from_ts = cutoff_date.timestamp() if cutoff_date else 0.0
+            
+            # Участок загружен целиком: чего в нем нет, то удалено в Telegram. Покрытие
+            # сужается до этого участка, чтобы оно все было перепроверено (revalidated)
+            await message_cache.delete_missing(
+                group_id, [int(msg['message_id']) for msg in messages], covered_from_ts, newest_id
+            )
+            await message_cache.set_coverage(group_id, covered_from_ts, newest_id, revalidated=True)
+            
+        except Exception as e:
+            logger.warning(f"Message cache write failed for group {group_id}: {e}")
+    
+    async def iter_group_messages(
+        self,
+        group_id: str,
+        limit: int = 100,
+        days_back: Optional[int] = None,
+        get_users: bool = True,
+        min_id: Optional[int] = None,
+        batch_size: int = 100,
+        offset_date: Optional[datetime] = None,
+        max_id: Optional[int] = None
+    ) -> AsyncIterator[List[MessageRecord]]:
+        """
+        Потоковый вариант get_group_messages: отдает пачки сообщений по мере загрузки страниц
+        
+        Память не растет с limit, первая пачка доступна после первой страницы GetHistory.
+        Порядок - от новых к старым (при min_id - от старых к новым). Повтора при
+        FloodWait нет: часть данных уже отдана, ошибка передается вызывающему.
+        
+        Args:
+            group_id: ID группы
+            limit: Максимальное количество сообщений
+            days_back: Только сообщения за последние N дней
+            get_users: Заполнять user_info отправителей
+            min_id: Только сообщения новее этого id
+            batch_size: Размер отдаваемой пачки
+            offset_date: Только сообщения раньше этой даты
+            max_id: Только сообщения старше этого id
+            
+        Yields:
+            Списки сообщений (MessageRecord)
+        """
+        cutoff_date = None
+        if days_back is not None and days_back > 0:
+            cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_back)
+        reverse = bool(min_id)
+        
+        account = self.pool.pick(group_id, 'history')
+        with self.using_account(account):
+            await self.ensure_connected()
+            entity = await self.resolve_entity(group_id)
+        
+        # Слот планировщика берется на каждую страницу GetHistory, а не на весь поток:
+        # медленный потребитель не должен занимать слоты истории остальных операций
+        async for batch in self._iter_message_batches(
+            account, entity, limit, min_id, reverse, cutoff_date, get_users, batch_size,
+            offset_date=self._as_utc(offset_date), max_id=max_id,
+            operation_scheduler=account.operation_scheduler
+        ):
+            yield batch
+    
+    async def _iter_message_batches(
+        self,
+        account: TelegramAccount,
+        entity,
+        limit: int,
+        min_id: Optional[int],
+        reverse: bool,
+        cutoff_date: Optional[datetime],
+        get_users: bool,
+        batch_size: int,
+        offset_date: Optional[datetime] = None,
+        max_id: Optional[int] = None,
+        operation_scheduler=None
+    ) -> AsyncIterator[List[MessageRecord]]:
+        """
+        Общий цикл загрузки истории для get_group_messages и iter_group_messages
+        
+        Аккаунт передается явно: генератор возобновляется вне контекста операции.
+        operation_scheduler передается, только если вызывающий не держит слот сам (поток).
+        Окно [cutoff_date/min_id, offset_date/max_id) передается в GetHistory:
+        от новых к старым обход начинается с верхней границы, от старых к новым
+        (reverse, только при min_id) - с min_id и останавливается на верхней.
+        """
+        batch = []
+        known_senders = {}
+        
+        # Основной цикл получения сообщений (АДАПТИРОВАННЫЙ из daysback.docx для Telethon).
+        # Каждая страница GetHistory берет токен из бюджета 'history'
+        if reverse:
+            # reverse бывает только при min_id: нижняя граница задана им, а при
+            # reverse=True offset_date у Telethon означал бы "после даты" - не передаем
+            history = account.client.iter_messages(
+                entity,
+                limit=limit,
+                min_id=min_id,
+                max_id=max_id or 0,
+                reverse=True
+            )
+        else:
+            history = account.client.iter_messages(
+                entity,
+                limit=limit,
+                min_id=min_id or 0,
+                max_id=max_id or 0,
+                offset_date=offset_date
+            )
+        
+        async for message in self._paced(
+            'history', history, rate_limiter=account.rate_limiter, operation_scheduler=operation_scheduler
+        ):
+            # Верхняя граница окна (min_id вместе с offset_date) при обходе от старых к новым
+            if reverse and offset_date is not None and message.date >= offset_date:
+                logger.info(f"Reached message from {message.date.strftime('%Y-%m-%d %H:%M:%S')} - stopping (window upper edge)")
+                break
+            
+            # КЛЮЧЕВАЯ ЛОГИКА: Если сообщение старше cutoff_date - останавливаемся
+            if cutoff_date is not None and message.date < cutoff_date:
+                if reverse:
+                    continue
+                logger.info(f"Reached message from {message.date.strftime('%Y-%m-%d %H:%M:%S')} - stopping (older than cutoff)")
+                break
+            
+            # Обрабатываем сообщение (как в рабочей версии)
+            try:
+                msg_data = self.message_to_record(message)
+                
+                # Запоминаем сущность отправителя, если Telegram уже прислал ее с сообщением
+                if get_users and message.sender_id and message.sender is not None:
+                    known_senders[message.sender_id] = message.sender
+                
+                batch.append(msg_data)
+                
+            except Exception as message_error:
+                logger.warning(f"Failed to process message {message.id}: {message_error}")
+                continue
+            
+            if len(batch) >= batch_size:
+                yield await self._finish_batch(account, batch, known_senders, get_users)
+                batch = []
+                known_senders = {}
+        
+        if batch:
+            yield await self._finish_batch(account, batch, known_senders, get_users)
+    
+    async def _finish_batch(
+        self,
+        account: TelegramAccount,
+        batch: List[MessageRecord],
+        known_senders: Dict[int, Any],
+        get_users: bool
+    ) -> List[MessageRecord]:
+        """Информация об отправителях: одним пакетом на пачку сообщений"""
+        # Внутри аккаунта, загрузившего пачку: access_hash отправителей известен только ему
+        if get_users:
+            with self.using_account(account):
+                await self._attach_user_info(batch, known_senders)
+        return batch
+    
+    @staticmethod
+    def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+        """Даты Telethon в UTC; наивную дату считаем локальной"""
+        if value is None:
+            return None
+        return value.astimezone(timezone.utc)
+    
+    def message_to_record(self, message) -> MessageRecord:
+        """
+        Привести сообщение Telethon к компактной записи, с которой работают сервисы
+        
+        user_info заполняется отдельно (_attach_user_info), пакетом для всей выборки.
+        """
+        msg_data = MessageRecord(
+            message_id=str(message.id),
+            text=message.text or "",
+            date=message.date.isoformat(),
+            sender_id=str(message.sender_id) if message.sender_id else None,
+            is_reply=message.is_reply,
+            reply_to_message_id=str(message.reply_to_msg_id) if message.reply_to_msg_id else None,
+            edit_date=message.edit_date.isoformat() if message.edit_date else None,
+            views=getattr(message, 'views', None)
+        )
+        
+        # Информация о медиа
+        if message.media:
+            if hasattr(message.media, 'photo'):
+                msg_data.media_type = 'photo'
+            elif hasattr(message.media, 'document'):
+                msg_data.media_type = 'document'
+            elif hasattr(message.media, 'video'):
+                msg_data.media_type = 'video'
+            else:
+                msg_data.media_type = 'other'
+        
+        # Информация о пересылке
+        if message.forward:
+            msg_data.forward_from = {
+                'from_id': str(message.forward.from_id) if message.forward.from_id else None,
+                'from_name': getattr(message.forward, 'from_name', None),
+                'date': message.forward.date.isoformat() if message.forward.date else None
+            }
+        
+        return msg_data
+    
+    def message_to_dict(self, message) -> Dict[str, Any]:
+        """Привести сообщение Telethon к формату, в котором сервис отдает сообщения через API"""
+        return self.message_to_record(message).to_dict()
+    
+    async def _attach_user_info(self, messages: List[MessageRecord], known_senders: Dict[int, Any]):
+        """Заполнить user_info у сообщений через общий кэш профилей"""
+        sender_ids = {int(msg['sender_id']) for msg in messages if msg.get('sender_id')}
+        try:
+            profiles = await user_profile_resolver.resolve(
+                self.client, sender_ids, known_senders, rate_limiter=self.rate_limiter
+            )
+        except Exception as e:
+            logger.warning(f"Failed to resolve sender profiles: {e}")
+            return
+        
+        for msg in messages:
+            if msg.get('sender_id'):
+                msg['user_info'] = profiles.get(int(msg['sender_id']))
+    
+    async def _get_high_water_mark(self, sync_key: str) -> Optional[int]:
+        """Получить последний синхронизированный message_id (из памяти или БД)"""
+        if sync_key in self.sync_state:
+            return self.sync_state[sync_key]
+        
+        try:
+            state = await repository.get_sync_state(sync_key)
+        except Exception as e:
+            logger.warning(f"Failed to load sync state {sync_key}: {e}")
+            return None
+        
+        if state and state.get('last_message_id'):
+            self.sync_state[sync_key] = int(state['last_message_id'])
+            return self.sync_state[sync_key]
+        return None
+    
+    async def _update_high_water_mark(self, sync_key: str, group_id: str, message_id: int):
+        """Сдвинуть high-water mark вперед и сохранить его в БД"""
+        if message_id <= self.sync_state.get(sync_key, 0):
+            return
+        
+        self.sync_state[sync_key] = message_id
+        try:
+            await repository.upsert_sync_state(sync_key, group_id, message_id)
+        except Exception as e:
+            # Отметка в памяти остается актуальной, в БД догоним при следующем обновлении
+            logger.warning(f"Failed to persist sync state {sync_key}: {e}")
+    
     async def _save_message_to_db(self, group_id: str, message: Dict[str, Any]):
         """Сохранить сообщение в базу данных"""
         try:
             # Сначала получаем ID группы из базы
-            db_group = supabase_client.table('telegram_groups').select('id').eq('group_id', group_id).execute()
+            db_group = await repository.get_group_by_telegram_id(group_id, columns='id')
             
-            if not db_group.data:
+            if not db_group:
                 logger.warning(f"Group with telegram_id {group_id} not found in database")
                 return
                 
-            db_group_id = db_group.data[0]['id']
+            db_group_id = db_group['id']
             
             # Проверяем, есть ли уже такое сообщение в базе
-            existing_msg = supabase_client.table('telegram_messages').select('id')\
-                .eq('group_id', db_group_id)\
-                .eq('message_id', message['message_id']).execute()
+            existing_msg = await repository.get_group_message(db_group_id, message['message_id'], columns='id')
             
-            if not existing_msg.data:
+            if not existing_msg:
                 # Создаем запись в базе
                 msg_for_db = {
                     'group_id': db_group_id,
@@ -324,7 +839,7 @@ class TelegramService:
                     'is_reply': message['is_reply'],
                     'reply_to_message_id': message['reply_to_message_id']
                 }
-                supabase_client.table('telegram_messages').insert(msg_for_db).execute()
+                await repository.insert_message(msg_for_db)
                 logger.debug(f"Message {message['message_id']} saved to database")
         except Exception as e:
             logger.error(f"Error saving message to database: {e}")
@@ -332,7 +847,7 @@ class TelegramService:
     async def get_group_info(self, group_id: str) -> Dict[str, Any]:
         """Получить информацию о группе"""
         async def operation():
-            entity = await self.client.get_entity(group_id)
+            entity = await self.resolve_entity(group_id)
             group_info = {}
             
             if isinstance(entity, Channel) or isinstance(entity, Chat):
@@ -364,7 +879,7 @@ class TelegramService:
             return {}
             
         try:
-            return await self.execute_telegram_operation(operation)
+            return await self.execute_telegram_operation(operation, op_class='entity', shard_key=group_id)
         except Exception as e:
             logger.error(f"Error retrieving group info for {group_id}: {e}")
             raise
@@ -373,7 +888,7 @@ class TelegramService:
         """Сохранить или обновить информацию о группе в базе данных"""
         try:
             # Проверяем, есть ли группа в базе
-            existing_group = supabase_client.table('telegram_groups').select('id').eq('group_id', group_info['id']).execute()
+            existing_group = await repository.get_group_by_telegram_id(group_info['id'], columns='id')
             
             # Подготовка данных для базы
             group_data = {
@@ -388,14 +903,14 @@ class TelegramService:
                 }
             }
             
-            if existing_group.data:
+            if existing_group:
                 # Обновляем существующую группу
-                supabase_client.table('telegram_groups').update(group_data).eq('group_id', group_info['id']).execute()
+                await repository.update_group_by_telegram_id(group_info['id'], group_data)
                 logger.debug(f"Updated group {group_info['id']} in database")
             else:
                 # Создаем новую группу
                 group_data['group_id'] = group_info['id']
-                supabase_client.table('telegram_groups').insert(group_data).execute()
+                await repository.insert_group(group_data)
                 logger.debug(f"Added new group {group_info['id']} to database")
         except Exception as e:
             logger.error(f"Error saving group to database: {e}")
@@ -403,13 +918,11 @@ class TelegramService:
     async def get_moderators(self, group_id: str, save_to_db: bool = False) -> List[Dict[str, Any]]:
         """Получить список модераторов группы"""
         async def operation():
-            entity = await self.get_entity(group_id)
+            entity = await self.resolve_entity(group_id)
             
             moderators = []
-            async for user in self.client.iter_participants(
-                entity, 
-                filter='admin'
-            ):
+            participants = self.client.iter_participants(entity, filter='admin')
+            async for user in self._paced('participants', participants, page_size=200):
                 if isinstance(user, User):
                     mod = {
                         'telegram_id': str(user.id),
@@ -430,7 +943,7 @@ class TelegramService:
             return moderators
             
         try:
-            return await self.execute_telegram_operation(operation)
+            return await self.execute_telegram_operation(operation, op_class='participants', shard_key=group_id)
         except Exception as e:
             logger.error(f"Error retrieving moderators from group {group_id}: {e}")
             raise
@@ -439,55 +952,56 @@ class TelegramService:
         """Сохранить или обновить информацию о пользователе в базе данных"""
         try:
             # Проверяем, есть ли уже такой пользователь в базе
-            existing_user = supabase_client.table('telegram_users').select('id')\
-                .eq('telegram_id', user_data['telegram_id']).execute()
+            existing_user = await repository.get_user_by_telegram_id(user_data['telegram_id'], columns='id')
             
-            if not existing_user.data:
+            if not existing_user:
                 # Создаем запись в базе
-                supabase_client.table('telegram_users').insert(user_data).execute()
+                await repository.insert_user(user_data)
                 logger.debug(f"Added new user {user_data['telegram_id']} to database")
             else:
                 # Обновляем существующую запись
-                user_id = existing_user.data[0]['id']
-                supabase_client.table('telegram_users').update({
+                user_id = existing_user['id']
+                await repository.update_user(user_id, {
                     'username': user_data['username'],
                     'first_name': user_data['first_name'],
                     'last_name': user_data['last_name'],
                     'is_bot': user_data.get('is_bot', False),
                     'is_moderator': user_data['is_moderator'],
                     'photo_url': user_data.get('photo_url')
-                }).eq('id', user_id).execute()
+                })
                 logger.debug(f"Updated user {user_data['telegram_id']} in database")
             
             # Если указан group_id, добавляем связь пользователя с группой
             if group_id:
-                db_group = supabase_client.table('telegram_groups').select('id').eq('group_id', group_id).execute()
-                if db_group.data:
-                    db_group_id = db_group.data[0]['id']
-                    db_user = supabase_client.table('telegram_users').select('id').eq('telegram_id', user_data['telegram_id']).execute()
+                db_group = await repository.get_group_by_telegram_id(group_id, columns='id')
+                if db_group:
+                    db_group_id = db_group['id']
+                    db_user = await repository.get_user_by_telegram_id(user_data['telegram_id'], columns='id')
                     
-                    if db_user.data:
-                        db_user_id = db_user.data[0]['id']
+                    if db_user:
+                        db_user_id = db_user['id']
                         
                         # Проверяем, существует ли уже связь
-                        existing_relation = supabase_client.table('user_group_relations').select('id')\
-                            .eq('user_id', db_user_id)\
-                            .eq('group_id', db_group_id).execute()
+                        existing_relation = await repository.get_user_group_relation(db_user_id, db_group_id)
                         
-                        if not existing_relation.data:
+                        if not existing_relation:
                             # Создаем связь
                             relation_data = {
                                 'user_id': db_user_id,
                                 'group_id': db_group_id,
                                 'role': 'moderator' if user_data['is_moderator'] else 'user'
                             }
-                            supabase_client.table('user_group_relations').insert(relation_data).execute()
+                            await repository.insert_user_group_relation(relation_data)
                             logger.debug(f"Added user-group relation for user {user_data['telegram_id']} and group {group_id}")
         except Exception as e:
             logger.error(f"Error saving user to database: {e}")
     
-    async def collect_group_data(self, group_id: str, messages_limit: int = 100) -> Dict[str, Any]:
-        """Собрать все данные о группе и сохранить в базу"""
+    async def collect_group_data(self, group_id: str, messages_limit: int = 100, incremental: bool = True) -> Dict[str, Any]:
+        """
+        Собрать все данные о группе и сохранить в базу
+        
+        При incremental=True загружаются только сообщения, появившиеся после прошлого сбора.
+        """
         try:
             # Получаем информацию о группе
             group_info = await self.get_group_info(group_id)
@@ -496,7 +1010,12 @@ class TelegramService:
             moderators = await self.get_moderators(group_id, save_to_db=True)
             
             # Получаем сообщения
-            messages = await self.get_group_messages(group_id, limit=messages_limit, save_to_db=True)
+            messages = await self.get_group_messages(
+                group_id,
+                limit=messages_limit,
+                save_to_db=True,
+                sync_key=f"collect:{group_id}" if incremental else None
+            )
             
             logger.info(f"Collected data for group {group_id}: {len(messages)} messages, {len(moderators)} moderators")
             
@@ -512,10 +1031,11 @@ class TelegramService:
     async def get_group_members(self, group_id: str, limit: int = 100) -> List[Dict[str, Any]]:
         """Получить участников группы"""
         async def operation():
-            entity = await self.get_entity(group_id)
+            entity = await self.resolve_entity(group_id)
             
             members = []
-            async for user in self.client.iter_participants(entity, limit=limit):
+            participants = self.client.iter_participants(entity, limit=limit)
+            async for user in self._paced('participants', participants, page_size=200):
                 if isinstance(user, User):
                     member = {
                         'telegram_id': str(user.id),
@@ -532,7 +1052,7 @@ class TelegramService:
             return members
             
         try:
-            return await self.execute_telegram_operation(operation)
+            return await self.execute_telegram_operation(operation, op_class='participants', shard_key=group_id)
         except Exception as e:
             logger.error(f"Error retrieving members from group {group_id}: {e}")
             raise
@@ -540,10 +1060,10 @@ class TelegramService:
     async def get_message_reactions(self, group_id: str, message_id: int) -> List[Dict[str, Any]]:
         """Получить реакции на сообщение"""
         async def operation():
-            entity = await self.get_entity(group_id)
+            entity = await self.resolve_entity(group_id)
             
             # Получаем сообщение
-            message = await self.client.get_messages(entity, ids=message_id)
+            message = await self._rate_limited('history', lambda: self.client.get_messages(entity, ids=message_id))
             
             if not message or not hasattr(message, 'reactions'):
                 return []
@@ -559,7 +1079,7 @@ class TelegramService:
             return reactions
             
         try:
-            return await self.execute_telegram_operation(operation)
+            return await self.execute_telegram_operation(operation, op_class='history', shard_key=group_id)
         except Exception as e:
             logger.error(f"Error retrieving reactions for message {message_id} in group {group_id}: {e}")
             return []
@@ -567,15 +1087,12 @@ class TelegramService:
     async def get_message_thread(self, group_id: str, message_id: int, limit: int = 50) -> List[Dict[str, Any]]:
         """Получить ветку сообщений (ответы на конкретное сообщение)"""
         async def operation():
-            entity = await self.get_entity(group_id)
+            entity = await self.resolve_entity(group_id)
             
             # Получаем сообщение
             thread_messages = []
-            async for message in self.client.iter_messages(
-                entity, 
-                reply_to=message_id,
-                limit=limit
-            ):
+            replies = self.client.iter_messages(entity, reply_to=message_id, limit=limit)
+            async for message in self._paced('replies', replies):
                 if isinstance(message, Message):
                     msg = {
                         'message_id': str(message.id),
@@ -590,41 +1107,72 @@ class TelegramService:
             return thread_messages
             
         try:
-            return await self.execute_telegram_operation(operation)
+            return await self.execute_telegram_operation(operation, op_class='history', shard_key=group_id)
         except Exception as e:
             logger.error(f"Error retrieving thread for message {message_id} in group {group_id}: {e}")
             return []
 
+    async def resolve_entity(self, entity_id):
+        """
+        Получить сущность Telegram через кэш
+        
+        Работает без блокировки клиента, поэтому безопасен внутри операций
+        execute_telegram_operation. Промахи разрешения кэшируются с коротким TTL.
+        """
+        found, entity = self.entity_cache.get(entity_id)
+        if found:
+            if entity is None:
+                raise ValueError(f"Entity {entity_id} not found (cached lookup failure)")
+            return entity
+        
+        try:
+            entity = await self._lookup_entity(entity_id)
+        except (ValueError, errors.UsernameNotOccupiedError, errors.UsernameInvalidError,
+                errors.ChannelPrivateError, errors.InviteHashExpiredError, errors.InviteHashInvalidError):
+            self.entity_cache.set_negative(entity_id)
+            raise
+        
+        self.entity_cache.set(entity_id, entity)
+        return entity
+    
+    async def _lookup_entity(self, entity_id):
+        """Цепочка попыток get_entity для разных форматов идентификатора"""
+        # Числовые id (включая -100...) сразу передаем как число
+        if str(entity_id).lstrip('-').isdigit():
+            return await self._rate_limited('entity', lambda: self.client.get_entity(int(entity_id)))
+        
+        try:
+            # Сначала пробуем получить как есть
+            return await self._rate_limited('entity', lambda: self.client.get_entity(entity_id))
+        except errors.FloodWaitError:
+            raise
+        except Exception as e1:
+            logger.warning(f"Direct entity lookup failed: {e1}")
+            
+            # Если не получилось, убираем @ если есть
+            clean_id = str(entity_id).lstrip('@')
+            if clean_id == entity_id:
+                raise
+            try:
+                return await self._rate_limited('entity', lambda: self.client.get_entity(clean_id))
+            except errors.FloodWaitError:
+                raise
+            except Exception as e2:
+                logger.warning(f"Clean ID lookup failed: {e2}")
+                # Если ничего не помогло, выбрасываем исходную ошибку
+                raise e1
+    
     async def get_entity(self, entity_id: str):
         """Исправленное получение сущности Telegram"""
+        found, entity = self.entity_cache.get(entity_id)
+        if found and entity is not None:
+            return entity
+        
         async def operation():
-            try:
-                # Сначала пробуем получить как есть
-                return await self.client.get_entity(entity_id)
-            except Exception as e1:
-                logger.warning(f"Direct entity lookup failed: {e1}")
-                
-                # Если не получилось, пробуем разные форматы
-                try:
-                    # Убираем @ если есть
-                    clean_id = entity_id.lstrip('@')
-                    return await self.client.get_entity(clean_id)
-                except Exception as e2:
-                    logger.warning(f"Clean ID lookup failed: {e2}")
-                    
-                    # Пробуем как число если это возможно
-                    try:
-                        if str(entity_id).lstrip('-').isdigit():
-                            numeric_id = int(entity_id)
-                            return await self.client.get_entity(numeric_id)
-                    except Exception as e3:
-                        logger.warning(f"Numeric ID lookup failed: {e3}")
-                        
-                    # Если ничего не помогло, выбрасываем исходную ошибку
-                    raise e1
+            return await self.resolve_entity(entity_id)
         
         try:
-            return await self.execute_telegram_operation(operation)
+            return await self.execute_telegram_operation(operation, op_class='entity')
         except Exception as e:
             logger.error(f"Failed to get entity {entity_id}: {e}")
             raise ValueError(f"Entity {entity_id} not found or not accessible. Error: {str(e)}")
@@ -664,7 +1212,7 @@ class TelegramService:
         """Получить информацию о группе по ссылке или username"""
         async def operation():
             try:
-                entity = await self.client.get_entity(link_or_username)
+                entity = await self.resolve_entity(link_or_username)
                 
                 group_info = {}
                 
@@ -692,12 +1240,14 @@ class TelegramService:
                 
                 logger.warning(f"Entity {link_or_username} is not a group or channel")
                 return {}
+            except errors.FloodWaitError:
+                raise
             except Exception as e:
                 logger.error(f"Error getting entity {link_or_username}: {e}")
                 return {}
                 
         try:
-            return await self.execute_telegram_operation(operation)
+            return await self.execute_telegram_operation(operation, op_class='entity', shard_key=link_or_username)
         except Exception as e:
             logger.error(f"Error retrieving group info for {link_or_username}: {e}")
             return {}
@@ -729,112 +1279,62 @@ class TelegramService:
             Список цепочек диалогов
         """
         try:
-            # Вычисляем дату, с которой начинать получение сообщений
-            offset_date = datetime.now() - timedelta(days=days_back)
-            
-            # Получаем сообщения
+            # Получаем сообщения за последние days_back дней
+            # (offset_date - верхняя граница окна, а не начало)
             messages = await self.get_group_messages(
                 group_id, 
                 limit=500,  # Увеличиваем лимит для более полного анализа
-                offset_date=offset_date,
+                days_back=days_back,
                 include_replies=True,
                 get_users=True
             )
             
-            # Организуем сообщения по цепочкам
-            threads = {}
-            standalone_messages = []
-            
-            # Сначала группируем сообщения по reply_to_message_id
-            for msg in messages:
-                if msg['is_reply'] and msg['reply_to_message_id']:
-                    thread_id = msg['reply_to_message_id']
-                    if thread_id not in threads:
-                        threads[thread_id] = {
-                            'root_message_id': thread_id,
-                            'messages': []
-                        }
-                    threads[thread_id]['messages'].append(msg)
-                else:
-                    standalone_messages.append(msg)
-            
-            # Дополняем цепочки корневыми сообщениями
-            for msg in standalone_messages:
-                if msg['message_id'] in threads:
-                    threads[msg['message_id']]['root_message'] = msg
-            
-            # Преобразуем в список и сортируем по дате
-            thread_list = []
-            for thread_id, thread in threads.items():
-                if 'root_message' in thread:
-                    # Добавляем дополнительную информацию о цепочке
-                    thread['start_date'] = thread['root_message']['date']
-                    thread['participants'] = set()
-                    thread['moderator_involved'] = False
-                    
-                    # Добавляем отправителя корневого сообщения
-                    if 'sender' in thread['root_message']:
-                        thread['participants'].add(thread['root_message']['sender']['id'])
-                        if thread['root_message']['sender'].get('is_moderator', False):
-                            thread['moderator_involved'] = True
-                    
-                    # Добавляем отправителей ответов
-                    for msg in thread['messages']:
-                        if 'sender' in msg:
-                            thread['participants'].add(msg['sender']['id'])
-                            if msg['sender'].get('is_moderator', False):
-                                thread['moderator_involved'] = True
-                    
-                    # Конвертируем set в list для сериализации
-                    thread['participants'] = list(thread['participants'])
-                    
-                    # Вычисляем время первого ответа модератора
-                    if thread['moderator_involved']:
-                        thread['first_moderator_response_time'] = self._calculate_first_response_time(
-                            thread['root_message'],
-                            thread['messages']
-                        )
-                    
-                    thread_list.append(thread)
-            
-            # Сортируем по дате начала, самые новые первыми
-            thread_list.sort(key=lambda x: x['start_date'], reverse=True)
-            
-            return thread_list
+            return self._build_conversation_threads(ReplyIndex(messages))
         except Exception as e:
             logger.error(f"Error getting conversation threads for group {group_id}: {e}")
             raise
-
-    def _calculate_first_response_time(self, root_message: Dict[str, Any], replies: List[Dict[str, Any]]) -> Optional[float]:
+    
+    def _build_conversation_threads(
+        self,
+        index: ReplyIndex,
+        moderator_threads: Optional[Dict[str, Dict[str, Any]]] = None
+    ) -> List[Dict[str, Any]]:
         """
-        Вычислить время первого ответа модератора на сообщение
+        Собрать цепочки диалогов по графу ответов
+        
+        Цепочка - корневое сообщение и все ответы на него (включая ответы на ответы).
         
         Args:
-            root_message: Корневое сообщение
-            replies: Ответы на сообщение
-            
-        Returns:
-            Время ответа в минутах или None, если ответа не было
+            index: Граф ответов выборки
+            moderator_threads: Участие модераторов по корням цепочек (calculate_moderator_metrics)
         """
-        # Проверяем, что корневое сообщение не от модератора
-        if root_message.get('sender', {}).get('is_moderator', False):
-            return None
-        
-        # Сортируем ответы по дате
-        sorted_replies = sorted(replies, key=lambda x: x['date'])
+        moderator_threads = moderator_threads or {}
+        thread_list = []
+        for root_id, replies in index.threads().items():
+            root_message = index.get(root_id)
+            moderator_info = moderator_threads.get(root_id, {})
+            thread = {
+                'root_message_id': root_id,
+                'root_message': root_message,
+                'messages': replies,
+                # Добавляем дополнительную информацию о цепочке
+                'start_date': root_message['date'],
+                'participants': list(dict.fromkeys(
+                    msg['sender_id'] for msg in [root_message] + replies if msg.get('sender_id')
+                )),
+                'moderator_involved': moderator_info.get('moderator_involved', False)
+            }
+            
+            # Время первого ответа модератора
+            if thread['moderator_involved']:
+                thread['first_moderator_response_time'] = moderator_info.get('first_moderator_response_time')
+            
+            thread_list.append(thread)
         
-        # Ищем первый ответ от модератора
-        for reply in sorted_replies:
-            if reply.get('sender', {}).get('is_moderator', False):
-                # Преобразуем строки в datetime
-                root_date = datetime.fromisoformat(root_message['date'].replace('Z', '+00:00'))
-                reply_date = datetime.fromisoformat(reply['date'].replace('Z', '+00:00'))
-                
-                # Вычисляем разницу в минутах
-                time_diff = (reply_date - root_date).total_seconds() / 60
-                return time_diff
+        # Сортируем по дате начала, самые новые первыми
+        thread_list.sort(key=lambda x: x['start_date'], reverse=True)
         
-        return None
+        return thread_list
     
     async def prepare_data_for_analysis(self, group_id: str, days_back: int = 7) -> Dict[str, Any]:
         """
@@ -854,11 +1354,19 @@ class TelegramService:
             # Получаем модераторов
             moderators = await self.get_moderators(group_id, save_to_db=True)
             
-            # Получаем цепочки диалогов
-            threads = await self.get_conversation_threads(group_id, days_back)
+            # Получаем сообщения и строим граф ответов один раз для цепочек и метрик
+            messages = await self.get_group_messages(
+                group_id,
+                limit=500,
+                days_back=days_back,
+                include_replies=True,
+                get_users=True
+            )
+            index = ReplyIndex(messages)
             
-            # Вычисляем метрики
-            metrics = self._calculate_metrics(threads, moderators)
+            # Вычисляем метрики (модераторы - по telegram_id, векторно по всему окну)
+            metrics, moderator_threads = calculate_moderator_metrics(index, moderators)
+            threads = self._build_conversation_threads(index, moderator_threads)
             
             # Формируем данные для анализа
             analysis_data = {
@@ -878,88 +1386,6 @@ class TelegramService:
             logger.error(f"Error preparing data for analysis for group {group_id}: {e}")
             raise
 
-    def _calculate_metrics(self, threads: List[Dict[str, Any]], moderators: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """
-        Вычислить метрики на основе данных о диалогах
-        
-        Args:
-            threads: Цепочки диалогов
-            moderators: Модераторы группы
-            
-        Returns:
-            Словарь с метриками
-        """
-        # Инициализируем метрики
-        metrics = {
-            'total_threads': len(threads),
-            'moderator_involved_threads': 0,
-            'response_times': [],
-            'response_time_avg': None,
-            'response_time_min': None,
-            'response_time_max': None,
-            'moderator_activity': {},
-            'thread_length_avg': 0
-        }
-        
-        # Инициализируем данные по модераторам
-        for mod in moderators:
-            mod_id = mod['telegram_id']
-            metrics['moderator_activity'][mod_id] = {
-                'threads_participated': 0,
-                'messages_sent': 0,
-                'avg_response_time': None,
-                'response_times': []
-            }
-        
-        # Обрабатываем каждую цепочку
-        total_messages = 0
-        for thread in threads:
-            # Считаем общее количество сообщений
-            thread_messages = len(thread.get('messages', [])) + 1  # +1 для корневого сообщения
-            total_messages += thread_messages
-            
-            # Если в цепочке участвовал модератор
-            if thread.get('moderator_involved', False):
-                metrics['moderator_involved_threads'] += 1
-                
-                # Добавляем время ответа, если есть
-                response_time = thread.get('first_moderator_response_time')
-                if response_time is not None:
-                    metrics['response_times'].append(response_time)
-                    
-                    # Обновляем статистику по каждому модератору
-                    for msg in thread.get('messages', []):
-                        if msg.get('sender', {}).get('is_moderator', False):
-                            mod_id = msg['sender']['id']
-                            if mod_id in metrics['moderator_activity']:
-                                metrics['moderator_activity'][mod_id]['threads_participated'] += 1
-                                metrics['moderator_activity'][mod_id]['messages_sent'] += 1
-                                
-                                # Вычисляем время ответа для конкретного модератора
-                                if 'replied_message' in msg:
-                                    root_date = datetime.fromisoformat(msg['replied_message']['date'].replace('Z', '+00:00'))
-                                    msg_date = datetime.fromisoformat(msg['date'].replace('Z', '+00:00'))
-                                    mod_response_time = (msg_date - root_date).total_seconds() / 60
-                                    metrics['moderator_activity'][mod_id]['response_times'].append(mod_response_time)
-        
-        # Вычисляем среднюю длину цепочки
-        if metrics['total_threads'] > 0:
-            metrics['thread_length_avg'] = total_messages / metrics['total_threads']
-        
-        # Вычисляем статистику по времени ответа
-        if metrics['response_times']:
-            metrics['response_time_avg'] = sum(metrics['response_times']) / len(metrics['response_times'])
-            metrics['response_time_min'] = min(metrics['response_times'])
-            metrics['response_time_max'] = max(metrics['response_times'])
-        
-        # Вычисляем среднее время ответа для каждого модератора
-        for mod_id, activity in metrics['moderator_activity'].items():
-            if activity['response_times']:
-                activity['avg_response_time'] = sum(activity['response_times']) / len(activity['response_times'])
-        
-        return metrics
-    
-    
     async def connect_with_retry(self, max_retries: int = 3):
         """Подключение к Telegram с повторными попытками и диагностикой"""
         for attempt in range(max_retries):
@@ -1128,6 +1554,70 @@ class TelegramService:
             return None
     
 
+    def _post_channel_ref(self, post_info: Dict[str, Any]) -> str:
+        """Ссылка на канал поста: id для приватных, username для публичных"""
+        return post_info['channel_id'] if post_info['is_private'] else post_info['channel_username']
+    
+    async def _collect_post_comments(
+        self,
+        entity,
+        post_info: Dict[str, Any],
+        limit: int,
+        state: Dict[str, Any]
+    ):
+        """
+        Загрузить комментарии к посту в state
+        
+        Комментарии складываются в state по мере получения, поэтому при
+        таймауте у вызывающего остается уже загруженная часть.
+        """
+        replies = self.client.iter_messages(entity, reply_to=post_info['message_id'], limit=limit)
+        async for message in self._paced('replies', replies):
+            if isinstance(message, Message) and message.text:
+                if message.sender_id and message.sender is not None:
+                    state['known_senders'][message.sender_id] = message.sender
+                
+                state['comments'].append({
+                    'message_id': str(message.id),
+                    'text': message.text,
+                    'date': message.date.isoformat(),
+                    'author': None,
+                    'post_link': post_info['link'],
+                    'post_message_id': str(post_info['message_id']),
+                    'has_media': bool(message.media),
+                    'is_reply': True,
+                    'reply_to_message_id': str(post_info['message_id'])
+                })
+                state['sender_ids'].append(message.sender_id)
+    
+    async def _attach_comment_authors(self, state: Dict[str, Any]):
+        """Авторы комментариев: одним пакетом через общий кэш профилей"""
+        if not state['comments']:
+            return
+        
+        try:
+            profiles = await user_profile_resolver.resolve(
+                self.client,
+                [sender_id for sender_id in state['sender_ids'] if sender_id],
+                state['known_senders'],
+                rate_limiter=self.rate_limiter
+            )
+            for comment_data, sender_id in zip(state['comments'], state['sender_ids']):
+                profile = profiles.get(sender_id) if sender_id else None
+                if profile:
+                    comment_data['author'] = {
+                        'id': profile['telegram_id'],
+                        'username': profile['username'],
+                        'first_name': profile['first_name'],
+                        'last_name': profile['last_name']
+                    }
+        except Exception as e:
+            logger.warning(f"Failed to resolve comment authors: {e}")
+    
+    @staticmethod
+    def _new_comments_state() -> Dict[str, Any]:
+        return {'comments': [], 'sender_ids': [], 'known_senders': {}, 'timed_out': False}
+    
     async def get_post_comments(self, post_info: Dict[str, Any], limit: int = 100) -> List[Dict[str, Any]]:
         """
         Получить комментарии к посту
@@ -1139,78 +1629,98 @@ class TelegramService:
         Returns:
             Список комментариев
         """
+        channel_ref = self._post_channel_ref(post_info)
+        
         async def operation():
             try:
                 # Получаем entity канала/группы
-                if post_info['is_private']:
-                    entity = await self.client.get_entity(int(post_info['channel_id']))
-                else:
-                    entity = await self.client.get_entity(post_info['channel_username'])
+                entity = await self.resolve_entity(channel_ref)
                 
                 # Получаем сам пост
-                post_message = await self.client.get_messages(entity, ids=post_info['message_id'])
+                post_message = await self._rate_limited(
+                    'history',
+                    lambda: self.client.get_messages(entity, ids=post_info['message_id'])
+                )
                 
                 if not post_message:
                     logger.warning(f"Post {post_info['message_id']} not found")
                     return []
                 
-                # Получаем комментарии (replies) к посту
-                comments = []
-                
                 # Проверяем есть ли комментарии у поста
+                state = self._new_comments_state()
                 if hasattr(post_message, 'replies') and post_message.replies:
-                    
-                    async for message in self.client.iter_messages(
-                        entity, 
-                        reply_to=post_info['message_id'],
-                        limit=limit
-                    ):
-                        if isinstance(message, Message) and message.text:
-                            # Получаем информацию об авторе комментария
-                            author_info = None
-                            if message.sender_id:
-                                try:
-                                    user = await self.client.get_entity(message.sender_id)
-                                    author_info = {
-                                        'id': str(user.id),
-                                        'username': getattr(user, 'username', None),
-                                        'first_name': getattr(user, 'first_name', None),
-                                        'last_name': getattr(user, 'last_name', None)
-                                    }
-                                except:
-                                    pass
-                            
-                            comment_data = {
-                                'message_id': str(message.id),
-                                'text': message.text,
-                                'date': message.date.isoformat(),
-                                'author': author_info,
-                                'post_link': post_info['link'],
-                                'post_message_id': str(post_info['message_id']),
-                                'has_media': bool(message.media),
-                                'is_reply': True,
-                                'reply_to_message_id': str(post_info['message_id'])
-                            }
-                            
-                            comments.append(comment_data)
+                    await self._collect_post_comments(entity, post_info, limit, state)
+                
+                await self._attach_comment_authors(state)
                 
-                logger.info(f"Retrieved {len(comments)} comments for post {post_info['message_id']}")
-                return comments
+                logger.info(f"Retrieved {len(state['comments'])} comments for post {post_info['message_id']}")
+                return state['comments']
                 
+            except errors.FloodWaitError:
+                # Отдаем наверх, чтобы execute_telegram_operation дождался окончания FloodWait
+                raise
             except Exception as e:
                 logger.error(f"Error getting comments for post {post_info}: {e}")
                 return []
         
         try:
-            return await self.execute_telegram_operation(operation)
+            return await self.execute_telegram_operation(operation, op_class='history', shard_key=channel_ref)
         except Exception as e:
             logger.error(f"Failed to get comments for post {post_info}: {e}")
             return []
+    
+    async def _fetch_channel_posts(self, channel_ref: str, posts: List[Dict[str, Any]]) -> List[Any]:
+        """Один get_messages(ids=[...]) на все посты канала; None для ненайденных постов"""
+        async def operation():
+            entity = await self.resolve_entity(channel_ref)
+            headers = await self._rate_limited(
+                'history',
+                lambda: self.client.get_messages(entity, ids=[post['message_id'] for post in posts])
+            )
+            return list(headers)
+        
+        return await self.execute_telegram_operation(operation, op_class='history', shard_key=channel_ref)
+    
+    async def _fetch_post_comments_bounded(
+        self,
+        channel_ref: str,
+        post_info: Dict[str, Any],
+        limit: int,
+        semaphore: asyncio.Semaphore
+    ) -> Dict[str, Any]:
+        """Комментарии одного поста с ограничением параллелизма и таймаутом (частичный результат)"""
+        async def operation():
+            state = self._new_comments_state()
+            # entity берем из кэша аккаунта, выбранного для этой операции
+            entity = await self.resolve_entity(channel_ref)
+            try:
+                await asyncio.wait_for(
+                    self._collect_post_comments(entity, post_info, limit, state),
+                    timeout=settings.POST_COMMENTS_TIMEOUT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                state['timed_out'] = True
+                logger.warning(
+                    f"Timeout fetching comments for post {post_info['message_id']}, "
+                    f"returning {len(state['comments'])} collected so far"
+                )
+            
+            await self._attach_comment_authors(state)
+            return state
         
+        async with semaphore:
+            return await self.execute_telegram_operation(operation, op_class='history', shard_key=channel_ref)
+    
     async def get_multiple_posts_comments(self, post_links: List[str], limit_per_post: int = 100) -> Dict[str, Any]:
         """
         Получить комментарии к нескольким постам
         
+        Посты группируются по каналам: одно разрешение entity и один
+        get_messages(ids=[...]) на канал, затем ответы к постам загружаются
+        параллельно (не больше COMMENTS_FETCH_CONCURRENCY одновременно).
+        Пост, не уложившийся в POST_COMMENTS_TIMEOUT_SECONDS, возвращает
+        уже загруженные комментарии и помечается timed_out.
+        
         Args:
             post_links: Список ссылок на посты
             limit_per_post: Максимальное количество комментариев на пост
@@ -1230,33 +1740,79 @@ class TelegramService:
                     'processed_posts': 0
                 }
             
-            all_comments = []
-            posts_info = []
-            
+            # Группируем посты по каналам
+            posts_by_channel: Dict[str, List[Dict[str, Any]]] = {}
             for post_info in parsed_posts:
+                posts_by_channel.setdefault(self._post_channel_ref(post_info), []).append(post_info)
+            
+            semaphore = asyncio.Semaphore(settings.COMMENTS_FETCH_CONCURRENCY)
+            results: Dict[int, Dict[str, Any]] = {}
+            
+            async def process_channel(channel_ref: str, posts: List[Dict[str, Any]]):
                 try:
-                    # Получаем комментарии к каждому посту
-                    post_comments = await self.get_post_comments(post_info, limit_per_post)
-                    
-                    # Добавляем информацию о посте к каждому комментарию
-                    for comment in post_comments:
-                        comment['source_post'] = post_info
-                    
-                    all_comments.extend(post_comments)
-                    posts_info.append({
-                        'post_info': post_info,
-                        'comments_count': len(post_comments)
-                    })
-                    
-                    logger.info(f"Processed post {post_info['message_id']}: {len(post_comments)} comments")
-                    
+                    headers = await self._fetch_channel_posts(channel_ref, posts)
                 except Exception as e:
-                    logger.error(f"Error processing post {post_info}: {e}")
+                    logger.error(f"Error loading posts from channel {channel_ref}: {e}")
+                    for post_info in posts:
+                        results[id(post_info)] = {'error': str(e)}
+                    return
+                
+                tasks = []
+                for post_info, post_message in zip(posts, headers):
+                    if not post_message:
+                        logger.warning(f"Post {post_info['message_id']} not found")
+                        results[id(post_info)] = {'comments': []}
+                    elif not getattr(post_message, 'replies', None):
+                        results[id(post_info)] = {'comments': []}
+                    else:
+                        tasks.append(post_info)
+                
+                states = await asyncio.gather(
+                    *(self._fetch_post_comments_bounded(channel_ref, post_info, limit_per_post, semaphore)
+                      for post_info in tasks),
+                    return_exceptions=True
+                )
+                for post_info, state in zip(tasks, states):
+                    if isinstance(state, Exception):
+                        logger.error(f"Error processing post {post_info}: {state}")
+                        results[id(post_info)] = {'error': str(state)}
+                    else:
+                        results[id(post_info)] = state
+            
+            await asyncio.gather(*(
+                process_channel(channel_ref, posts)
+                for channel_ref, posts in posts_by_channel.items()
+            ))
+            
+            # Собираем результат в исходном порядке ссылок
+            all_comments = []
+            posts_info = []
+            for post_info in parsed_posts:
+                result = results.get(id(post_info), {'error': 'Not processed'})
+                
+                if 'error' in result:
                     posts_info.append({
                         'post_info': post_info,
                         'comments_count': 0,
-                        'error': str(e)
+                        'error': result['error']
                     })
+                    continue
+                
+                post_comments = result['comments']
+                # Добавляем информацию о посте к каждому комментарию
+                for comment in post_comments:
+                    comment['source_post'] = post_info
+                
+                all_comments.extend(post_comments)
+                entry = {
+                    'post_info': post_info,
+                    'comments_count': len(post_comments)
+                }
+                if result.get('timed_out'):
+                    entry['timed_out'] = True
+                posts_info.append(entry)
+                
+                logger.info(f"Processed post {post_info['message_id']}: {len(post_comments)} comments")
             
             result = {
                 'comments': all_comments,
@@ -1265,7 +1821,10 @@ class TelegramService:
                 'processed_posts': len([p for p in posts_info if 'error' not in p])
             }
             
-            logger.info(f"Retrieved total {len(all_comments)} comments from {len(parsed_posts)} posts")
+            logger.info(
+                f"Retrieved total {len(all_comments)} comments from {len(parsed_posts)} posts "
+                f"in {len(posts_by_channel)} channels"
+            )
             return result
             
         except Exception as e:
@@ -1276,4 +1835,3 @@ class TelegramService:
                 'total_comments': 0,
                 'processed_posts': 0
             }
-        
\ No newline at end of file
@@ -0,0 +1,237 @@
+# backend/app/services/user_profile_cache.py
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from telethon import errors, utils
+from telethon.tl.functions.users import GetUsersRequest
+from telethon.tl.types import User
+
+from ..core.config import settings
+from ..core.repository import repository
+
+logger = logging.getLogger(__name__)
+
+# Лимит Telegram на количество пользователей в одном GetUsersRequest
+GET_USERS_BATCH_SIZE = 100
+
+
+def profile_from_entity(entity) -> Dict[str, Any]:
+    """Привести сущность Telegram (User/Channel) к профилю в формате telegram_users"""
+    return {
+        'telegram_id': str(entity.id),
+        'username': getattr(entity, 'username', None),
+        'first_name': getattr(entity, 'first_name', None),
+        'last_name': getattr(entity, 'last_name', None),
+        'is_bot': getattr(entity, 'bot', False) or False
+    }
+
+
+class UserProfileCache:
+    """Процессный LRU-кэш профилей пользователей с ограниченным временем жизни"""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._items: "OrderedDict[int, Tuple[float, Optional[Dict[str, Any]]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Вернуть (найдено, профиль). Профиль None означает 'известно, что недоступен'"""
+        item = self._items.get(user_id)
+        if item is None:
+            self.misses += 1
+            return False, None
+
+        expires_at, profile = item
+        if expires_at < time.monotonic():
+            del self._items[user_id]
+            self.misses += 1
+            return False, None
+
+        self._items.move_to_end(user_id)
+        self.hits += 1
+        return True, profile
+
+    def set(self, user_id: int, profile: Optional[Dict[str, Any]]):
+        self._items[user_id] = (time.monotonic() + self.ttl_seconds, profile)
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+class UserProfileResolver:
+    """
+    Пакетное получение профилей отправителей.
+
+    Порядок источников: кэш -> сущности, уже пришедшие вместе с сообщениями ->
+    таблица telegram_users -> GetUsersRequest пачками по 100 id.
+    Новые профили сохраняются в кэш и в telegram_users.
+    """
+
+    def __init__(self, cache: UserProfileCache):
+        self.cache = cache
+
+    async def resolve(
+        self,
+        client,
+        user_ids: Iterable[int],
+        known_entities: Optional[Dict[int, Any]] = None,
+        rate_limiter=None
+    ) -> Dict[int, Optional[Dict[str, Any]]]:
+        """
+        Получить профили для набора id
+
+        Args:
+            client: Подключенный TelegramClient
+            user_ids: id отправителей
+            known_entities: Сущности отправителей, уже доставленные с сообщениями (message.sender)
+            rate_limiter: TelegramRateLimiter аккаунта; GetUsersRequest расходует бюджет 'entity'
+
+        Returns:
+            Словарь id -> профиль (None, если профиль получить не удалось)
+        """
+        known_entities = known_entities or {}
+        profiles: Dict[int, Optional[Dict[str, Any]]] = {}
+        to_persist: List[Dict[str, Any]] = []
+        missing: List[int] = []
+
+        for user_id in set(user_ids):
+            if not user_id:
+                continue
+
+            found, profile = self.cache.get(user_id)
+            if found:
+                profiles[user_id] = profile
+                continue
+
+            entity = known_entities.get(user_id)
+            if entity is not None:
+                profile = profile_from_entity(entity)
+                self.cache.set(user_id, profile)
+                profiles[user_id] = profile
+                if isinstance(entity, User):
+                    to_persist.append(profile)
+                continue
+
+            missing.append(user_id)
+
+        if missing:
+            missing = await self._load_from_db(missing, profiles)
+
+        if missing:
+            fetched = await self._fetch_from_telegram(client, missing, profiles, rate_limiter)
+            to_persist.extend(fetched)
+
+        if to_persist:
+            await self._persist(to_persist)
+
+        return profiles
+
+    async def _load_from_db(self, user_ids: List[int], profiles: Dict[int, Optional[Dict[str, Any]]]) -> List[int]:
+        """Дочитать профили из telegram_users, вернуть id, которых там нет"""
+        try:
+            rows = await repository.get_users_by_telegram_ids([str(user_id) for user_id in user_ids])
+        except Exception as e:
+            logger.warning(f"Failed to load user profiles from database: {e}")
+            return user_ids
+
+        for row in rows:
+            user_id = int(row['telegram_id'])
+            profile = {
+                'telegram_id': str(row['telegram_id']),
+                'username': row.get('username'),
+                'first_name': row.get('first_name'),
+                'last_name': row.get('last_name'),
+                'is_bot': row.get('is_bot', False) or False
+            }
+            self.cache.set(user_id, profile)
+            profiles[user_id] = profile
+
+        return [user_id for user_id in user_ids if user_id not in profiles]
+
+    async def _fetch_from_telegram(
+        self,
+        client,
+        user_ids: List[int],
+        profiles: Dict[int, Optional[Dict[str, Any]]],
+        rate_limiter=None
+    ) -> List[Dict[str, Any]]:
+        """Запросить оставшиеся профили через GetUsersRequest пачками"""
+        input_users = []
+        input_ids = []
+        for user_id in user_ids:
+            if user_id < 0:
+                # Каналы и группы как отправители: без доставленной сущности профиля нет
+                self.cache.set(user_id, None)
+                profiles[user_id] = None
+                continue
+            try:
+                # get_input_entity берет access_hash из кэша сессии без RPC
+                input_users.append(utils.get_input_user(await client.get_input_entity(user_id)))
+                input_ids.append(user_id)
+            except Exception as e:
+                logger.warning(f"No access hash for user {user_id}: {e}")
+                self.cache.set(user_id, None)
+                profiles[user_id] = None
+
+        fetched = []
+        for start in range(0, len(input_users), GET_USERS_BATCH_SIZE):
+            batch = input_users[start:start + GET_USERS_BATCH_SIZE]
+            batch_ids = input_ids[start:start + GET_USERS_BATCH_SIZE]
+            try:
+                if rate_limiter is not None:
+                    await rate_limiter.acquire('entity')
+                users = await client(GetUsersRequest(id=batch))
+            except errors.FloodWaitError as e:
+                if rate_limiter is not None:
+                    rate_limiter.on_flood_wait('entity', e.seconds)
+                logger.warning(f"FloodWait {e.seconds}s on GetUsersRequest, skipping remaining batches")
+                break
+            except Exception as e:
+                logger.warning(f"GetUsersRequest failed for {len(batch)} users: {e}")
+                continue
+
+            for user in users:
+                if isinstance(user, User):
+                    profile = profile_from_entity(user)
+                    self.cache.set(user.id, profile)
+                    profiles[user.id] = profile
+                    fetched.append(profile)
+
+            # Недоступными кэшируем только тех, кого Telegram не вернул в успешном ответе;
+            # id из упавших и пропущенных пачек не кэшируем - их запросят в следующий раз
+            for user_id in batch_ids:
+                if user_id not in profiles:
+                    self.cache.set(user_id, None)
+                    profiles[user_id] = None
+
+        logger.debug(f"Resolved {len(fetched)} user profiles via GetUsersRequest")
+        return fetched
+
+    async def _persist(self, user_profiles: List[Dict[str, Any]]):
+        """Сохранить профили в telegram_users (без перезаписи is_moderator)"""
+        unique = {profile['telegram_id']: profile for profile in user_profiles}
+        try:
+            await repository.upsert_users(list(unique.values()))
+        except Exception as e:
+            logger.warning(f"Failed to persist {len(unique)} user profiles: {e}")
+
+
+# Глобальный экземпляр (общий для всех запросов процесса)
+user_profile_resolver = UserProfileResolver(
+    UserProfileCache(
+        max_size=settings.USER_PROFILE_CACHE_SIZE,
+        ttl_seconds=settings.USER_PROFILE_CACHE_TTL_SECONDS
+    )
+)
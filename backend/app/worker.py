@@ -0,0 +1,92 @@
+# backend/app/worker.py
+"""
+Отдельный процесс мониторинга клиентов: python -m app.worker
+
+Запускает SchedulerService (опрос или real-time обработку, анализ и уведомления)
+в собственном процессе с собственным event loop и клиентом Telethon, чтобы
+тяжелые запросы анализа в API и фоновый мониторинг не мешали друг другу.
+В API при этом выставляется RUN_SCHEDULER_IN_API=False.
+
+С API процесс общается только через БД: настройки и шаблоны читаются из
+monitoring_settings/product_templates, изменения настроек замечаются по
+updated_at (MONITORING_SETTINGS_POLL_SECONDS), найденные клиенты пишутся
+в potential_clients. Несколько воркеров делят пользователей через
+аренду scheduler_leases (SCHEDULER_LEASE_ENABLED).
+"""
+import asyncio
+import logging
+import signal
+
+from .core.config import settings
+
+# Своя сессия Telegram: одну StringSession нельзя одновременно использовать
+# из двух процессов. Подменяем до создания TelegramService.
+if settings.WORKER_TELEGRAM_SESSION_STRINGS:
+    settings.TELEGRAM_SESSION_STRING = None
+    settings.TELEGRAM_SESSION_STRINGS = settings.WORKER_TELEGRAM_SESSION_STRINGS
+
+from .core.repository import repository
+from .services.message_cache import message_cache
+from .services.scheduler_service import scheduler_service
+from .services.telegram_service import TelegramService
+
+logger = logging.getLogger(__name__)
+
+
+async def run_worker():
+    """Запустить планировщик и работать до SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка по KeyboardInterrupt
+            pass
+
+    print("🚀 WORKER: Starting monitoring worker...")
+    logger.info("Starting monitoring worker...")
+    if not settings.WORKER_TELEGRAM_SESSION_STRINGS:
+        logger.warning(
+            "WORKER_TELEGRAM_SESSION_STRINGS is not set: the worker shares Telegram sessions with the API, "
+            "run them together only if the API does not use Telegram"
+        )
+
+    try:
+        await scheduler_service.start()
+        print("✅ WORKER: Monitoring worker started")
+        logger.info("Monitoring worker started")
+        await stop_event.wait()
+    finally:
+        print("🛑 WORKER: Shutting down monitoring worker...")
+        logger.info("Shutting down monitoring worker...")
+
+        await scheduler_service.stop()
+
+        try:
+            await asyncio.wait_for(TelegramService().close(), timeout=5.0)
+        except asyncio.TimeoutError:
+            logger.warning("Timeout occurred while closing Telegram client, forcing shutdown")
+        except Exception as e:
+            logger.error(f"Error closing Telegram client: {e}")
+
+        repository.shutdown()
+        if message_cache is not None:
+            message_cache.close()
+
+        print("✅ WORKER: Monitoring worker stopped")
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    try:
+        asyncio.run(run_worker())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()